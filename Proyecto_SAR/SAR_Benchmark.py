@@ -0,0 +1,918 @@
+import argparse
+import bisect
+import json
+import os
+import random
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from array import array
+
+from SAR_Client import SearchClient
+from SAR_lib import (SAR_Project, STORED_FIELDS, as_array, bm25_scale, decode_impacts, iter_news,
+                     news_files, rotate)
+
+
+def random_posting(size, universe, rng):
+    """
+    Genera una posting list sintetica: "size" newids distintos y ordenados menores que "universe".
+
+    """
+    return array('I', sorted(rng.sample(range(universe), size)))
+
+
+def best_time(fnc, repeat):
+    """
+    Ejecuta "fnc" "repeat" veces y devuelve el mejor tiempo (en segundos) y el ultimo resultado.
+
+    """
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fnc()
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def bench_postings(args):
+    """
+    Micro-benchmark de and_posting, or_posting, minus_posting y del AND n-ario con los
+    motores 'python' y 'numpy' sobre posting lists sinteticas de tamaños equilibrados y
+    descompensados. Comprueba que ambos motores devuelven lo mismo.
+
+    """
+    rng = random.Random(args.seed)
+    universe = args.universe
+    cases = [('balanced', (10000, 10000)), ('balanced', (100000, 100000)),
+             ('skewed', (100, 100000)), ('skewed', (1000, 1000000)),
+             ('n-way', (1000, 100000, 1000000))]
+    project = SAR_Project()
+
+    print("%-6s %-9s %-22s %12s %12s %9s" % ('op', 'case', 'sizes', 'python (ms)', 'numpy (ms)', 'speedup'))
+    for case, sizes in cases:
+        postings = [random_posting(size, universe, rng) for size in sizes]
+        if case == 'n-way':
+            ops = [('AND', lambda: project.and_many(postings),
+                    lambda: fold(project.and_posting, postings))]
+        else:
+            p1, p2 = postings
+            ops = [(name, lambda f=f: f(p1, p2), lambda f=f: f(p1, p2))
+                   for name, f in (('AND', project.and_posting), ('OR', project.or_posting),
+                                   ('MINUS', project.minus_posting))]
+        for name, numpy_call, python_call in ops:
+            project.set_engine('python')
+            t_python, r_python = best_time(python_call, args.repeat)
+            project.set_engine('numpy')
+            t_numpy, r_numpy = best_time(numpy_call, args.repeat)
+            if as_array(r_python) != as_array(r_numpy):
+                print("==> ERROR: different results for %s %s" % (name, sizes))
+                sys.exit(-1)
+            print("%-6s %-9s %-22s %12.3f %12.3f %8.1fx" % (name, case, 'x'.join(map(str, sizes)),
+                                                             t_python * 1000, t_numpy * 1000,
+                                                             t_python / t_numpy))
+
+
+def random_wildcard(term, rng):
+    """
+    Genera un patron con un comodin a partir de un termino: 'pre*', '*suf', 'pre*suf' o 'pre?suf'.
+
+    """
+    i = rng.randrange(len(term) + 1)
+    kind = rng.choice('*?') if i < len(term) else '*'
+    if kind == '?':
+        return term[:i] + '?' + term[i + 1:]
+    j = rng.randrange(i, len(term) + 1)
+    return term[:i] + '*' + term[j:]
+
+
+def bench_permuterm(args):
+    """
+    Memoria y latencia por comodin del indice permuterm: array ordenado de rotaciones del lexicon
+    compartido con busqueda binaria (filtrando los terminos de cada campo) frente a un diccionario
+    rotacion --> termino por campo (memoria) y frente a recorrer todo el diccionario de terminos
+    del campo con una expresion regular (latencia). Comprueba que ambas busquedas devuelven los
+    mismos terminos.
+
+    """
+    project = SAR_Project.load(args.index)
+    if not project.permuterm:
+        print("==> ERROR: '%s' has no permuterm index (use SAR_Indexer.py -P)" % args.index)
+        sys.exit(-1)
+    rng = random.Random(args.seed)
+    ptindex = project.get_ptindex()
+
+    print("%-9s %10s %10s %18s %18s" % ('field', 'rotations', 'dict (MB)',
+                                        'bisect p50/mean us', 'scan p50/mean us'))
+    for field, _ in project.indexed_fields:
+        if field == 'date' and project.dindex is not None:
+            # las fechas no se rotan, se buscan en el indice de fechas (DateIndex)
+            print("%-9s %10s" % (field, 'date index, not in the permuterm'))
+            continue
+        terms = list(project.index[field])
+
+        tracemalloc.start()
+        rotations = {rotate(term, r): term for term in terms for r in range(len(term) + 1)}
+        dict_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        patterns = [random_wildcard(rng.choice(terms), rng) for _ in range(args.patterns)]
+        t_bisect, t_scan = [], []
+        for pattern in patterns:
+            t0 = time.perf_counter()
+            found = project.permuterm_terms(pattern, field)
+            t1 = time.perf_counter()
+            regex = re.compile(re.escape(pattern).replace(r'\*', '.*').replace(r'\?', '.'))
+            scanned = [term for term in terms if regex.fullmatch(term)]
+            t2 = time.perf_counter()
+            if sorted(found) != scanned:
+                print("==> ERROR: different terms for '%s' in '%s'" % (pattern, field))
+                sys.exit(-1)
+            t_bisect.append(t1 - t0)
+            t_scan.append(t2 - t1)
+
+        print("%-9s %10d %10.2f %8.1f / %7.1f %8.1f / %7.1f" % (
+            field, len(rotations), dict_bytes / 2**20,
+            statistics.median(t_bisect) * 1e6, statistics.mean(t_bisect) * 1e6,
+            statistics.median(t_scan) * 1e6, statistics.mean(t_scan) * 1e6))
+        del rotations
+    print("shared permuterm: %d rotations, %.2f MB" % (len(ptindex), ptindex.nbytes() / 2**20))
+
+
+def bench_stemming(args):
+    """
+    Tiempo de las consultas con stemming usando las posting lists precalculadas de cada stem
+    frente a unir en cada consulta las posting lists de todos los terminos con ese stem.
+    Se mide la obtencion de la posting list de cada termino de las consultas (get_stemming), que es
+    lo unico que cambia, y las consultas completas, que incluyen ademas los comodines y las
+    conectivas. En frio cada termino o consulta se resuelve una vez sobre el indice recien cargado
+    (incluye decodificar las posting lists), en caliente se toma el mejor de "repeat" intentos.
+    Las consultas con frases se omiten porque el stemming no se aplica a las frases.
+
+    """
+    with open(args.queries, encoding='utf-8') as fh:
+        queries = [line for line in fh.read().split('\n')
+                   if line and not line.startswith('#') and '"' not in line]
+
+    times, results = {}, {}
+    for mode in ('union of terms', 'precomputed stems'):
+        project = SAR_Project.load(args.index)
+        if not project.stemming:
+            print("==> ERROR: '%s' has no stem index (use SAR_Indexer.py -S)" % args.index)
+            sys.exit(-1)
+        project.set_stemming(True)
+        project.set_cache(0)
+        if mode == 'union of terms':
+            project.get_stemming = union_stemming(project)
+        leaves = list(dict.fromkeys(leaf for query in queries for leaf in query_leaves(project.parse_query(query))))
+        results[mode] = []
+        t0 = time.perf_counter()
+        for _, field, term in leaves:
+            results[mode].append(as_array(project.get_stemming(term, field)))
+        terms_cold = time.perf_counter() - t0
+        terms_warm = best_time(lambda: [project.get_stemming(term, field) for _, field, term in leaves],
+                               args.repeat)[0]
+        cold = warm = 0
+        for query in queries:
+            t0 = time.perf_counter()
+            project.solve_query(query)
+            cold += time.perf_counter() - t0
+            t, result = best_time(lambda: project.solve_query(query), args.repeat)
+            warm += t
+            results[mode].append(as_array(result))
+        times[mode] = terms_cold, terms_warm, cold, warm
+
+    for query, r_union, r_stem in zip(leaves + queries, *results.values()):
+        if r_union != r_stem:
+            print("==> ERROR: different results for '%s'" % (query,))
+            sys.exit(-1)
+
+    print("%d queries with stemming, %d distinct terms" % (len(queries), len(leaves)))
+    print("%-20s %12s %12s %12s %12s" % ('', 'terms cold', 'terms warm', 'queries cold', 'queries warm'))
+    for mode, measures in times.items():
+        print("%-20s" % mode + "".join(" %9.2f ms" % (t * 1000) for t in measures))
+    print("%-20s" % 'speedup' + "".join(" %11.1fx" % (union / max(stem, 1e-9))
+                                        for union, stem in zip(*times.values())))
+
+
+def query_leaves(node):
+    """
+    Recorre los terminos simples ('term', campo, termino) del arbol sintactico de una query.
+
+    """
+    if node[0] == 'term':
+        yield node
+    elif node[0] == 'not':
+        yield from query_leaves(node[1])
+    elif node[0] in ('and', 'or'):
+        for child in node[1]:
+            yield from query_leaves(child)
+
+
+def union_stemming(project):
+    """
+    Devuelve una version de get_stemming sin posting lists por stem: une en cada consulta
+    las posting lists de todos los terminos del campo que tienen el mismo stem.
+
+    """
+    by_stem = {}
+    for field, _ in project.indexed_fields:
+        by_stem[field] = {}
+        for term in project.index[field]:
+            by_stem[field].setdefault(project.stem(term), []).append(term)
+
+    def get_stemming(term, field='article'):
+        answer = array('I')
+        for t in by_stem[field].get(project.stem(term), []):
+            answer = project.or_posting(answer, project.posting_list(project.index[field][t]))
+        return answer
+
+    return get_stemming
+
+
+PHRASES = ['fin de semana', 'medalla de oro', 'el país', 'de la', 'uno de los', 'a lo largo de',
+           'el gobierno de', 'en el que', 'por el', 'de que el']
+
+
+def naive_positionals(project, terms, field='article'):
+    """
+    Frase sin el motor posicional: AND de los newids de todos los terminos y, en cada noticia,
+    comparacion de todas las posiciones del primer termino con todas las de los demas.
+
+    """
+    postings = [project.index[field].get(term) for term in terms]
+    if any(posting is None for posting in postings):
+        return array('I')
+    newids = postings[0].newids
+    for posting in postings[1:]:
+        newids = project.and_posting(newids, posting.newids)
+    res = array('I')
+    for newid in newids:
+        lists = [p.positions(bisect.bisect_left(p.newids, newid)) for p in postings]
+        for start in lists[0]:
+            if all(any(q == start + k for q in positions) for k, positions in enumerate(lists[1:], 1)):
+                res.append(newid)
+                break
+    return res
+
+
+def bench_phrases(args):
+    """
+    Tiempo de get_positionals frente a la version ingenua (naive_positionals) en frases
+    con palabras muy frecuentes como 'de' o 'el'. Comprueba que ambas devuelven lo mismo.
+
+    """
+    project = SAR_Project.load(args.index)
+    if not project.positional:
+        print("==> ERROR: '%s' has no positional index (use SAR_Indexer.py -O)" % args.index)
+        sys.exit(-1)
+    phrases = args.phrase or PHRASES
+
+    print("%-16s %20s %8s %12s %14s %9s" % ('phrase', 'df of terms', 'results', 'naive (ms)',
+                                            'positional (ms)', 'speedup'))
+    for phrase in phrases:
+        terms = project.tokenize(phrase)
+        t_naive, r_naive = best_time(lambda: naive_positionals(project, terms), args.repeat)
+        t_fast, r_fast = best_time(lambda: project.get_positionals(terms), args.repeat)
+        if as_array(r_naive) != as_array(r_fast):
+            print("==> ERROR: different results for '%s'" % phrase)
+            sys.exit(-1)
+        dfs = '/'.join(str(len(project.index['article'].get(term) or ())) for term in terms)
+        print("%-16s %20s %8d %12.2f %14.2f %8.1fx" % (phrase, dfs, len(r_fast), t_naive * 1000,
+                                                     t_fast * 1000, t_naive / t_fast))
+
+
+RANKED_QUERIES = ['de', 'el', 'de OR la', 'de AND el', 'el país', 'gobierno OR madrid OR españa',
+                  'de AND NOT medalla', 'fin de semana', '"fin de semana"', 'medalla de oro']
+
+
+def rank_all(project, result, query, k):
+    """
+    Ranking sin terminacion temprana: puntua todas las noticias del resultado y las ordena.
+
+    """
+    terms = {(name, key): index for name, key, index
+             in project.scoring_terms(project.optimize_query(project.parse_query(query)))}
+    lists = [(index[key].newids, decode_impacts(project.weight[name][key])[1])
+             for (name, key), index in terms.items() if key in index]
+    scores = []
+    for newid in result:
+        score = 0
+        for newids, impacts in lists:
+            i = bisect.bisect_left(newids, newid)
+            if i < len(newids) and newids[i] == newid:
+                score += impacts[i]
+        scores.append((score, newid))
+    scores.sort(key=lambda entry: (-entry[0], entry[1]))
+    return [(newid, score) for score, newid in scores[:k]]
+
+
+def bench_ranking(args):
+    """
+    Latencia del ranking (-R) con top_k frente a puntuar y ordenar todo el resultado.
+    Comprueba que las puntuaciones de las k mejores noticias coinciden.
+
+    """
+    project = SAR_Project.load(args.index)
+    project.set_cache(0)
+    queries = args.query or RANKED_QUERIES
+    k = args.k
+
+    print("%-30s %8s %12s %12s %9s" % ('query', 'results', 'all (ms)', 'top-k (ms)', 'speedup'))
+    for query in queries:
+        result = project.solve_query(query)
+        t_all, r_all = best_time(lambda: rank_all(project, result, query, k), args.repeat)
+        t_top, r_top = best_time(lambda: project.rank_result(result, query, k), args.repeat)
+        scale = bm25_scale(len(project.news))
+        if [round(score) for _, score in r_all] != [round(score * scale) for _, score in r_top]:
+            print("==> ERROR: different scores for '%s'" % query)
+            sys.exit(-1)
+        print("%-30s %8d %12.3f %12.3f %8.1fx" % (query, len(result), t_all * 1000, t_top * 1000,
+                                                 t_all / t_top))
+
+
+STORE_QUERIES = ['país', 'fin AND semana', 'gobierno OR madrid', 'medalla NOT oro']
+
+
+def show_json(project, newid, terms):
+    """
+    Noticia y snippet sin almacen de documentos: se abre y se parsea todo su fichero JSON y
+    se vuelve a tokenizar el cuerpo para recortar el snippet.
+
+    """
+    docid, pos = project.news[newid]
+    with open(project.docs[docid]) as fh:
+        new = json.load(fh)[pos]
+    new['bounds'] = array('I', [bound for m in project.tokenizer.finditer(new['article'])
+                                for bound in m.span()])
+    return new, project.make_snippet(new, newid, terms)
+
+
+def show_store(project, newid, terms):
+    """
+    Noticia y snippet leidos del almacen de documentos.
+
+    """
+    new = project.fetch_news(newid)
+    return new, project.make_snippet(new, newid, terms)
+
+
+def bench_store(args):
+    """
+    Latencia de mostrar las noticias de un resultado con snippet (-N) leyendolas del almacen
+    de documentos frente a parsear su fichero JSON. Comprueba que los snippets coinciden.
+
+    """
+    project = SAR_Project.load(args.index)
+    if project.store is None:
+        print("==> ERROR: the index has no document store")
+        sys.exit(-1)
+    queries = args.query or STORE_QUERIES
+
+    print("%-20s %8s %12s %12s %9s" % ('query', 'shown', 'json (ms)', 'store (ms)', 'speedup'))
+    for query in queries:
+        shown = list(project.solve_query(query))[:args.show]
+        terms = project.get_query_terms(query)
+        t_json, r_json = best_time(lambda: [show_json(project, newid, terms) for newid in shown], args.repeat)
+        t_store, r_store = best_time(lambda: [show_store(project, newid, terms) for newid in shown], args.repeat)
+        for (a, snippet_a), (b, snippet_b) in zip(r_json, r_store):
+            if snippet_a != snippet_b or any(a.get(field, '') != b[field] for field in STORED_FIELDS):
+                print("==> ERROR: different news for '%s'" % query)
+                sys.exit(-1)
+        print("%-20s %8d %12.3f %12.3f %8.1fx" % (query, len(shown), t_json * 1000, t_store * 1000,
+                                                 t_json / t_store))
+
+
+def run_clients(unix, requests, clients):
+    """
+    Reparte "requests" entre "clients" clientes concurrentes, cada uno con su conexion y
+    enviando sus peticiones sin esperar las respuestas.
+
+    return: tupla (segundos, numero de respuestas con error)
+
+    """
+    shares = [requests[i::clients] for i in range(clients)]
+    errors = [0] * clients
+
+    def work(i):
+        client = SearchClient(unix=unix)
+        errors[i] = sum(not response['ok'] for response in client.ask(shares[i]))
+        client.close()
+
+    threads = [threading.Thread(target=work, args=(i,)) for i in range(clients)]
+    t0 = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - t0, sum(errors)
+
+
+def bench_server(args):
+    """
+    Rendimiento (queries/s) del servidor de consultas con varios clientes concurrentes frente a
+    lanzar SAR_Searcher.py para cada query, que carga el indice cada vez.
+
+    """
+    with open(args.queries, encoding='utf-8') as fh:
+        queries = [line for line in fh.read().split('\n') if line and not line.startswith('#')]
+    requests = [{'op': args.op, 'query': query} for query in queries] * args.repeat
+
+    oneshot = []
+    flag = '-C' if args.op == 'count' else '-R' if args.op == 'rank' else '-Q'
+    for query in queries[:args.oneshot]:
+        command = [sys.executable, 'SAR_Searcher.py', args.index, '-Q', query]
+        if flag != '-Q':
+            command.append(flag)
+        t0 = time.perf_counter()
+        subprocess.run(command, stdout=subprocess.DEVNULL, check=True)
+        oneshot.append(time.perf_counter() - t0)
+    print("one-shot SAR_Searcher.py: %.1f queries/s (%d queries)" % (len(oneshot) / sum(oneshot), len(oneshot)))
+
+    unix = os.path.join(tempfile.mkdtemp(prefix='sar_server_'), 'sar.sock')
+    server = subprocess.Popen([sys.executable, 'SAR_Server.py', args.index, '--unix', unix,
+                               '-w', str(args.workers)], stdout=subprocess.PIPE, text=True)
+    try:
+        server.stdout.readline()  # 'listening on ...' cuando el indice esta cargado
+        # la primera pasada llena la cache de cada worker, como en un servidor ya en marcha
+        run_clients(unix, requests, 1)
+        print("%-8s %10s %12s" % ('clients', 'seconds', 'queries/s'))
+        for clients in args.clients:
+            elapsed, errors = run_clients(unix, requests, clients)
+            if errors:
+                print("==> ERROR: %d failed requests" % errors)
+                sys.exit(-1)
+            print("%-8d %10.3f %12.1f" % (clients, elapsed, len(requests) / elapsed))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def evict(filenames):
+    """
+    Saca los ficheros de la cache de paginas del sistema operativo (posix_fadvise), para medir
+    la lectura en frio sin permisos para vaciar toda la cache.
+
+    """
+    for filename in filenames:
+        fd = os.open(filename, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+
+def load_news(filename, data=None):
+    """
+    Lectura de noticias anterior a la ingestion incremental: json.load de todo el fichero.
+
+    """
+    with open(filename) as fh:
+        return iter(json.load(fh))
+
+
+def stream_news(filename, data=None):
+    """
+    Ingestion incremental con JSONDecoder.raw_decode (ver iter_news).
+
+    """
+    if data is None:
+        with open(filename, 'rb') as fh:
+            data = fh.read()
+    return iter_news(data)
+
+
+def ingest(corpus, read_news, prefetch, index):
+    """
+    Lee todas las noticias de "corpus" como SAR_Project.index_dir y, si "index" es True,
+    tambien las indexa (solo 'article', sin ampliaciones). "read_news" sustituye a
+    SAR_Project.read_news, None para usar el de la clase.
+
+    return: tupla (segundos, SAR_Project o numero de noticias leidas)
+
+    """
+    project = SAR_Project()
+    if read_news is not None:
+        project.read_news = read_news
+    t0 = time.perf_counter()
+    if index:
+        project.index_dir(corpus, multifield=False, positional=False, stem=False, permuterm=False,
+                          prefetch=prefetch)
+        return time.perf_counter() - t0, project
+    project.prefetch = prefetch
+    count = 0
+    for filename, data in project.read_files(news_files(corpus)):
+        for _ in project.read_news(filename, data):
+            count += 1
+    return time.perf_counter() - t0, count
+
+
+def bench_ingest(args):
+    """
+    Rendimiento de la lectura de las noticias: json.load de cada fichero (como antes) frente al
+    parseo incremental con raw_decode, leyendo los ficheros en el hilo de indexacion o por delante
+    en otro hilo (read_ahead). Se mide solo la lectura y la indexacion completa, con la cache de
+    paginas en frio (los ficheros se sacan de la cache antes de cada intento) y en caliente.
+    Comprueba que todos indexan lo mismo.
+
+    """
+    filenames = list(news_files(args.corpus))
+    megabytes = sum(os.path.getsize(filename) for filename in filenames) / 2**20
+    modes = [('json.load', load_news, 0), ('raw_decode', stream_news, 0),
+             ('raw_decode + read-ahead', stream_news, args.prefetch)]
+
+    print("%d files, %.1f MB" % (len(filenames), megabytes))
+    print("%-26s %-5s %12s %12s %12s" % ('mode', 'cache', 'read (MB/s)', 'index (s)', 'news/s'))
+    reference = None
+    for name, read_news, prefetch in modes:
+        for cache in ('cold', 'warm'):
+            t_read = t_index = None
+            for _ in range(args.repeat):
+                if cache == 'cold':
+                    evict(filenames)
+                else:
+                    ingest(args.corpus, read_news, prefetch, False)
+                t, _ = ingest(args.corpus, read_news, prefetch, False)
+                t_read = t if t_read is None else min(t_read, t)
+                if cache == 'cold':
+                    evict(filenames)
+                t, project = ingest(args.corpus, read_news, prefetch, True)
+                t_index = t if t_index is None else min(t_index, t)
+            summary = (project.news_counter, project.tokens_indexed, project.lengths['article'])
+            if reference is None:
+                reference = summary
+            elif summary != reference:
+                print("==> ERROR: '%s' indexes different news" % name)
+                sys.exit(-1)
+            print("%-26s %-5s %12.1f %12.3f %12.0f" % (name, cache, megabytes / t_read, t_index,
+                                                       project.news_counter / t_index))
+
+
+SHARD_QUERIES = ['cultura AND date:2016-01-21', 'date:2015-03-1*', 'guerra AND date:201*10', 'economía',
+                 'fin AND de AND semana', '"fin de semana"', 'NOT isla', 'keywords:precio OR keywords:economía']
+
+
+def bench_shards(args):
+    """
+    Latencia de las queries en un indice con shards (SAR_Indexer.py --shard), resueltos en
+    "--workers" procesos, frente al indice completo de las mismas noticias, con la cache
+    desactivada, y numero de shards que abre cada query empezando con todos cerrados. Comprueba
+    que los resultados coinciden.
+
+    """
+    queries = args.query or SHARD_QUERIES
+    full = SAR_Project.load(args.index)
+    full.set_cache(0)
+    sharded = SAR_Project.load(args.sharded)
+    if not hasattr(sharded, 'shards'):
+        print("==> ERROR: '%s' is not a sharded index (use SAR_Indexer.py --shard)" % args.sharded)
+        sys.exit(-1)
+    if args.workers is not None:
+        sharded.set_workers(args.workers)
+
+    print("%-40s %8s %8s %12s %12s %9s" % ('query', 'results', 'shards', 'full (ms)', 'shards (ms)', 'speedup'))
+    for query in queries:
+        fresh = SAR_Project.load(args.sharded)
+        # en este proceso, para ver que shards se abren
+        fresh.set_workers(1)
+        fresh.solve_query(query)
+        opened = sum(project is not None for project in fresh.projects)
+        sharded.set_cache(0)
+        t_full, r_full = best_time(lambda: full.solve_query(query), args.repeat)
+        t_sharded, r_sharded = best_time(lambda: sharded.solve_query(query), args.repeat)
+        if as_array(r_full) != as_array(r_sharded):
+            print("==> ERROR: different results for '%s'" % query)
+            sys.exit(-1)
+        print("%-40s %8d %4d/%-3d %12.3f %12.3f %8.1fx" % (query, len(r_full), opened, len(fresh.shards),
+                                                         t_full * 1000, t_sharded * 1000, t_full / t_sharded))
+
+
+QUERY_CLASSES = ('term', 'boolean', 'field', 'phrase', 'wildcard')
+
+
+def query_class(query):
+    """
+    Clase de una query para agrupar sus latencias, la primera que se cumpla de: comodin
+    ('wildcard'), frase ('phrase'), campo ('field'), operadores o parentesis ('boolean') y
+    terminos sueltos ('term').
+
+    """
+    if '*' in query or '?' in query:
+        return 'wildcard'
+    if '"' in query:
+        return 'phrase'
+    if re.search(r'\w:', query):
+        return 'field'
+    if re.search(r'\b(AND|OR|NOT)\b|[()]', query):
+        return 'boolean'
+    return 'term'
+
+
+def percentile(values, p):
+    """
+    Percentil "p" (0-100) por rango mas cercano de una lista no vacia.
+
+    """
+    values = sorted(values)
+    return values[max(0, min(len(values), -(-len(values) * p // 100)) - 1)]
+
+
+def read_reference(filename):
+    """
+    Lee un fichero references/result_*.txt.
+
+    return: lista de tuplas (query, numero de resultados)
+
+    """
+    with open(filename, encoding='utf-8') as fh:
+        lines = [line.split('\t') for line in fh.read().split('\n') if line and not line.startswith('#')]
+    return [(query, int(count)) for query, count in lines]
+
+
+def run_indexer(corpus, index, flags):
+    """
+    Indexa "corpus" con SAR_Indexer.py en otro proceso.
+
+    return: diccionario con el tiempo total, los tiempos de indexado y guardado que imprime el
+            indexador y el pico de memoria residente del proceso (MB)
+
+    """
+    command = [sys.executable, 'SAR_Indexer.py', corpus, index] + ['-' + flag for flag in flags]
+    t0 = time.perf_counter()
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    output = process.stdout.read()
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - t0
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        raise RuntimeError("'%s' failed with status %d" % (' '.join(command), process.returncode))
+    stages = dict((name, float(seconds)) for name, seconds in re.findall(r'Time (\w+): ([\d.]+)s', output))
+    # ru_maxrss esta en KB en Linux
+    return {'seconds': elapsed, 'indexing': stages.get('indexing'), 'saving': stages.get('saving'),
+            'peak_rss_mb': usage.ru_maxrss / 1024}
+
+
+def query_latencies(project, tests, repeat, stemming):
+    """
+    Resuelve cada query "repeat" veces sin cache y comprueba su numero de resultados.
+
+    return: tupla (latencias por clase en segundos, lista de errores)
+
+    """
+    project.set_stemming(stemming)
+    latencies = {}
+    errors = []
+    for query, reference in tests:
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            count = len(project.solve_query(query))
+            latencies.setdefault(query_class(query), []).append(time.perf_counter() - t0)
+        if count != reference:
+            errors.append({'query': query, 'stemming': stemming, 'result': count, 'reference': reference})
+    project.set_stemming(False)
+    return latencies, errors
+
+
+def latency_summary(latencies):
+    return {name: {'samples': len(samples), 'p50_ms': percentile(samples, 50) * 1000,
+                   'p95_ms': percentile(samples, 95) * 1000, 'p99_ms': percentile(samples, 99) * 1000}
+            for name, samples in sorted(latencies.items(), key=lambda item: QUERY_CLASSES.index(item[0]))}
+
+
+def bench_suite_run(corpus, flags, workdir, repeat):
+    """
+    Indexa "corpus" con "flags" y mide el indice resultante: tamaño, tiempo de carga y latencia
+    de las queries de referencia por clase, comprobando sus resultados.
+
+    Las queries 'full' solo son validas con -M y -O; sin ellos se usan las 'minimo'. Con -S se
+    comprueban tambien las queries con stemming.
+
+    """
+    year = os.path.basename(os.path.normpath(corpus))
+    index = os.path.join(workdir, '%s_%s.bin' % (year, flags or 'none'))
+    run = {'corpus': corpus, 'flags': flags}
+    run['indexing'] = run_indexer(corpus, index, flags)
+    run['index_mb'] = os.path.getsize(index) / 2**20
+
+    loads = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        project = SAR_Project.load(index)
+        loads.append(time.perf_counter() - t0)
+    run['load_seconds'] = statistics.median(loads)
+
+    project.set_cache(0)
+    queries = 'full' if 'M' in flags and 'O' in flags else 'minimo'
+    run['queries'] = queries
+    run['errors'] = []
+    for stemming in (False, True) if 'S' in flags else (False,):
+        reference = 'references/result_%s_%s%s.txt' % (year, queries, '_stemming' if stemming else '')
+        if not os.path.exists(reference):
+            continue
+        latencies, errors = query_latencies(project, read_reference(reference), repeat, stemming)
+        run['latency_stemming' if stemming else 'latency'] = latency_summary(latencies)
+        run['errors'].extend(errors)
+    return run
+
+
+def show_suite_run(run, previous=None):
+    """
+    Imprime una ejecucion del benchmark y, si se da, el cociente de cada valor respecto al de la
+    misma ejecucion en un fichero de resultados anterior.
+
+    """
+    flat = flatten_run(run)
+    previous = previous or {}
+
+    def value(key, fmt):
+        before = previous.get(key)
+        return fmt % flat[key] + (' (x%.2f)' % (flat[key] / before) if before else '')
+
+    print("%s %s: indexing %s, peak %s, index %s, load %s" % (
+        run['corpus'], '-' + run['flags'] if run['flags'] else 'none', value('indexing_seconds', '%.2fs'), value('peak_rss_mb', '%.1f MB'),
+        value('index_mb', '%.1f MB'), value('load_ms', '%.1f ms')))
+    for key in ('latency', 'latency_stemming'):
+        for name, stats in run.get(key, {}).items():
+            print("    %-17s %-9s %4d samples  p50 %8.3f ms  p95 %s  p99 %8.3f ms" % (
+                key, name, stats['samples'], stats['p50_ms'], value('%s:%s' % (key, name), '%8.3f ms'),
+                stats['p99_ms']))
+    for error in run['errors']:
+        print("==> ERROR: '%s'%s\t%d\t%d" % (error['query'], ' (stemming)' if error['stemming'] else '',
+                                            error['result'], error['reference']))
+
+
+def flatten_run(run):
+    """
+    Valores de una ejecucion guardada que se comparan con la ejecucion actual.
+
+    """
+    flat = {'indexing_seconds': run['indexing']['seconds'], 'peak_rss_mb': run['indexing']['peak_rss_mb'],
+            'index_mb': run['index_mb'], 'load_ms': run['load_seconds'] * 1000}
+    for key in ('latency', 'latency_stemming'):
+        for name, stats in run.get(key, {}).items():
+            flat['%s:%s' % (key, name)] = stats['p95_ms']
+    return flat
+
+
+def bench_suite(args):
+    """
+    Benchmark completo y reproducible: para cada coleccion y combinacion de opciones de
+    SAR_Indexer.py mide el tiempo y el pico de memoria de indexar, el tamaño del indice, su tiempo
+    de carga y los percentiles p50/p95/p99 de latencia de cada clase de query de references/,
+    comprobando los resultados. Guarda todo en JSON para comparar ejecuciones.
+
+    """
+    previous = {}
+    if args.compare is not None:
+        with open(args.compare, encoding='utf-8') as fh:
+            previous = {(run['corpus'], run['flags']): flatten_run(run) for run in json.load(fh)['runs']}
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    results = {'date': time.strftime('%Y-%m-%dT%H:%M:%S'), 'commit': commit, 'python': sys.version.split()[0],
+               'platform': sys.platform, 'cpus': os.cpu_count(), 'repeat': args.repeat, 'runs': []}
+
+    workdir = tempfile.mkdtemp(prefix='sar_suite_')
+    try:
+        for corpus in args.corpora:
+            for flags in args.flags:
+                flags = '' if flags == 'none' else flags.lstrip('-').upper()
+                run = bench_suite_run(corpus, flags, workdir, args.repeat)
+                results['runs'].append(run)
+                show_suite_run(run, previous.get((corpus, flags)))
+    finally:
+        for name in os.listdir(workdir):
+            os.remove(os.path.join(workdir, name))
+        os.rmdir(workdir)
+
+    with open(args.output, 'w', encoding='utf-8') as fh:
+        json.dump(results, fh, indent=2, ensure_ascii=False)
+    print("results saved in '%s'" % args.output)
+    if any(run['errors'] for run in results['runs']):
+        sys.exit(-1)
+
+
+def fold(fnc, postings):
+    """
+    Aplica una operacion binaria de posting lists de izquierda a derecha.
+
+    """
+    answer = postings[0]
+    for p in postings[1:]:
+        answer = fnc(answer, p)
+    return answer
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Benchmarks of the indexer and the searcher.')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    postings = subparsers.add_parser('postings', help='posting list merges, python vs numpy engine.')
+    postings.add_argument('--universe', type=int, default=2000000,
+                          help='number of news of the synthetic collection.')
+    postings.add_argument('--repeat', type=int, default=3,
+                          help='repetitions of each measure, the best one is reported.')
+    postings.add_argument('--seed', type=int, default=0,
+                          help='seed for the synthetic posting lists.')
+    postings.set_defaults(run=bench_postings)
+
+    permuterm = subparsers.add_parser('permuterm', help='permuterm index memory and wildcard latency per field.')
+    permuterm.add_argument('index', type=str, help='index built with SAR_Indexer.py -P.')
+    permuterm.add_argument('--patterns', type=int, default=200,
+                           help='number of random wildcards per field.')
+    permuterm.add_argument('--seed', type=int, default=0,
+                           help='seed for the random wildcards.')
+    permuterm.set_defaults(run=bench_permuterm)
+
+    stemming = subparsers.add_parser('stemming', help='queries with stemming, precomputed stem postings vs. union of terms.')
+    stemming.add_argument('index', type=str, help='index built with SAR_Indexer.py -S.')
+    stemming.add_argument('--queries', type=str, default='references/queries_full.txt',
+                          help='file with queries.')
+    stemming.add_argument('--repeat', type=int, default=3,
+                          help='repetitions of each query, the best one is reported.')
+    stemming.set_defaults(run=bench_stemming)
+
+    phrases = subparsers.add_parser('phrases', help='phrase queries, positional intersection vs. naive.')
+    phrases.add_argument('index', type=str, help='index built with SAR_Indexer.py -O.')
+    phrases.add_argument('--phrase', type=str, action='append',
+                         help='phrase to measure, can be repeated. By default, phrases with "de" and "el".')
+    phrases.add_argument('--repeat', type=int, default=3,
+                         help='repetitions of each measure, the best one is reported.')
+    phrases.set_defaults(run=bench_phrases)
+
+    ranking = subparsers.add_parser('ranking', help='ranked queries, top-k with early termination vs. scoring every result.')
+    ranking.add_argument('index', type=str, help='index built with SAR_Indexer.py.')
+    ranking.add_argument('--query', type=str, action='append',
+                         help='query to measure, can be repeated. By default, broad queries with "de" and "el".')
+    ranking.add_argument('-k', type=int, default=10, help='number of results ranked.')
+    ranking.add_argument('--repeat', type=int, default=3,
+                         help='repetitions of each measure, the best one is reported.')
+    ranking.set_defaults(run=bench_ranking)
+
+    store = subparsers.add_parser('store', help='news shown with -N, document store vs. parsing the JSON files.')
+    store.add_argument('index', type=str, help='index built with SAR_Indexer.py.')
+    store.add_argument('--query', type=str, action='append',
+                       help='query to measure, can be repeated.')
+    store.add_argument('--show', type=int, default=10, help='number of news read per query.')
+    store.add_argument('--repeat', type=int, default=3,
+                       help='repetitions of each measure, the best one is reported.')
+    store.set_defaults(run=bench_store)
+
+    server = subparsers.add_parser('server', help='query server throughput with concurrent clients vs. one-shot SAR_Searcher.py.')
+    server.add_argument('index', type=str, help='index built with SAR_Indexer.py.')
+    server.add_argument('--queries', type=str, default='references/queries_full.txt',
+                        help='file with queries.')
+    server.add_argument('--op', choices=['count', 'show', 'rank'], default='count',
+                        help='request sent for each query.')
+    server.add_argument('--clients', type=int, nargs='+', default=[1, 2, 4, 8],
+                        help='numbers of concurrent clients measured.')
+    server.add_argument('-w', '--workers', type=int, default=os.cpu_count() or 1,
+                        help='worker processes of the server.')
+    server.add_argument('--repeat', type=int, default=5,
+                        help='times each client sends the query list.')
+    server.add_argument('--oneshot', type=int, default=5,
+                        help='queries measured with one SAR_Searcher.py run each.')
+    server.set_defaults(run=bench_server)
+
+    shards = subparsers.add_parser('shards', help='query latency on a sharded index vs. the full index, and shards opened per query.')
+    shards.add_argument('index', type=str, help='index built with SAR_Indexer.py -M.')
+    shards.add_argument('sharded', type=str, help='index of the same news built with SAR_Indexer.py -M --shard.')
+    shards.add_argument('--query', type=str, action='append',
+                        help='query to measure, can be repeated. By default, queries with and without dates.')
+    shards.add_argument('--repeat', type=int, default=5,
+                        help='repetitions of each measure, the best one is reported.')
+    shards.add_argument('--workers', type=int, default=None,
+                        help='processes that solve the shards, by default one per CPU (up to the number of shards).')
+    shards.set_defaults(run=bench_shards)
+
+    ingest_parser = subparsers.add_parser('ingest', help='reading and indexing the news, json.load vs. incremental parsing and read-ahead, cold and warm page cache.')
+    ingest_parser.add_argument('--corpus', type=str, default='Corpora/2016', help='directory with the news.')
+    ingest_parser.add_argument('--prefetch', type=int, default=2, help='files read ahead by the reader thread.')
+    ingest_parser.add_argument('--repeat', type=int, default=3,
+                               help='repetitions of each measure, the best one is reported.')
+    ingest_parser.set_defaults(run=bench_ingest)
+
+    suite = subparsers.add_parser('suite', help='indexing time, peak memory, index size, load time and query latency per class, checked against references/ and saved as JSON.')
+    suite.add_argument('--corpora', type=str, nargs='+', default=['Corpora/2015', 'Corpora/2016'],
+                       help='directories with the news.')
+    suite.add_argument('--flags', type=str, nargs='+', default=['none', 'S', 'SP', 'SPM', 'SPMO'],
+                       help='combinations of SAR_Indexer.py options, "none" for no options.')
+    suite.add_argument('--repeat', type=int, default=5,
+                       help='times each load and query is measured.')
+    suite.add_argument('-o', '--output', type=str, default='benchmark.json',
+                       help='JSON file where the results are saved.')
+    suite.add_argument('--compare', type=str, default=None,
+                       help='JSON file of a previous run, the ratio to its values is shown.')
+    suite.set_defaults(run=bench_suite)
+
+    args = parser.parse_args()
+    args.run(args)
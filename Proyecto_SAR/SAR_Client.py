@@ -0,0 +1,137 @@
+import argparse
+import json
+import socket
+import sys
+
+
+class SearchClient:
+    """
+    Cliente del servidor de consultas (SAR_Server.py): envia peticiones JSON, una por linea,
+    y lee las respuestas en el mismo orden.
+
+    """
+
+    def __init__(self, host='127.0.0.1', port=8765, unix=None):
+        if unix is not None:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(unix)
+        else:
+            self.sock = socket.create_connection((host, port))
+        self.fh = self.sock.makefile('rb')
+
+    def send(self, requests):
+        """
+        Envia todas las peticiones de una vez, sin esperar las respuestas.
+
+        """
+        self.sock.sendall(b''.join(json.dumps(request).encode('utf-8') + b'\n' for request in requests))
+
+    def receive(self):
+        """
+        Lee la siguiente respuesta.
+
+        """
+        line = self.fh.readline()
+        if not line:
+            raise ConnectionError('the server closed the connection')
+        return json.loads(line)
+
+    def ask(self, requests):
+        """
+        Envia las peticiones y devuelve la lista de respuestas.
+
+        """
+        requests = list(requests)
+        self.send(requests)
+        return [self.receive() for _ in requests]
+
+    def close(self):
+        self.fh.close()
+        self.sock.close()
+
+
+def check(response):
+    if not response['ok']:
+        print("==> ERROR: %s" % response['error'], file=sys.stderr)
+        sys.exit(-1)
+    return response
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Search an index served by SAR_Server.py.')
+
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='TCP address of the server.')
+    parser.add_argument('--port', type=int, default=8765, help='TCP port of the server.')
+    parser.add_argument('--unix', type=str, default=None, help='Unix socket of the server instead of TCP.')
+
+    parser.add_argument('-S', '--stem', dest='stem', action='store_true', default=False,
+                        help='use stem index by default.')
+
+    group0 = parser.add_mutually_exclusive_group()
+    group0.add_argument('-N', '--snippet', dest='snippet', action='store_true', default=False,
+                        help='show a snippet of the retrieved documents.')
+    group0.add_argument('-C', '--count', dest='count', action='store_true', default=False,
+                        help='show only the number of documents retrieved.')
+
+    parser.add_argument('-A', '--all', dest='all', action='store_true', default=False,
+                        help='show all the results. If not used, only the first 10 results are showed. Does not apply with -C and -T options.')
+    parser.add_argument('-R', '--rank', dest='rank', action='store_true', default=False,
+                        help='rank results. Does not apply with -C and -T options.')
+
+    group1 = parser.add_mutually_exclusive_group(required=True)
+    group1.add_argument('-Q', '--query', dest='query', metavar='query', type=str, action='store',
+                        help='query.')
+    group1.add_argument('-L', '--list', dest='qlist', metavar='qlist', type=str, action='store',
+                        help='file with queries.')
+    group1.add_argument('-T', '--test', dest='test', metavar='test', type=str, action='store',
+                        help='file with queries and results, for testing.')
+
+    args = parser.parse_args()
+
+    client = SearchClient(args.host, args.port, args.unix)
+    options = {'stem': args.stem, 'snippet': args.snippet, 'all': args.all}
+    if args.count:
+        op = 'count'
+    else:
+        op = 'rank' if args.rank else 'show'
+
+    if args.test is not None:
+        # opt: -T, se envian todas las queries y se comparan las respuestas en orden
+        with open(args.test, encoding='utf-8') as fh:
+            lines = fh.read().split('\n')
+        tests = [line.split('\t') for line in lines if len(line) > 0 and not line.startswith('#')]
+        responses = iter(client.ask({'op': 'count', 'query': query, 'stem': args.stem} for query, _ in tests))
+        for line in lines:
+            if len(line) > 0 and not line.startswith('#'):
+                query, reference = line.split('\t')
+                result = check(next(responses))['count']
+                # la misma linea que SAR_Searcher.py -T (ver SAR_Project.solve_and_count)
+                print("%s\t%d" % (query, result))
+                if result != int(reference):
+                    print("==> ERROR: '%s'\t%d\t%d" % (query, result, int(reference)))
+                    sys.exit(-1)
+            else:
+                print(line)
+        print('\nParece que todo ha ido bien, buen trabajo!')
+
+    else:
+        if args.query is not None:
+            lines = [args.query]
+        else:
+            with open(args.qlist, encoding='utf-8') as fh:
+                lines = fh.read().split('\n')
+                lines.pop()
+        queries = [line for line in lines if len(line) > 0 and not line.startswith('#')]
+        responses = iter(client.ask(dict(options, op=op, query=query) for query in queries))
+        for line in lines:
+            if len(line) > 0 and not line.startswith('#'):
+                response = check(next(responses))
+                if op == 'count':
+                    print("%s\t%d" % (line, response['count']))
+                else:
+                    print('\n'.join(response['lines']))
+            else:
+                print(line)
+
+    client.close()
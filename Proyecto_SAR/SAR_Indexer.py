@@ -1,9 +1,9 @@
 import argparse
-import pickle
+import os
 import sys
 import time
 
-from SAR_lib import SAR_Project
+from SAR_lib import SAR_Project, ShardedProject
 
 
 if __name__ == "__main__":
@@ -28,19 +28,56 @@ if __name__ == "__main__":
     parser.add_argument('-O', '--positional', dest='positional', action='store_true', default=False,
                         help='compute positional index.')
 
+    parser.add_argument('-j', '--jobs', dest='jobs', metavar='N', type=int, default=1,
+                        help='number of worker processes used for indexing.')
+
+    parser.add_argument('-B', '--memory', dest='memory', metavar='MB', type=int, default=None,
+                        help='memory budget for the in-memory index. When exceeded, sorted runs are written to disk and merged at the end (SPIMI).')
+
+    parser.add_argument('--shard', dest='shard', choices=['year', 'month', 'day'], default=None,
+                        help='build one index per year, month or day of the news files, saved next to the index file and loaded only when a query needs them.')
+
+    parser.add_argument('--prefetch', dest='prefetch', metavar='N', type=int, default=2,
+                        help='number of files read ahead by a background thread while indexing, 0 reads them in the indexing thread.')
+
+    parser.add_argument('--profile', dest='profile', action='store_true', default=False,
+                        help='measure the time of every indexing stage and show it with the statistics.')
+
+    parser.add_argument('-a', '--append', dest='append', action='store_true', default=False,
+                        help='add new or modified files to an existing index instead of rebuilding it.')
+
     args = parser.parse_args()
 
     newsdir = args.newsdir
     indexfile = args.index
 
-    indexer = SAR_Project()
-    t0 = time.time()
-    indexer.index_dir(newsdir, **vars(args))
-    t1 = time.time()
-    with open(indexfile, 'wb') as fh:
-        pickle.dump(indexer, fh)
-    t2 = time.time()
+    if args.shard is not None:
+        if args.append:
+            print("==> ERROR: -a cannot be used with --shard")
+            sys.exit(-1)
+        t0 = time.time()
+        # cada shard se guarda al terminar de indexarlo
+        indexer = ShardedProject.build(newsdir, indexfile, **vars(args))
+        t1 = t2 = time.time()
+    else:
+        if args.append and os.path.exists(indexfile):
+            indexer = SAR_Project.load(indexfile)
+            if isinstance(indexer, ShardedProject):
+                print("==> ERROR: -a cannot be used with a sharded index")
+                sys.exit(-1)
+            indexer.start_append(indexfile)
+        else:
+            indexer = SAR_Project()
+        indexer.set_profile(args.profile)
+        t0 = time.time()
+        indexer.index_dir(newsdir, **vars(args))
+        t1 = time.time()
+        indexer.save(indexfile)
+        t2 = time.time()
     indexer.show_stats()
     print("Time indexing: %2.2fs." % (t1 - t0))
     print("Time saving: %2.2fs." % (t2 - t1))
+    print("Tokens indexed: %d (%d tokens/s)." % (indexer.tokens_indexed, indexer.tokens_indexed / max(t1 - t0, 1e-9)))
+    if indexer.stemming:
+        print("Time stemming: %2.2fs." % indexer.stemming_time)
     print()
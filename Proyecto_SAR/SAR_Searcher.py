@@ -2,10 +2,12 @@
 
 
 import argparse
-import pickle
 import sys
+import time
 
+import_start = time.perf_counter()
 from SAR_lib import SAR_Project
+import_time = time.perf_counter() - import_start
 
 
 def syntax():
@@ -38,6 +40,24 @@ if __name__ == "__main__":
     parser.add_argument('-R', '--rank', dest='rank', action='store_true', default=False,
                         help='rank results. Does not apply with -C and -T options.')
 
+    parser.add_argument('-E', '--engine', dest='engine', choices=['python', 'numpy'], default='python',
+                        help='engine used to merge posting lists.')
+
+    parser.add_argument('-K', '--cache', dest='cache', metavar='size', type=int, default=256,
+                        help='number of sub-expressions kept in the query cache, 0 disables it.')
+
+    parser.add_argument('--cache-stats', dest='cache_stats', action='store_true', default=False,
+                        help='print the hits and misses of the query cache to stderr when finished.')
+
+    parser.add_argument('-j', '--jobs', dest='jobs', metavar='N', type=int, default=None,
+                        help='solve the -L and -T query files as a batch with N worker processes: repeated queries are solved once, queries that share sub-expressions go to the same worker and the time of each query is printed to stderr.')
+
+    parser.add_argument('--profile', dest='profile', action='store_true', default=False,
+                        help='print to stderr the operators evaluated for each query, with the size of their results and their time, and the time of every stage when finished. Queries are solved one by one, -j is ignored.')
+
+    parser.add_argument('--timing', dest='timing', action='store_true', default=False,
+                        help='print to stderr the time spent importing the modules, loading the index, opening the parts of the index used by the queries (fields, stems, permuterm, stemmer) and solving the queries.')
+
     group1 = parser.add_mutually_exclusive_group()
     group1.add_argument('-Q', '--query', dest='query', metavar='query', type=str, action='store',
                         help='query.')
@@ -48,13 +68,19 @@ if __name__ == "__main__":
 
     args = parser.parse_args()
 
-    with open(args.index, 'rb') as fh:
-        searcher = pickle.load(fh)
+    t0 = time.perf_counter()
+    searcher = SAR_Project.load(args.index)
+    load_time = time.perf_counter() - t0
 
     searcher.set_stemming(args.stem)
     searcher.set_ranking(args.rank)
     searcher.set_showall(args.all)
     searcher.set_snippet(args.snippet)
+    searcher.set_engine(args.engine)
+    searcher.set_cache(args.cache)
+    searcher.set_profile(args.profile, sys.stderr)
+
+    t0 = time.perf_counter()
 
     # se debe contar o mostrar resultados?
     if args.count is True:
@@ -62,6 +88,34 @@ if __name__ == "__main__":
     else:
         fnc = searcher.solve_and_show
 
+    batch = None
+    if args.jobs is not None and not args.profile and (args.test is not None or args.qlist is not None):
+        # -j: se resuelve todo el fichero antes de mostrar los resultados en el orden original
+        with open(args.test or args.qlist, encoding='utf-8') as fh:
+            queries = [line.split('\t')[0] for line in fh.read().split('\n')
+                       if len(line) > 0 and not line.startswith('#')]
+        count_only = args.test is not None or args.count
+        t0 = time.perf_counter()
+        batch = searcher.solve_batch(args.index, queries, args.jobs, count_only)
+        elapsed = time.perf_counter() - t0
+        for query in dict.fromkeys(queries):
+            print("%10.3f ms\t%s" % (batch[query][2] * 1000, query), file=sys.stderr)
+        print("%d queries (%d distinct) in %.3f s" % (len(queries), len(batch), elapsed), file=sys.stderr)
+
+    def solve(query):
+        """
+        Resultado de una query de -L o -T: del batch si se ha usado -j, si no se resuelve ahora.
+
+        """
+        if batch is None:
+            return fnc(query)
+        count, lines, _ = batch[query]
+        if lines is None:
+            print("%s\t%d" % (query, count))
+        else:
+            print('\n'.join(lines))
+        return count
+
     if args.test is not None:
         # opt: -T, testing
 
@@ -71,7 +125,7 @@ if __name__ == "__main__":
                 if len(line) > 0 and not line.startswith('#'):
                     query, reference = line.split('\t')
                     reference = int(reference)
-                    result = searcher.solve_and_count(query)
+                    result = solve(query) if batch is not None else searcher.solve_and_count(query)
                     if result != reference:
                         print("==> ERROR: '%s'\t%d\t%d" %
                               (query, result, reference))
@@ -91,7 +145,7 @@ if __name__ == "__main__":
             queries.pop()
             for query in queries:
                 if len(query) > 0 and not query.startswith('#'):
-                    fnc(query)
+                    solve(query)
                 else:
                     print(query)
     else:
@@ -100,3 +154,16 @@ if __name__ == "__main__":
         while query != "":
             fnc(query)
             query = input("query:")
+
+    if args.timing:
+        # lo que se abre bajo demanda se carga mientras se resuelven las queries
+        lazy = sum(searcher.load_times.values())
+        print("Import: %.1f ms" % (import_time * 1000), file=sys.stderr)
+        print("Load: %.1f ms" % (load_time * 1000), file=sys.stderr)
+        for name, seconds in searcher.load_times.items():
+            print("\topen %s: %.1f ms" % (name, seconds * 1000), file=sys.stderr)
+        print("Queries: %.1f ms" % ((time.perf_counter() - t0 - lazy) * 1000), file=sys.stderr)
+    if args.cache_stats:
+        print(searcher.cache_stats(), file=sys.stderr)
+    if args.profile:
+        searcher.show_profile(file=sys.stderr)
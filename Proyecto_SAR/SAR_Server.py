@@ -0,0 +1,177 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from SAR_lib import SAR_Project
+
+
+# Protocolo: una peticion JSON por linea y una respuesta JSON por linea, en el mismo orden.
+#
+#   peticion:  {"op": "count" | "show" | "rank" | "stats", "query": "...",
+#               "stem": bool, "snippet": bool, "all": bool, "id": cualquier valor}
+#   respuesta: {"ok": true, "count": n, "lines": [...], "time": segundos, "id": ...}
+#              {"ok": false, "error": "...", "id": ...}
+#
+# "count" solo devuelve el numero de resultados, "show" las lineas de solve_and_show y "rank"
+# lo mismo con el ranking de resultados. Las opciones que no se indican valen False.
+
+OPS = ('count', 'show', 'rank', 'stats')
+
+# indice de cada proceso del pool, se carga una vez en init_worker
+searcher = None
+
+
+def init_worker(index, engine, cache):
+    """
+    Carga el indice en un proceso del pool (o en el hilo de evaluacion con -w 0).
+
+    """
+    global searcher
+    searcher = SAR_Project.load(index)
+    searcher.set_engine(engine)
+    searcher.set_cache(cache)
+
+
+def answer(request):
+    """
+    Resuelve una peticion con el indice del proceso. Cada proceso atiende una peticion cada
+    vez, por lo que las opciones de la peticion se pueden fijar en el objeto SAR_Project.
+
+    return: diccionario de respuesta
+
+    """
+    op = request.get('op')
+    if op not in OPS:
+        return {'ok': False, 'error': "unknown op '%s'" % op}
+    if op == 'stats':
+        return {'ok': True, 'pid': os.getpid(), 'cache': searcher.cache_stats()}
+    query = request.get('query')
+    if not isinstance(query, str) or not query.strip():
+        return {'ok': False, 'error': 'missing query'}
+
+    t0 = time.perf_counter()
+    searcher.set_stemming(bool(request.get('stem')))
+    searcher.set_ranking(op == 'rank')
+    searcher.set_showall(bool(request.get('all')))
+    searcher.set_snippet(bool(request.get('snippet')))
+    try:
+        if op == 'count':
+            response = {'ok': True, 'count': len(searcher.solve_query(query))}
+        else:
+            count, lines = searcher.show_lines(query)
+            response = {'ok': True, 'count': count, 'lines': lines}
+    except Exception as e:
+        # una query mal formada no debe tumbar el proceso
+        return {'ok': False, 'error': '%s: %s' % (type(e).__name__, e)}
+    response['time'] = time.perf_counter() - t0
+    return response
+
+
+class QueryServer:
+    """
+    Servidor asyncio de consultas sobre un indice cargado una sola vez.
+
+    El bucle de eventos solo lee y escribe lineas; la evaluacion, que usa la CPU, se hace en
+    un pool de procesos con el indice cargado en cada uno (el mmap del fichero es compartido).
+    Cada conexion puede enviar varias peticiones sin esperar las respuestas: se evaluan a la vez
+    en el pool y las respuestas se escriben en el orden de las peticiones.
+
+    """
+
+    def __init__(self, index, workers, engine='python', cache=256):
+        if workers > 0:
+            self.pool = ProcessPoolExecutor(workers, initializer=init_worker,
+                                            initargs=(index, engine, cache))
+        else:
+            # -w 0: un solo hilo de evaluacion en el propio proceso
+            self.pool = ThreadPoolExecutor(1, initializer=init_worker, initargs=(index, engine, cache))
+        self.requests = 0
+
+    async def evaluate(self, line):
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError('request must be a JSON object')
+        except ValueError as e:
+            return {'ok': False, 'error': 'bad request: %s' % e}
+        response = await asyncio.get_running_loop().run_in_executor(self.pool, answer, request)
+        if 'id' in request:
+            response['id'] = request['id']
+        self.requests += 1
+        return response
+
+    async def handle(self, reader, writer):
+        pending = asyncio.Queue()
+
+        async def respond():
+            while True:
+                task = await pending.get()
+                if task is None:
+                    break
+                writer.write(json.dumps(await task).encode('utf-8') + b'\n')
+                await writer.drain()
+
+        responder = asyncio.create_task(respond())
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if line.strip():
+                    await pending.put(asyncio.create_task(self.evaluate(line)))
+        finally:
+            await pending.put(None)
+            try:
+                await responder
+            except ConnectionError:
+                pass
+            writer.close()
+
+    async def serve(self, host=None, port=None, unix=None):
+        if unix is not None:
+            server = await asyncio.start_unix_server(self.handle, path=unix)
+            where = unix
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+            where = '%s:%d' % (host, port)
+        # una peticion de calentamiento para que el indice este cargado al aceptar clientes
+        await asyncio.get_running_loop().run_in_executor(self.pool, answer, {'op': 'stats'})
+        print('listening on %s' % where, flush=True)
+        async with server:
+            await server.serve_forever()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Serve queries on an index over a local socket (one JSON request per line).')
+    parser.add_argument('index', metavar='index', type=str,
+                        help='name of the file with the index object.')
+    parser.add_argument('--host', type=str, default='127.0.0.1',
+                        help='TCP address to listen on.')
+    parser.add_argument('--port', type=int, default=8765,
+                        help='TCP port to listen on.')
+    parser.add_argument('--unix', type=str, default=None,
+                        help='listen on this Unix socket instead of TCP.')
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count() or 1,
+                        help='number of worker processes that evaluate queries, 0 evaluates them in the server process.')
+    parser.add_argument('-E', '--engine', dest='engine', choices=['python', 'numpy'], default='python',
+                        help='engine used to merge posting lists.')
+    parser.add_argument('-K', '--cache', dest='cache', metavar='size', type=int, default=256,
+                        help='number of sub-expressions kept in the query cache of each worker, 0 disables it.')
+
+    args = parser.parse_args()
+
+    server = QueryServer(args.index, args.workers, args.engine, args.cache)
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.pool.shutdown(cancel_futures=True)
+        if args.unix is not None and os.path.exists(args.unix):
+            os.remove(args.unix)
+        print('%d requests served' % server.requests, file=sys.stderr)
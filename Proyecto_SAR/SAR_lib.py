@@ -1,352 +1,3768 @@
 import json
-from nltk.stem.snowball import SnowballStemmer
 import os
 import re
-from pathlib import Path
+import shutil
+import tempfile
 import sys
 import math
+import heapq
+import time
+import bisect
+import mmap
+import pickle
+import queue
+import struct
+import threading
+import zlib
+from array import array
+from collections import Counter, OrderedDict
+from collections.abc import Mapping
+from itertools import accumulate, product
+from types import GeneratorType
+
+# numpy solo es necesario para el motor 'numpy' y se importa al elegirlo (ver import_numpy)
+np = None
+
+def import_numpy():
+    """
+    Importa numpy la primera vez que se elige el motor 'numpy'. Importarlo siempre hacia que
+    arrancar el buscador tardase mas que cargar el indice.
 
+    return: True si numpy esta instalado
 
-class SAR_Project:
     """
-    Prototipo de la clase para realizar la indexacion y la recuperacion de noticias
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            return False
+        np = numpy
+    return True
 
-        Preparada para todas las ampliaciones:
-          parentesis + multiples indices + posicionales + stemming + permuterm + ranking de resultado
 
-    Se deben completar los metodos que se indica.
-    Se pueden añadir nuevas variables y nuevos metodos
-    Los metodos que se añadan se deberan documentar en el codigo y explicar en la memoria
+def spanish_stemmer():
     """
+    Crea el stemmer en castellano de nltk. nltk se importa aqui y no al principio del modulo
+    porque tarda varias decimas de segundo y solo hace falta con stemming.
 
-    # lista de campos, el booleano indica si se debe tokenizar el campo
-    # NECESARIO PARA LA AMPLIACION MULTIFIELD
-    fields = [("title", True), ("date", False),
-              ("keywords", True), ("article", True),
-              ("summary", True)]
+    """
+    from nltk.stem.snowball import SnowballStemmer
+    return SnowballStemmer('spanish')
 
-    # numero maximo de documento a mostrar cuando self.show_all es False
-    SHOW_MAX = 10
+
+def vbyte_encode(n, out):
+    """
+    Añade a "out" (bytearray) el entero no negativo "n" codificado con variable-byte.
+    Cada byte guarda 7 bits del numero, el bit alto indica que el numero continua en el siguiente byte.
+
+    """
+    while n >= 0x80:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def vbyte_decode(buf, pos):
+    """
+    Decodifica el entero variable-byte que empieza en buf[pos].
+
+    return: tupla (entero, posicion del siguiente byte)
+
+    """
+    n = shift = 0
+    b = buf[pos]
+    while b & 0x80:
+        n |= (b & 0x7F) << shift
+        shift += 7
+        pos += 1
+        b = buf[pos]
+    return n | (b << shift), pos + 1
+
+
+# docid que marca en la tabla de noticias un newid borrado (noticia de un fichero reindexado)
+DELETED = 0xFFFFFFFF
+
+# una posting list se maneja como mapa de bits cuando ocupa menos asi: 4 bytes por newid en el
+# array frente a 1 bit por noticia de la coleccion en el mapa de bits (df > N / DENSE_RATIO)
+DENSE_RATIO = 32
+
+# memoria aproximada (en bytes) de un Posting vacio y su entrada en el diccionario,
+# se usa para estimar el tamaño del indice en memoria (SPIMI)
+POSTING_BYTES = 400
+
+# ficheros que se leen por delante mientras se indexa, ver read_ahead
+READ_AHEAD = 2
+
+# posting lists decodificadas que guarda cada MappedIndex (LRU, como la cache de subexpresiones):
+# sin limite, las expansiones de comodines acabarian decodificando todo el indice en memoria
+POSTING_CACHE = 1024
+
+# parametros de BM25 (ver bm25_record)
+BM25_K1 = 1.2
+BM25_B = 0.75
+# "order" de una posting list con una sola noticia
+FIRST = array('I', [0]).tobytes()
+
+
+class Posting:
+    """
+    Posting list compacta de un termino.
+
+        - "newids": array('I') ordenado con los newid de las noticias que contienen el termino.
+        - "data": bytearray con un bloque por noticia: la frecuencia del termino seguida de los
+          gaps entre posiciones consecutivas (solo en el indice posicional), todo en variable-byte.
+        - "offsets": array('I') con el inicio en "data" del bloque de cada noticia.
+
+    Las noticias se indexan por orden creciente de newid, por lo que basta con añadir al final.
+    "newids" es la posting list que manejan and_posting, or_posting y minus_posting.
+    """
+
+    __slots__ = ('newids', 'offsets', 'data', 'bitmap')
 
     def __init__(self):
+        self.newids = array('I')
+        self.offsets = array('I')
+        self.data = bytearray()
+        self.bitmap = None
+
+    def __len__(self):
+        return len(self.newids)
+
+    def add(self, newid, tf, positions=None):
         """
-        Constructor de la classe SAR_Indexer.
-        NECESARIO PARA LA VERSION MINIMA
+        Añade la noticia "newid" al final de la posting list.
 
-        Incluye todas las variables necesaria para todas las ampliaciones.
-        Puedes añadir más variables si las necesitas
+        param:  "newid": identificador de la noticia, mayor que el ultimo añadido
+                "tf": numero de apariciones del termino en la noticia
+                "positions": lista creciente de posiciones, None si el indice no es posicional
 
         """
-        self.index = {}  # hash para el indice invertido de terminos --> clave: termino, valor: posting list.
-        # Si se hace la implementacion multifield, se pude hacer un segundo nivel de hashing de tal forma que:
-        # self.index['title'] seria el indice invertido del campo 'title'.
-        self.sindex = {}  # hash para el indice invertido de stems --> clave: stem, valor: lista con los terminos que tienen ese stem
-        self.ptindex = {}  # hash para el indice permuterm.
-        # diccionario de documentos --> clave: entero(docid),  valor: ruta del fichero.
-        self.docs = {}
-        # hash de terminos para el pesado, ranking de resultados. puede no utilizarse
-        self.weight = {}
-        # hash de noticias --> clave entero (newid), valor: la info necesaria para diferenciar la noticia dentro de su fichero (doc_id y posición dentro del documento)
-        self.news = {}
-        # expresion regular para hacer la tokenizacion
-        self.tokenizer = re.compile("\W+")
-        self.stemmer = SnowballStemmer('spanish')  # stemmer en castellano
-        self.show_all = False  # valor por defecto, se cambia con self.set_showall()
-        self.show_snippet = False  # valor por defecto, se cambia con self.set_snippet()
-        self.use_stemming = False  # valor por defecto, se cambia con self.set_stemming()
-        self.use_ranking = False  # valor por defecto, se cambia con self.set_ranking()
+        data = self.data
+        self.bitmap = None
+        self.newids.append(newid)
+        self.offsets.append(len(data))
+        vbyte_encode(tf, data)
+        if positions is not None:
+            last = 0
+            for position in positions:
+                vbyte_encode(position - last, data)
+                last = position
+
+    def __reduce__(self):
+        # se serializa como un unico bytes, mucho mas rapido de enviar entre procesos que los atributos
+        data = self.to_bytes()
+        return Posting.from_bytes, (data, 0, len(data))
+
+    def shift(self, shift):
+        """
+        Suma "shift" a todos los newids de la posting list.
 
-        self.docid = 0
-        self.news_counter = 0
-    ###############################
-    ###                         ###
-    ###      CONFIGURACION      ###
-    ###                         ###
-    ###############################
+        """
+        if shift:
+            self.newids = array('I', [newid + shift for newid in self.newids])
+            self.bitmap = None
 
-    def set_showall(self, v):
+    def extend(self, other, shift):
         """
+        Añade al final las noticias de la posting list "other" sumando "shift" a sus newids.
+        Todos los newids de "other" (desplazados) deben ser mayores que los de esta posting list.
 
-        Cambia el modo de mostrar los resultados.
+        """
+        base = len(self.data)
+        self.bitmap = None
+        self.newids.extend(newid + shift for newid in other.newids)
+        self.offsets.extend(offset + base for offset in other.offsets)
+        self.data += other.data
 
-        input: "v" booleano.
+    def without(self, deleted):
+        """
+        Devuelve una copia de la posting list sin las noticias cuyo newid esta en "deleted".
 
-        UTIL PARA TODAS LAS VERSIONES
+        """
+        posting = Posting()
+        data = self.data
+        for i, newid in enumerate(self.newids):
+            if newid not in deleted:
+                end = self.offsets[i + 1] if i + 1 < len(self.offsets) else len(data)
+                posting.newids.append(newid)
+                posting.offsets.append(len(posting.data))
+                posting.data += data[self.offsets[i]:end]
+        return posting
+
+    @staticmethod
+    def merge_tf(postings):
+        """
+        Une varias posting lists en una posting list no posicional en la que cada noticia
+        aparece una vez con la suma de sus frecuencias. Es la posting list de un stem.
 
-        si self.show_all es True se mostraran todos los resultados el lugar de un maximo de self.SHOW_MAX, no aplicable a la opcion -C
+        """
+        if len(postings) == 1:
+            newids, tfs = postings[0].newids, postings[0].tfs()
+        else:
+            counts = {}
+            for p in postings:
+                for newid, tf in zip(p.newids, p.tfs()):
+                    counts[newid] = counts.get(newid, 0) + tf
+            newids = sorted(counts)
+            tfs = [counts[newid] for newid in newids]
+        merged = Posting()
+        merged.newids = array('I', newids)
+        if max(tfs, default=0) < 0x80:
+            # cada frecuencia ocupa un byte
+            merged.offsets = array('I', range(len(tfs)))
+            merged.data = bytearray(tfs)
+        else:
+            for tf in tfs:
+                merged.offsets.append(len(merged.data))
+                vbyte_encode(tf, merged.data)
+        return merged
 
+    def as_bitmap(self):
         """
-        self.show_all = v
+        Devuelve la posting list como Bitmap. Se calcula la primera vez y se guarda.
 
-    def set_snippet(self, v):
         """
+        if self.bitmap is None:
+            self.bitmap = Bitmap.from_newids(self.newids)
+        return self.bitmap
 
-        Cambia el modo de mostrar snippet.
+    def tf(self, i):
+        """
+        Devuelve la frecuencia del termino en la i-esima noticia de la posting list.
 
-        input: "v" booleano.
+        """
+        return vbyte_decode(self.data, self.offsets[i])[0]
 
-        UTIL PARA TODAS LAS VERSIONES
+    def tfs(self):
+        """
+        Devuelve la lista de frecuencias del termino en cada noticia de la posting list.
 
-        si self.show_snippet es True se mostrara un snippet de cada noticia, no aplicable a la opcion -C
+        """
+        data = self.data
+        return [data[offset] if data[offset] < 0x80 else vbyte_decode(data, offset)[0]
+                for offset in self.offsets]
 
+    def iter_positions(self, i):
         """
-        self.show_snippet = v
+        Recorre las posiciones del termino en la i-esima noticia decodificando los gaps segun
+        se piden, para poder dejar de decodificar en cuanto no hacen falta mas.
 
-    def set_stemming(self, v):
         """
+        data = self.data
+        tf, pos = vbyte_decode(data, self.offsets[i])
+        last = 0
+        for _ in range(tf):
+            b = data[pos]
+            if b < 0x80:
+                last += b
+                pos += 1
+            else:
+                gap, pos = vbyte_decode(data, pos)
+                last += gap
+            yield last
 
-        Cambia el modo de stemming por defecto.
+    def positions(self, i):
+        """
+        Devuelve la lista de posiciones del termino en la i-esima noticia de la posting list.
 
-        input: "v" booleano.
+        """
+        data = self.data
+        tf, pos = vbyte_decode(data, self.offsets[i])
+        res = []
+        last = 0
+        for _ in range(tf):
+            gap, pos = vbyte_decode(data, pos)
+            last += gap
+            res.append(last)
+        return res
 
-        UTIL PARA LA VERSION CON STEMMING
+    def nbytes(self):
+        """
+        Devuelve la memoria (en bytes) que ocupa la posting list.
 
-        si self.use_stemming es True las consultas se resolveran aplicando stemming por defecto.
+        """
+        return (sys.getsizeof(self) + sys.getsizeof(self.newids)
+                + sys.getsizeof(self.offsets) + sys.getsizeof(self.data))
 
+    def legacy_nbytes(self, positional):
         """
-        self.use_stemming = v
+        Estima la memoria (en bytes) que ocuparia la misma posting list con la representacion
+        anterior {newid: [posiciones]}: un dict con un int y una lista de ints boxed por noticia.
+        Los ints pequeños (<= 256) son compartidos por el interprete y no se cuentan.
 
-    def set_ranking(self, v):
         """
+        size = sys.getsizeof(dict.fromkeys(self.newids))
+        for i, newid in enumerate(self.newids):
+            size += sys.getsizeof(newid) + sys.getsizeof([None] * self.tf(i))
+            if positional:
+                size += sum(sys.getsizeof(p) for p in self.positions(i) if p > 256)
+        return size
+
+    def to_bytes(self):
+        """
+        Serializa la posting list para el fichero de indice:
+        df (uint32) + newids (df * uint32) + offsets (df * uint32) + data.
 
-        Cambia el modo de ranking por defecto.
+        """
+        return (struct.pack('<I', len(self.newids)) + self.newids.tobytes()
+                + self.offsets.tobytes() + bytes(self.data))
 
-        input: "v" booleano.
+    @staticmethod
+    def from_bytes(buf, start, end):
+        """
+        Reconstruye una posting list serializada con to_bytes en buf[start:end].
 
-        UTIL PARA LA VERSION CON RANKING DE NOTICIAS
+        """
+        posting = Posting()
+        df = struct.unpack_from('<I', buf, start)[0]
+        start += 4
+        posting.newids.frombytes(buf[start:start + 4 * df])
+        start += 4 * df
+        posting.offsets.frombytes(buf[start:start + 4 * df])
+        posting.data = bytearray(buf[start + 4 * df:end])
+        return posting
 
-        si self.use_ranking es True las consultas se mostraran ordenadas, no aplicable a la opcion -C
 
+# posiciones de los bits a 1 de cada valor de un byte, para decodificar un Bitmap byte a byte
+BYTE_BITS = [tuple(bit for bit in range(8) if byte >> bit & 1) for byte in range(256)]
+
+
+class Bitmap:
+    """
+    Posting list como mapa de bits: el bit i del entero "bits" esta a 1 si la noticia con newid i
+    esta en la posting list. Python opera los enteros grandes palabra a palabra, por lo que AND, OR,
+    resta y complemento cuestan O(N/64) sea cual sea el numero de noticias de cada posting list.
+
+    Consultar un bit del entero lo desplazaria entero (O(N/64) por consulta), por lo que las
+    consultas de newids sueltos se hacen sobre sus bytes (ver self.to_bytes).
+
+    Se usa para los terminos frecuentes y para los resultados de NOT (ver DENSE_RATIO).
+    """
+
+    __slots__ = ('bits', 'buf')
+
+    def __init__(self, bits=0):
+        self.bits = bits
+        self.buf = None
+
+    @staticmethod
+    def from_newids(newids):
         """
-        self.use_ranking = v
+        Construye el mapa de bits de una posting list ordenada de newids.
 
-    ###############################
-    ###                         ###
-    ###   PARTE 1: INDEXACION   ###
-    ###                         ###
-    ###############################
+        """
+        if not newids:
+            return Bitmap()
+        buf = bytearray((newids[-1] >> 3) + 1)
+        for newid in newids:
+            buf[newid >> 3] |= 1 << (newid & 7)
+        return Bitmap(int.from_bytes(buf, 'little'))
 
-    def index_dir(self, root, **args):
+    def __len__(self):
+        return self.bits.bit_count()
+
+    def __bool__(self):
+        return self.bits != 0
+
+    def __contains__(self, newid):
+        buf = self.to_bytes()
+        return newid >> 3 < len(buf) and buf[newid >> 3] >> (newid & 7) & 1 == 1
+
+    def __iter__(self):
+        return iter(self.to_array())
+
+    def to_bytes(self):
         """
-        NECESARIO PARA TODAS LAS VERSIONES
+        Devuelve los bytes del mapa de bits (little endian): el bit del newid n es
+        buf[n >> 3] >> (n & 7) & 1. Se calculan la primera vez, "bits" no cambia.
 
-        Recorre recursivamente el directorio "root" e indexa su contenido
-        los argumentos adicionales "**args" solo son necesarios para las funcionalidades ampliadas
+        """
+        if self.buf is None:
+            self.buf = self.bits.to_bytes((self.bits.bit_length() + 7) // 8, 'little')
+        return self.buf
 
+    def to_array(self):
         """
+        Devuelve la posting list como array('I') ordenado de newids: con numpy, si ya se ha
+        importado (motor 'numpy'), y si no byte a byte con BYTE_BITS.
 
-        self.multifield = args['multifield']
-        self.positional = args['positional']
-        self.stemming = args['stem']
-        self.permuterm = args['permuterm']
+        """
+        if np is not None:
+            flags = np.unpackbits(np.frombuffer(self.to_bytes(), dtype=np.uint8), bitorder='little')
+            return array('I', np.flatnonzero(flags).astype(np.uint32).tobytes())
+        return array('I', [i << 3 | bit for i, byte in enumerate(self.to_bytes()) if byte
+                           for bit in BYTE_BITS[byte]])
 
-        for dir, subdirs, files in os.walk(root):
-            for filename in files:
-                if filename.endswith('.json'):
-                    fullname = os.path.join(dir, filename)
-                    self.index_file(fullname)
-        print(self.index)
+    def filter(self, p, keep=True):
+        """
+        Devuelve los newids de la posting list ordenada "p" que estan (keep=True)
+        o no estan (keep=False) en el mapa de bits. Cuesta O(|p|): cada newid se busca en su byte.
 
-        ##########################################
-        ## COMPLETAR PARA FUNCIONALIDADES EXTRA ##
-        ##########################################
+        """
+        if np is not None and isinstance(p, np.ndarray):
+            return np_filter(self, p, keep)
+        buf = self.to_bytes()
+        # los newids a partir del ultimo byte no estan en el mapa de bits
+        hi = bisect.bisect_left(p, len(buf) << 3)
+        if keep:
+            return array('I', [newid for newid in p[:hi] if buf[newid >> 3] >> (newid & 7) & 1])
+        res = array('I', [newid for newid in p[:hi] if not buf[newid >> 3] >> (newid & 7) & 1])
+        res.extend(p[hi:])
+        return res
+
+
+def as_bits(p):
+    """
+    Devuelve el entero con el mapa de bits de una posting list (Bitmap o secuencia ordenada de newids).
+
+    """
+    return p.bits if isinstance(p, Bitmap) else Bitmap.from_newids(as_array(p)).bits
+
+
+def np_view(p):
+    """
+    Devuelve una posting list (array('I'), lista o array de numpy) como array de numpy de uint32.
+    Los array('I') se ven sin copiarlos.
+
+    """
+    if isinstance(p, np.ndarray):
+        return p
+    if isinstance(p, array) and p.itemsize == 4:
+        return np.frombuffer(p, dtype=np.uint32)
+    return np.array(p, dtype=np.uint32)
+
+
+def np_and(a, b):
+    """
+    Interseccion de dos arrays ordenados de numpy: se busca cada elemento del mas corto en el
+    mas largo con busqueda binaria vectorizada (searchsorted), O(|corto| * log |largo|).
+
+    """
+    if len(a) > len(b):
+        a, b = b, a
+    if len(a) == 0:
+        return a
+    idx = np.searchsorted(b, a)
+    np.minimum(idx, len(b) - 1, out=idx)
+    return a[b[idx] == a]
+
+
+def np_or(a, b):
+    """
+    Union de dos arrays ordenados de numpy. Se concatenan, se ordenan con el algoritmo estable
+    (radix sort para enteros) y se eliminan los repetidos; es mucho mas rapido que np.union1d.
+
+    """
+    c = np.concatenate((a, b))
+    if len(c) == 0:
+        return c
+    c.sort(kind='stable')
+    keep = np.empty(len(c), dtype=bool)
+    keep[0] = True
+    np.not_equal(c[1:], c[:-1], out=keep[1:])
+    return c[keep]
+
+
+def np_and_many(arrays):
+    """
+    Interseccion n-aria de arrays ordenados de numpy: se parte del mas corto y se va
+    intersectando con los demas de menor a mayor, parando si el resultado se queda vacio.
+
+    """
+    arrays = sorted(arrays, key=len)
+    answer = arrays[0]
+    for other in arrays[1:]:
+        if len(answer) == 0:
+            break
+        answer = np_and(answer, other)
+    return answer
+
+
+def np_filter(bitmap, a, keep=True):
+    """
+    Devuelve los newids del array de numpy "a" que estan (keep=True) o no estan (keep=False)
+    en el Bitmap "bitmap", sin recorrerlos en Python.
+
+    """
+    flags = np.unpackbits(np.frombuffer(bitmap.to_bytes(), dtype=np.uint8), bitorder='little').astype(bool)
+    mask = np.zeros(len(a), dtype=bool)
+    inside = a < len(flags)
+    mask[inside] = flags[a[inside]]
+    return a[mask] if keep else a[~mask]
+
+
+def as_array(p):
+    """
+    Convierte el resultado de una query (array('I'), lista, Bitmap o array de numpy) en array('I').
+
+    """
+    if isinstance(p, Bitmap):
+        return p.to_array()
+    if np is not None and isinstance(p, np.ndarray):
+        res = array('I')
+        res.frombytes(p.astype(np.uint32).tobytes())
+        return res
+    return p
+
+
+###################################
+###                             ###
+###       INDICE PERMUTERM      ###
+###                             ###
+###################################
+
+# marca de fin de termino de las rotaciones, no aparece en los terminos (\w o fechas)
+PERMUTERM_END = '$'
+
+
+class Permuterm:
+    """
+    Indice permuterm del lexicon compartido por los campos como array ordenado de rotaciones.
+
+    Cada rotacion de "termino$" se representa con el identificador del termino (su posicion en
+    el diccionario ordenado de terminos) y el desplazamiento de la rotacion:
+
+        - "tids": array('I') con el identificador del termino de cada rotacion
+        - "offsets": array('H') con el desplazamiento de cada rotacion
 
-    def index_file(self, filename):
+    ordenados por la cadena rotada, que no se guarda sino que se reconstruye a partir del termino
+    al comparar. Las rotaciones de un comodin se localizan con dos busquedas binarias.
+    """
+
+    __slots__ = ('terms', 'tids', 'offsets')
+
+    def __init__(self, terms, tids, offsets):
+        self.terms = terms
+        self.tids = tids
+        self.offsets = offsets
+
+    @staticmethod
+    def build(terms, tids=None):
         """
-        NECESARIO PARA TODAS LAS VERSIONES
+        Construye el indice permuterm de la secuencia ordenada de terminos "terms", o solo de
+        los terminos con identificador en "tids".
 
-        Indexa el contenido de un fichero.
+        """
+        if tids is None:
+            tids = range(len(terms))
+        entries = [(tid, r) for tid in tids for r in range(len(terms[tid]) + 1)]
+        entries.sort(key=lambda entry: rotate(terms[entry[0]], entry[1]))
+        return Permuterm(terms, array('I', [tid for tid, _ in entries]),
+                         array('H', [r for _, r in entries]))
+
+    @staticmethod
+    def merge(old, terms, tid_map, tids):
+        """
+        Construye el indice permuterm de la secuencia ordenada "terms" a partir del indice "old"
+        de un lexicon anterior sin volver a ordenar sus rotaciones: las de "old" ya estan en orden
+        y se conservan con el identificador de su termino en "terms" ("tid_map", -1 si ya no se
+        rota); solo se ordenan las de los terminos nuevos "tids".
 
-        Para tokenizar la noticia se debe llamar a "self.tokenize"
+        Si hay pocas rotaciones nuevas cada una se inserta con una busqueda binaria; si no, se
+        ordenan junto a las de "old" con sort, que recorre estas como un unico tramo ya ordenado.
 
-        Dependiendo del valor de "self.multifield" y "self.positional" se debe ampliar el indexado.
-        En estos casos, se recomienda crear nuevos metodos para hacer mas sencilla la implementacion
+        """
+        key = lambda entry: rotate(terms[entry[0]], entry[1])
+        entries = [(tid, r) for tid in tids for r in range(len(terms[tid]) + 1)]
+        kept = [i for i, tid in enumerate(old.tids) if tid_map[tid] >= 0]
+        kept_tids = array('I', [tid_map[old.tids[i]] for i in kept])
+        kept_offsets = array('H', [old.offsets[i] for i in kept])
+        if len(entries) * max(len(kept).bit_length(), 1) >= len(kept):
+            merged = sorted(list(zip(kept_tids, kept_offsets)) + entries, key=key)
+            return Permuterm(terms, array('I', [tid for tid, _ in merged]), array('H', [r for _, r in merged]))
+
+        entries.sort(key=key)
+        positions = range(len(kept))
+        merged_tids, merged_offsets = array('I'), array('H')
+        lo = 0
+        for tid, r in entries:
+            # una rotacion determina su termino, por lo que no coincide con ninguna de "old"
+            hi = bisect.bisect_left(positions, rotate(terms[tid], r), lo,
+                                    key=lambda i: rotate(terms[kept_tids[i]], kept_offsets[i]))
+            merged_tids.extend(kept_tids[lo:hi])
+            merged_offsets.extend(kept_offsets[lo:hi])
+            merged_tids.append(tid)
+            merged_offsets.append(r)
+            lo = hi
+        merged_tids.extend(kept_tids[lo:])
+        merged_offsets.extend(kept_offsets[lo:])
+        return Permuterm(terms, merged_tids, merged_offsets)
+
+    def __len__(self):
+        return len(self.tids)
+
+    def rotation(self, i):
+        return rotate(self.terms[self.tids[i]], self.offsets[i])
+
+    def prefix_range(self, prefix):
+        """
+        Devuelve el intervalo [lo, hi) de rotaciones que empiezan por "prefix".
 
-        input: "filename" es el nombre de un fichero en formato JSON Arrays (https://www.w3schools.com/js/js_json_arrays.asp).
-                Una vez parseado con json.load tendremos una lista de diccionarios, cada diccionario se corresponde a una noticia
+        """
+        size = len(prefix)
+        key = lambda i: self.rotation(i)[:size]
+        rotations = range(len(self.tids))
+        lo = bisect.bisect_left(rotations, prefix, key=key)
+        return lo, bisect.bisect_right(rotations, prefix, lo=lo, key=key)
 
+    def lookup(self, pattern):
         """
+        Devuelve los terminos que encajan con "pattern" ('*': cualquier secuencia, '?': un caracter).
 
-        with open(filename) as fh:
-            jlist = json.load(fh)
-            self.docs[self.docid] = filename
+        """
+        return [self.terms[tid] for tid in self.lookup_ids(pattern)]
 
-        # "jlist" es una lista con tantos elementos como noticias hay en el fichero,
-        # cada noticia es un diccionario con los campos:
-        #      "title", "date", "keywords", "article", "summary"
-        #
-        # En la version basica solo se debe indexar el contenido "article"
-        # COMPLETAR: asignar identificador al fichero 'filename'
-        myCounter = 0
-        for new in jlist:
-            self.news[self.news_counter] = [self.docid, myCounter]
-            content = self.tokenize(new['article'])
-
-            position = 1
-            for token in content:
-                # Checking if token does not exist in any news
-                if token not in self.index:
-                    self.index.update({token: {self.news_counter: [position]}})
-                # Checking if the current news is not in the token dictionary
-                elif self.news_counter not in self.index[token]:
-                    self.index[token].update({self.news_counter: [position]})
-                # Appending the token position to the posting list
-                else:
-                    self.index[token][self.news_counter].append(position)
-                position += 1
+    def lookup_ids(self, pattern):
+        """
+        Devuelve los identificadores de los terminos que encajan con "pattern".
 
-            self.news_counter += 1
-            myCounter += 1
+        La parte del patron anterior al primer comodin (X) y la posterior al ultimo (Y) dan el
+        prefijo 'Y$X' de las rotaciones candidatas; si el patron tiene '?' o varios comodines
+        solo los candidatos se comprueban con una expresion regular.
+
+        """
+        first = min(pattern.find(c) for c in '*?' if c in pattern)
+        last = max(pattern.rfind('*'), pattern.rfind('?'))
+        lo, hi = self.prefix_range(pattern[last + 1:] + PERMUTERM_END + pattern[:first])
+        # cada termino tiene un solo '$', por lo que aparece como mucho una vez en el intervalo
+        candidates = [self.tids[i] for i in range(lo, hi)]
+        if pattern != pattern[:first] + '*' + pattern[last + 1:]:
+            regex = re.compile(re.escape(pattern).replace(r'\*', '.*').replace(r'\?', '.'))
+            candidates = [tid for tid in candidates if regex.fullmatch(self.terms[tid])]
+        return candidates
+
+    def nbytes(self):
+        """
+        Memoria ocupada por las rotaciones (los terminos son los del diccionario del indice).
+
+        """
+        return len(self.tids) * self.tids.itemsize + len(self.offsets) * self.offsets.itemsize
+
+    def to_bytes(self):
+        """
+        Serializa el indice: numero de rotaciones (uint64), "tids" y "offsets" en little-endian.
+
+        """
+        tids, offsets = array('I', self.tids), array('H', self.offsets)
+        if sys.byteorder == 'big':
+            tids.byteswap()
+            offsets.byteswap()
+        return struct.pack('<Q', len(tids)) + tids.tobytes() + offsets.tobytes()
+
+    @staticmethod
+    def from_buffer(terms, buf, start):
+        """
+        Abre un indice serializado con to_bytes a partir de la posicion "start" de "buf" (un mmap),
+        sin copiar las rotaciones salvo en maquinas big-endian.
+
+        """
+        n = struct.unpack_from('<Q', buf, start)[0]
+        start += 8
+        view = memoryview(buf)
+        tids = view[start:start + 4 * n].cast('I')
+        offsets = view[start + 4 * n:start + 6 * n].cast('H')
+        if sys.byteorder == 'big':
+            tids, offsets = array('I', tids), array('H', offsets)
+            tids.byteswap()
+            offsets.byteswap()
+        return Permuterm(terms, tids, offsets)
+
+
+def rotate(term, r):
+    """
+    Rotacion "r" de "term$".
+
+    """
+    term += PERMUTERM_END
+    return term[r:] + term[:r]
+
+
+###################################
+###                             ###
+###       INDICE DE FECHAS      ###
+###                             ###
+###################################
+
+
+class DateIndex:
+    """
+    Indice del campo 'date' (no se tokeniza): fechas ordenadas y, por cada fecha, sus noticias
+    como secuencias de newids consecutivos. Las noticias de un fichero tienen la misma fecha
+    y newids seguidos, por lo que cada fecha suele ser una sola secuencia.
+
+        - "dates": lista ordenada de fechas
+        - "offsets": array('I') con len(dates) + 1 posiciones, las secuencias de la fecha i son
+          las de runs[2 * offsets[i]:2 * offsets[i + 1]]
+        - "runs": array('I') con pares (primer newid, ultimo newid + 1)
+
+    Una fecha, un comodin o un intervalo de fechas se localizan con busqueda binaria en "dates"
+    y su posting list es la union de las secuencias de las fechas encontradas.
+    """
+
+    __slots__ = ('dates', 'offsets', 'runs')
+
+    def __init__(self, dates=None, offsets=None, runs=None):
+        self.dates = [] if dates is None else dates
+        self.offsets = array('I', [0]) if offsets is None else offsets
+        self.runs = array('I') if runs is None else runs
+
+    @staticmethod
+    def build(items):
+        """
+        Construye el indice a partir de pares (fecha, newids ordenados) ordenados por fecha.
+
+        """
+        dindex = DateIndex()
+        for date, newids in items:
+            dindex.add(date, newids)
+        return dindex
+
+    def add(self, date, newids):
+        """
+        Añade la fecha "date", mayor que las anteriores, con sus newids ordenados.
+
+        """
+        runs = self.runs
+        for newid in newids:
+            if len(runs) > 2 * self.offsets[-1] and runs[-1] == newid:
+                runs[-1] = newid + 1
+            else:
+                runs.extend((newid, newid + 1))
+        self.dates.append(date)
+        self.offsets.append(len(runs) // 2)
+
+    def __len__(self):
+        return len(self.dates)
+
+    def lookup(self, pattern):
+        """
+        Devuelve las posiciones de las fechas que encajan con "pattern", una fecha o un comodin
+        ('*': cualquier secuencia, '?': un caracter). Solo se comprueban las fechas que empiezan
+        por la parte del patron anterior al primer comodin.
+
+        """
+        dates = self.dates
+        if '*' not in pattern and '?' not in pattern:
+            i = bisect.bisect_left(dates, pattern)
+            return range(i, i + 1) if i < len(dates) and dates[i] == pattern else range(0)
+        first = min(pattern.find(c) for c in '*?' if c in pattern)
+        last = max(pattern.rfind('*'), pattern.rfind('?'))
+        lo, hi = self.prefix_range(pattern[:first])
+        if pattern == pattern[:first] + '*' + pattern[last + 1:]:
+            # un solo '*': basta comprobar el sufijo
+            suffix = pattern[last + 1:]
+            return [i for i, date in enumerate(dates[lo:hi], lo) if date.endswith(suffix)]
+        regex = wildcard_regex(pattern)
+        return [i for i, date in enumerate(dates[lo:hi], lo) if regex.fullmatch(date)]
+
+    def prefix_range(self, prefix):
+        """
+        Devuelve el intervalo [lo, hi) de fechas que empiezan por "prefix".
+
+        """
+        size = len(prefix)
+        key = lambda date: date[:size]
+        lo = bisect.bisect_left(self.dates, prefix, key=key)
+        return lo, bisect.bisect_right(self.dates, prefix, lo=lo, key=key)
+
+    def between(self, first, last):
+        """
+        Devuelve las posiciones de las fechas del intervalo "first".."last". Los extremos pueden ser
+        parciales ('2015-03' incluye todo marzo) o vacios (intervalo abierto).
+
+        """
+        lo = bisect.bisect_left(self.dates, first) if first else 0
+        hi = self.prefix_range(last)[1] if last else len(self.dates)
+        return range(lo, max(lo, hi))
+
+    def runs_of(self, positions):
+        """
+        Devuelve las secuencias (inicio, fin) de las noticias de las fechas "positions" ordenadas.
+        Cada noticia tiene una sola fecha, por lo que las secuencias no se solapan.
+
+        """
+        runs, offsets = self.runs, self.offsets
+        if isinstance(positions, range):
+            spans = [(positions.start, positions.stop)] if len(positions) else []
+        else:
+            # las fechas consecutivas se leen de un solo tramo de "runs"
+            spans = []
+            for i in positions:
+                if spans and spans[-1][1] == i:
+                    spans[-1][1] = i + 1
+                else:
+                    spans.append([i, i + 1])
+        pairs = []
+        for lo, hi in spans:
+            chunk = runs[2 * offsets[lo]:2 * offsets[hi]]
+            pairs.extend(zip(chunk[::2], chunk[1::2]))
+        pairs.sort()
+        return pairs
+
+    def nbytes(self):
+        """
+        Memoria ocupada por las fechas (en utf-8), los offsets y las secuencias.
+
+        """
+        return (sum(len(date) for date in self.dates) + len(self.offsets) * self.offsets.itemsize +
+                len(self.runs) * self.runs.itemsize)
+
+    def to_bytes(self):
+        """
+        Serializa el indice: numero de fechas y de secuencias (uint64), "offsets" y "runs" en
+        little-endian y las fechas separadas por saltos de linea.
+
+        """
+        offsets, runs = array('I', self.offsets), array('I', self.runs)
+        if sys.byteorder == 'big':
+            offsets.byteswap()
+            runs.byteswap()
+        return (struct.pack('<QQ', len(self.dates), len(runs)) + offsets.tobytes() + runs.tobytes() +
+                '\n'.join(self.dates).encode('utf-8'))
+
+    @staticmethod
+    def from_buffer(buf, start, end):
+        """
+        Abre un indice serializado con to_bytes entre las posiciones "start" y "end" de "buf"
+        (un mmap). Son unas pocas fechas por dia de noticias y se copian a memoria: los arrays se
+        consultan mas rapido que la vista del mmap.
+
+        """
+        n, m = struct.unpack_from('<QQ', buf, start)
+        start += 16
+        offsets, runs = array('I'), array('I')
+        offsets.frombytes(buf[start:start + 4 * (n + 1)])
+        runs.frombytes(buf[start + 4 * (n + 1):start + 4 * (n + 1 + m)])
+        if sys.byteorder == 'big':
+            offsets.byteswap()
+            runs.byteswap()
+        text = buf[start + 4 * (n + 1 + m):end].decode('utf-8')
+        return DateIndex(text.split('\n') if n else [], offsets, runs)
+
+
+def wildcard_regex(pattern):
+    """
+    Expresion regular equivalente a un termino con comodines ('*' y '?').
+
+    """
+    return re.compile(re.escape(pattern).replace(r'\*', '.*').replace(r'\?', '.'))
+
+
+def in_date_range(date, first, last):
+    """
+    Indica si "date" esta en el intervalo "first".."last" de una query 'date:', con los mismos
+    extremos parciales o vacios que DateIndex.between.
+
+    """
+    return (not first or date >= first) and (not last or date[:len(last)] <= last)
+
+
+###################################
+###                             ###
+###        PESOS BM25           ###
+###                             ###
+###################################
+
+def bm25_scale(n):
+    """
+    Factor con el que se guardan los impactos BM25 como uint16: con "n" noticias ningun
+    impacto puede superar (k1 + 1) * idf(df=1), que se hace corresponder con 65535.
+
+    """
+    return 0xFFFF / ((BM25_K1 + 1) * math.log(1 + (max(n, 1) - 0.5) / 1.5))
+
+
+def bm25_record(posting, norms, n, scale, df=None):
+    """
+    Calcula los impactos BM25 de las noticias de una posting list:
+
+        idf(t) * tf * (k1 + 1) / (tf + k1 * (1 - b + b * dl / avgdl))
+
+    cuantizados con "scale" a uint16 (como minimo 1), de forma que la puntuacion de una
+    noticia es la suma de los impactos de los terminos de la query que contiene.
+
+    param:  "posting": Posting del termino
+            "norms": k1 * (1 - b + b * dl / avgdl) de cada noticia (indexado por newid)
+            "n": numero de noticias
+            "scale": factor de cuantizacion (ver bm25_scale)
+            "df": numero de noticias con el termino, por defecto las de "posting" (un indice con
+                  shards usa el de todos los shards, ver ShardedProject.rank_result)
+
+    return: registro con "order" (array('I') con las posiciones de la posting list ordenadas de
+            mayor a menor impacto) seguido de "impacts" (array('H') alineado con la posting list)
+
+    """
+    if df is None:
+        df = len(posting)
+    c = scale * math.log(1 + (n - df + 0.5) / (df + 0.5)) * (BM25_K1 + 1)
+    impacts = array('H', [max(1, int(c * tf / (tf + norms[newid]) + 0.5))
+                          for newid, tf in zip(posting.newids, posting.tfs())])
+    if len(impacts) == 1:
+        # la mayoria de terminos aparecen en una sola noticia
+        return FIRST + impacts.tobytes()
+    order = array('I', sorted(range(len(impacts)), key=impacts.__getitem__, reverse=True))
+    return order.tobytes() + impacts.tobytes()
+
+
+def decode_impacts(record):
+    """
+    Separa un registro de bm25_record en los arrays "order" e "impacts".
+
+    """
+    n = len(record) // 6
+    order, impacts = array('I'), array('H')
+    order.frombytes(record[:4 * n])
+    impacts.frombytes(record[4 * n:])
+    return order, impacts
+
+
+def top_k(result, lists, k):
+    """
+    Devuelve las "k" noticias de "result" con mayor puntuacion, suma de los impactos de cada
+    termino de la query, sin puntuar todas las noticias del resultado.
+
+    Las listas de impactos de cada termino estan ordenadas de mayor a menor impacto, por lo que
+    la suma de los impactos siguientes de cada lista es una cota superior de la puntuacion de
+    cualquier noticia aun no vista. Se avanza por la lista con mayor impacto siguiente,
+    cada noticia nueva se puntua con busquedas binarias en las demas listas y se guarda en un
+    heap de tamaño "k"; en cuanto la peor puntuacion del heap alcanza la cota se para.
+    Si el resultado es pequeño se puntuan directamente todas sus noticias.
+
+    param:  "result": array('I') ordenado con las noticias que cumplen la query
+            "lists": lista de tuplas (newids, order, impacts) de cada termino
+            "k": numero de noticias a devolver
+
+    return: lista de pares (newid, puntuacion cuantizada) de mayor a menor puntuacion;
+            las noticias sin ningun termino puntuado completan la lista con puntuacion 0
+
+    """
+    heap = []
+
+    def score(newid):
+        total = 0
+        for newids, _, impacts in lists:
+            i = bisect.bisect_left(newids, newid)
+            if i < len(newids) and newids[i] == newid:
+                total += impacts[i]
+        return total
+
+    def push(newid, s):
+        if len(heap) < k:
+            heapq.heappush(heap, (s, -newid))
+        elif (s, -newid) > heap[0]:
+            heapq.heapreplace(heap, (s, -newid))
+
+    if len(result) <= 4 * k:
+        for newid in result:
+            push(newid, score(newid))
+    else:
+        cursors = [0] * len(lists)
+        seen = set()
+        while True:
+            best, bound = -1, 0
+            for j, (_, order, impacts) in enumerate(lists):
+                if cursors[j] < len(order):
+                    impact = impacts[order[cursors[j]]]
+                    bound += impact
+                    if best < 0 or impact > lists[best][2][lists[best][1][cursors[best]]]:
+                        best = j
+            if best < 0 or (len(heap) == k and heap[0][0] >= bound):
+                break
+            newids, order, _ = lists[best]
+            newid = newids[order[cursors[best]]]
+            cursors[best] += 1
+            if newid in seen:
+                continue
+            seen.add(newid)
+            i = bisect.bisect_left(result, newid)
+            if i < len(result) and result[i] == newid:
+                push(newid, score(newid))
+
+    ranked = [(-newid, s) for s, newid in sorted(heap, reverse=True)]
+    if len(ranked) < k:
+        # noticias del resultado que no contienen ningun termino puntuado
+        found = {newid for newid, _ in ranked}
+        for newid in result:
+            if len(ranked) == k:
+                break
+            if newid not in found:
+                ranked.append((newid, 0))
+    return ranked
+
+
+###################################
+###                             ###
+###   ALMACEN DE DOCUMENTOS     ###
+###                             ###
+###################################
+
+# campos de cada noticia que se guardan en el almacen de documentos
+STORED_FIELDS = ('date', 'title', 'keywords', 'url', 'article')
+
+
+def store_record(new, bounds):
+    """
+    Construye el registro comprimido (zlib) de una noticia para el almacen de documentos:
+    longitud (uint32) del JSON con los campos STORED_FIELDS, el JSON y el inicio y el fin de
+    cada token del cuerpo en un array 'H' (o 'I' si el cuerpo tiene mas de 65535 caracteres)
+    little-endian, precedido de su typecode. Leer las posiciones es copiar el array.
+
+    param:  "new": diccionario de la noticia
+            "bounds": inicio y fin de cada token de new['article'] (inicio0, fin0, inicio1, ...),
+                      ver SAR_Project.tokenize_bounds
+
+    """
+    doc = json.dumps({field: new.get(field, '') for field in STORED_FIELDS},
+                     ensure_ascii=False).encode('utf-8')
+    bounds = array('H' if len(new['article']) < 1 << 16 else 'I', bounds)
+    if sys.byteorder == 'big':
+        bounds.byteswap()
+    return zlib.compress(struct.pack('<I', len(doc)) + doc + bounds.typecode.encode() + bounds.tobytes())
+
+
+def read_store_record(record, bounds=True):
+    """
+    Decodifica un registro de store_record.
+
+    param:  "record": registro del almacen
+            "bounds": si es False no se decodifican los tokens del cuerpo
+
+    return: diccionario con los campos STORED_FIELDS y 'bounds', array con el inicio y el fin
+            de cada token del cuerpo de la noticia (inicio0, fin0, inicio1, fin1, ...)
+
+    """
+    buf = zlib.decompress(record)
+    size = struct.unpack_from('<I', buf)[0]
+    new = json.loads(buf[4:4 + size])
+    if bounds:
+        new['bounds'] = array(chr(buf[4 + size]), buf[5 + size:])
+        if sys.byteorder == 'big':
+            new['bounds'].byteswap()
+    return new
+
+
+###################################
+###                             ###
+###   FORMATO BINARIO DE INDICE ###
+###                             ###
+###################################
+
+# Fichero de indice: cabecera (INDEX_MAGIC, INDEX_VERSION, offset de la tabla de secciones),
+# secciones consecutivas y, al final, la tabla de secciones (pickle de {nombre: (offset, longitud)}).
+# Los enteros se guardan en little-endian y los array('I') con el orden de bytes de la maquina.
+INDEX_MAGIC = b'SARIDX\x00\x00'
+INDEX_VERSION = 4
+INDEX_HEADER = struct.Struct('<8sIQ')
+
+
+class IndexWriter:
+    """
+    Escribe un fichero de indice seccion a seccion, sin necesidad de tener todo el contenido en memoria.
+
+    """
+
+    def __init__(self, filename):
+        self.fh = open(filename, 'wb')
+        self.fh.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, 0))
+        self.sections = {}
+
+    def add(self, name, data):
+        """
+        Añade una seccion completa "name" con el contenido "data" (bytes).
+
+        """
+        start = self.fh.tell()
+        self.fh.write(data)
+        self.sections[name] = (start, len(data))
+
+    def add_table(self, name, items):
+        """
+        Añade una seccion "name" con una tabla de registros de longitud variable.
+        Los registros se escriben segun llegan del iterable "items"; despues se escriben los
+        offsets de inicio de cada registro (uint64, uno mas que registros) y el numero de registros.
+
+        """
+        fh = self.fh
+        start = fh.tell()
+        ptrs = array('Q', [0])
+        for record in items:
+            fh.write(record)
+            ptrs.append(fh.tell() - start)
+        if sys.byteorder == 'big':
+            ptrs.byteswap()
+        fh.write(ptrs.tobytes())
+        fh.write(struct.pack('<Q', len(ptrs) - 1))
+        self.sections[name] = (start, fh.tell() - start)
+
+    def add_blob_table(self, name, blob, ptrs):
+        """
+        Añade una seccion "name" con el mismo formato que add_table a partir de los registros
+        ya concatenados en "blob" y sus offsets "ptrs" (array('Q') empezando en 0).
+
+        """
+        start = self.fh.tell()
+        self.fh.write(blob)
+        if sys.byteorder == 'big':
+            ptrs = array('Q', ptrs)
+            ptrs.byteswap()
+        self.fh.write(ptrs.tobytes())
+        self.fh.write(struct.pack('<Q', len(ptrs) - 1))
+        self.sections[name] = (start, self.fh.tell() - start)
+
+    def add_postings(self, field, items, terms=True):
+        """
+        Añade las secciones 'terms:<field>' y 'postings:<field>' a partir de un iterable de pares
+        (termino en utf-8, posting serializada) ordenado por termino. Las posting lists se escriben
+        segun llegan; los terminos se acumulan en un unico bloque de bytes y se escriben al final.
+        Si "terms" es False no se escribe 'terms:<field>': el diccionario del campo se guarda
+        despues en el lexicon compartido (ver add_lexicon).
+
+        return: lista ordenada de los terminos escritos
+
+
+        """
+        blob = bytearray()
+        ptrs = array('Q', [0])
+
+        def postings():
+            for term, posting in items:
+                blob.extend(term)
+                ptrs.append(len(blob))
+                yield posting
+
+        self.add_table('postings:' + field, postings())
+        if terms:
+            self.add_blob_table('terms:' + field, blob, ptrs)
+        return [blob[ptrs[i]:ptrs[i + 1]].decode('utf-8') for i in range(len(ptrs) - 1)]
+
+    def add_lexicon(self, name, field_terms):
+        """
+        Añade el lexicon compartido "name" con la union ordenada de los terminos de varios campos
+        y, por cada campo, la seccion 'tids:<campo>': array('I') con el identificador en el lexicon
+        de cada termino del campo, alineado con su seccion 'postings:<campo>'.
+
+        param:  "name": nombre de la seccion del lexicon
+                "field_terms": diccionario campo --> lista ordenada de terminos del campo
+
+        return: lista ordenada de los terminos del lexicon
+
+        """
+        lexicon = sorted(set().union(*field_terms.values()))
+        self.add(name, BlockLexicon.to_bytes(lexicon))
+        tid = {term: i for i, term in enumerate(lexicon)}
+        for field, terms in field_terms.items():
+            tids = array('I', [tid[term] for term in terms])
+            if sys.byteorder == 'big':
+                tids.byteswap()
+            self.add('tids:' + field, tids.tobytes())
+        return lexicon
+
+    def close(self):
+        fh = self.fh
+        table = fh.tell()
+        fh.write(pickle.dumps(self.sections))
+        fh.seek(0)
+        fh.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, table))
+        fh.close()
+
+
+def section_range(section):
+    """
+    Convierte una entrada (offset, longitud) de la tabla de secciones en el par (inicio, fin).
+
+    """
+    start, length = section
+    return start, start + length
+
+
+def map_index_file(filename):
+    """
+    Proyecta en memoria un fichero de indice escrito con IndexWriter.
+
+    return: tupla (mmap, tabla de secciones), o None si el fichero no tiene el formato binario
+
+    """
+    with open(filename, 'rb') as fh:
+        magic, version, table = INDEX_HEADER.unpack(fh.read(INDEX_HEADER.size))
+        if magic != INDEX_MAGIC:
+            return None
+        if version != INDEX_VERSION:
+            raise ValueError("%s: unsupported index version %d" % (filename, version))
+        mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+    return mm, pickle.loads(mm[table:])
+
+
+def map_lexicon(mm, sections, name):
+    """
+    Devuelve el lexicon compartido "name" de un fichero de indice proyectado en memoria.
+
+    """
+    return BlockLexicon(mm, *section_range(sections[name]))
+
+
+def map_field_index(mm, sections, field, lexicon):
+    """
+    Devuelve el MappedIndex del campo "field" de un fichero de indice proyectado en memoria,
+    sobre el lexicon compartido "lexicon".
+
+    """
+    start, end = section_range(sections['tids:' + field])
+    tids = memoryview(mm)[start:end].cast('I')
+    if sys.byteorder == 'big':
+        tids = array('I', tids)
+        tids.byteswap()
+    return MappedIndex(lexicon, tids, MappedTable(mm, *sections['postings:' + field]))
+
+
+def map_stem_memo(mm, sections):
+    """
+    Devuelve el diccionario termino --> stem de todo el lexicon de un fichero de indice proyectado
+    en memoria, a partir de la seccion 'stemids' (ver SAR_Project.save).
+
+    """
+    stems = [sys.intern(stem) for stem in map_lexicon(mm, sections, 'lexicon:stem')]
+    start, end = section_range(sections['stemids'])
+    ids = array('I', mm[start:end])
+    if sys.byteorder == 'big':
+        ids.byteswap()
+    return {sys.intern(term): stems[i] for term, i in zip(map_lexicon(mm, sections, 'lexicon'), ids)}
+
+
+def map_permuterm(mm, sections, lexicon):
+    """
+    Devuelve el Permuterm del lexicon compartido de un fichero de indice proyectado en memoria.
+
+    """
+    return Permuterm.from_buffer(lexicon, mm, sections['permuterm'][0])
+
+
+class MappedTable:
+    """
+    Acceso de solo lectura a una seccion escrita con IndexWriter.add_table sobre un mmap.
+    El registro i-esimo se obtiene con dos lecturas de offsets, sin recorrer la seccion.
+
+    """
+
+    def __init__(self, mm, start, length):
+        self.mm = mm
+        self.start = start
+        end = start + length
+        self.count = struct.unpack_from('<Q', mm, end - 8)[0]
+        self.ptrs = end - 8 - 8 * (self.count + 1)
+
+    def __len__(self):
+        return self.count
+
+    def bounds(self, i):
+        """
+        Devuelve los offsets (absolutos en el mmap) de inicio y fin del registro i.
+
+        """
+        a, b = struct.unpack_from('<QQ', self.mm, self.ptrs + 8 * i)
+        return self.start + a, self.start + b
+
+    def __getitem__(self, i):
+        a, b = self.bounds(i)
+        return self.mm[a:b]
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self[i]
+
+
+class MappedIndex(Mapping):
+    """
+    Indice invertido de un campo (termino --> Posting) leido bajo demanda de un fichero de indice.
+
+    El diccionario de terminos es el lexicon compartido por todos los campos (BlockLexicon); el
+    campo solo guarda el array ordenado "tids" con el identificador de sus terminos en el lexicon,
+    alineado con sus posting lists. Un termino se localiza con una busqueda binaria en el lexicon
+    y otra en "tids"; solo se decodifica la posting list de los terminos que se consultan.
+
+    """
+
+    def __init__(self, lexicon, tids, postings):
+        self.lexicon = lexicon
+        self.tids = tids
+        self.postings = postings
+        # termino --> Posting de los ultimos POSTING_CACHE terminos consultados
+        self.cache = OrderedDict()
+
+    def find(self, term):
+        """
+        Devuelve la posicion de "term" en el diccionario del campo, -1 si no esta.
+
+        """
+        tid = self.lexicon.find(term)
+        if tid < 0:
+            return -1
+        i = bisect.bisect_left(self.tids, tid)
+        if i < len(self.tids) and self.tids[i] == tid:
+            return i
+        return -1
+
+    def posting(self, i):
+        """
+        Decodifica la posting list del i-esimo termino.
+
+        """
+        a, b = self.postings.bounds(i)
+        return Posting.from_bytes(self.postings.mm, a, b)
+
+    def __getitem__(self, term):
+        posting = self.cache.get(term)
+        if posting is not None:
+            self.cache.move_to_end(term)
+            return posting
+        i = self.find(term)
+        if i < 0:
+            raise KeyError(term)
+        posting = self.cache[term] = self.posting(i)
+        if len(self.cache) > POSTING_CACHE:
+            self.cache.popitem(last=False)
+        return posting
+
+    def __contains__(self, term):
+        return term in self.cache or self.find(term) >= 0
+
+    def prefix_positions(self, prefix):
+        """
+        Devuelve el intervalo [a, b) de posiciones en el diccionario del campo de los terminos que
+        empiezan por "prefix": son un intervalo del lexicon ordenado y, por tanto, de "tids".
+
+        """
+        lo, hi = self.lexicon.prefix_range(prefix)
+        a = bisect.bisect_left(self.tids, lo)
+        return a, bisect.bisect_left(self.tids, hi, a)
+
+    def select(self, tids):
+        """
+        Devuelve, ordenados, los identificadores del lexicon de "tids" que son terminos del campo.
+
+        """
+        found, lo = [], 0
+        for tid in sorted(tids):
+            lo = bisect.bisect_left(self.tids, tid, lo)
+            if lo == len(self.tids):
+                break
+            if self.tids[lo] == tid:
+                found.append(tid)
+        return found
+
+    def __len__(self):
+        return len(self.tids)
+
+    def __iter__(self):
+        for tid in self.tids:
+            yield self.lexicon[tid]
+
+    def values(self):
+        # recorrer todo el indice no debe llenar la cache
+        for i in range(len(self.tids)):
+            yield self.posting(i)
+
+    def items(self):
+        for i, tid in enumerate(self.tids):
+            yield self.lexicon[tid], self.posting(i)
+
+
+# terminos por bloque del lexicon con codificacion frontal, ver BlockLexicon
+LEXICON_BLOCK = 16
+
+# inicio de la region R1 del stemmer de Snowball en castellano y vocales que pueden llevar tilde
+# en los terminos de un stem, ver SAR_Project.stem_positions
+STEM_R1 = re.compile('[aeiouáéíóúü][^aeiouáéíóúü]')
+ACCENTS = {'a': 'aá', 'e': 'eé', 'i': 'ií', 'o': 'oó', 'u': 'uú'}
+
+
+class BlockLexicon:
+    """
+    Lexicon compartido por los campos: terminos ordenados como secuencia de str (identificador -->
+    termino) guardados con codificacion frontal por bloques de LEXICON_BLOCK terminos.
+
+    El primer termino de cada bloque se guarda entero en el indice de bloques; los demas, como el
+    numero de bytes que comparten con el anterior y los bytes que faltan (variable-byte). Un termino
+    se localiza con una busqueda binaria en el indice de bloques, que se lee a memoria la primera
+    vez que se usa, y recorriendo un solo bloque. El identificador de un termino es su posicion en
+    el lexicon, el mismo que usan las secciones 'tids:<campo>' y el indice permuterm.
+
+    Formato de la seccion: numero de terminos, terminos por bloque y bytes del indice de bloques
+    (uint64 little-endian), el primer termino de cada bloque separados por saltos de linea, los
+    offsets de los bloques (array('I'), uno mas que bloques) y los bloques.
+    """
+
+    __slots__ = ('buf', 'size', 'count', 'block', 'heads_range', 'data', 'heads', 'offsets', 'last')
+
+    def __init__(self, buf, start, end):
+        self.buf = buf
+        self.size = end - start
+        self.count, self.block, size = struct.unpack_from('<QQQ', buf, start)
+        self.heads_range = (start + 24, start + 24 + size)
+        blocks = -(-self.count // self.block)
+        self.data = start + 24 + size + 4 * (blocks + 1)
+        self.heads = None
+        self.offsets = None
+        # ultimo bloque decodificado, los recorridos en orden decodifican cada bloque una vez
+        self.last = (-1, None)
+
+    @staticmethod
+    def to_bytes(terms, block=LEXICON_BLOCK):
+        """
+        Codifica la secuencia ordenada de terminos "terms" con el formato de la seccion.
+
+        """
+        heads, offsets, data = [], array('I', [0]), bytearray()
+        prev = b''
+        count = 0
+        for count, term in enumerate(terms, 1):
+            term = term.encode('utf-8')
+            if (count - 1) % block == 0:
+                if heads:
+                    offsets.append(len(data))
+                heads.append(term)
+            else:
+                shared = len(os.path.commonprefix((prev, term)))
+                vbyte_encode(shared, data)
+                vbyte_encode(len(term) - shared, data)
+                data += term[shared:]
+            prev = term
+        if heads:
+            offsets.append(len(data))
+        if sys.byteorder == 'big':
+            offsets.byteswap()
+        blob = b'\n'.join(heads)
+        return struct.pack('<QQQ', count, block, len(blob)) + blob + offsets.tobytes() + bytes(data)
+
+    def block_index(self):
+        """
+        Devuelve el primer termino (bytes) de cada bloque, leyendo el indice de bloques la primera vez.
+
+        """
+        if self.heads is None:
+            a, b = self.heads_range
+            heads = self.buf[a:b].split(b'\n') if self.count else []
+            offsets = array('I')
+            offsets.frombytes(self.buf[b:b + 4 * (len(heads) + 1)])
+            if sys.byteorder == 'big':
+                offsets.byteswap()
+            self.offsets = offsets
+            self.heads = heads
+        return self.heads
+
+    def block_terms(self, b):
+        """
+        Decodifica los terminos (bytes) del bloque "b".
+
+        """
+        last = self.last
+        if last[0] == b:
+            return last[1]
+        heads = self.block_index()
+        offsets = self.offsets
+        data = self.buf[self.data + offsets[b]:self.data + offsets[b + 1]]
+        term = heads[b]
+        terms = [term]
+        pos, end = 0, len(data)
+        while pos < end:
+            shared = data[pos]
+            if shared < 0x80:
+                pos += 1
+            else:
+                shared, pos = vbyte_decode(data, pos)
+            n = data[pos]
+            if n < 0x80:
+                pos += 1
+            else:
+                n, pos = vbyte_decode(data, pos)
+            term = term[:shared] + data[pos:pos + n]
+            pos += n
+            terms.append(term)
+        self.last = (b, terms)
+        return terms
+
+    def __len__(self):
+        return self.count
+
+    def term_bytes(self, i):
+        """
+        Devuelve el termino de identificador "i" en utf-8.
+
+        """
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        return self.block_terms(i // self.block)[i % self.block]
+
+    def __getitem__(self, i):
+        return self.term_bytes(i).decode('utf-8')
+
+    def __iter__(self):
+        for b in range(len(self.block_index())):
+            for term in self.block_terms(b):
+                yield term.decode('utf-8')
+
+    def position(self, key):
+        """
+        Devuelve el identificador del primer termino mayor o igual que "key" (bytes), como
+        bisect_left sobre todo el lexicon.
+
+        """
+        b = bisect.bisect_right(self.block_index(), key) - 1
+        if b < 0:
+            return 0
+        for j, term in enumerate(self.block_terms(b)):
+            if term >= key:
+                return b * self.block + j
+        return min((b + 1) * self.block, self.count)
+
+    def find(self, term):
+        """
+        Devuelve el identificador de "term" en el lexicon, -1 si no esta. El bloque se decodifica
+        solo hasta llegar al termino.
+
+        """
+        key = term.encode('utf-8')
+        heads = self.block_index()
+        b = bisect.bisect_right(heads, key) - 1
+        if b < 0:
+            return -1
+        term = heads[b]
+        if term == key:
+            return b * self.block
+        data = self.buf[self.data + self.offsets[b]:self.data + self.offsets[b + 1]]
+        pos, end, i = 0, len(data), b * self.block
+        while pos < end:
+            shared = data[pos]
+            if shared < 0x80:
+                pos += 1
+            else:
+                shared, pos = vbyte_decode(data, pos)
+            n = data[pos]
+            if n < 0x80:
+                pos += 1
+            else:
+                n, pos = vbyte_decode(data, pos)
+            term = term[:shared] + data[pos:pos + n]
+            pos += n
+            i += 1
+            if term >= key:
+                return i if term == key else -1
+        return -1
+
+    def prefix_range(self, prefix):
+        """
+        Devuelve el intervalo [lo, hi) de identificadores de los terminos que empiezan por "prefix".
+        El byte 0xFF no aparece en utf-8, por lo que prefix + 0xFF es mayor que todos ellos.
+
+        """
+        key = prefix.encode('utf-8')
+        return self.position(key), self.position(key + b'\xff')
+
+    def terms_of(self, tids):
+        """
+        Devuelve los terminos de los identificadores ordenados "tids" decodificando cada bloque una vez.
+
+        """
+        return [self[tid] for tid in tids]
+
+    def nbytes(self):
+        """
+        Bytes de la seccion: cabecera, indice de bloques, offsets y bloques.
+
+        """
+        return self.size
+
+    def index_nbytes(self):
+        """
+        Memoria del indice de bloques una vez leido: la lista de primeros terminos y los offsets.
+
+        """
+        heads = self.block_index()
+        return (sys.getsizeof(heads) + sum(sys.getsizeof(head) for head in heads) +
+                len(self.offsets) * self.offsets.itemsize)
+
+
+class MappedImpacts(Mapping):
+    """
+    Impactos BM25 (termino --> registro de bm25_record) de un campo leidos del mmap. La tabla
+    esta alineada con el diccionario de terminos del MappedIndex "index" del mismo campo.
+
+    """
+
+    def __init__(self, index, table):
+        self.index = index
+        self.table = table
+
+    def __getitem__(self, term):
+        i = self.index.find(term)
+        if i < 0:
+            raise KeyError(term)
+        return self.table[i]
+
+    def __len__(self):
+        return len(self.table)
+
+    def __iter__(self):
+        return iter(self.index)
+
+
+class MappedNews(Mapping):
+    """
+    Tabla de noticias (newid --> [docid, posicion en el fichero]) leida del mmap: numero de noticias
+    (uint64) seguido de un par de uint32 por newid. Los newid borrados tienen docid DELETED.
+
+    """
+
+    def __init__(self, mm, start, length):
+        self.mm = mm
+        self.start = start + 8
+        self.live = struct.unpack_from('<Q', mm, start)[0]
+        self.count = (length - 8) // 8
+
+    def __getitem__(self, newid):
+        if 0 <= newid < self.count:
+            entry = struct.unpack_from('<II', self.mm, self.start + 8 * newid)
+            if entry[0] != DELETED:
+                return list(entry)
+        raise KeyError(newid)
+
+    def __len__(self):
+        return self.live
+
+    def __iter__(self):
+        if self.live == self.count:
+            return iter(range(self.count))
+        return (newid for newid in range(self.count) if newid in self)
+
+
+class MappedDocs(Mapping):
+    """
+    Tabla de documentos (docid --> ruta del fichero) leida de una tabla del mmap.
+    Los docid de ficheros reindexados tienen una ruta vacia.
+
+    """
+
+    def __init__(self, table):
+        self.table = table
+
+    def __getitem__(self, docid):
+        if 0 <= docid < len(self.table):
+            filename = self.table[docid]
+            if filename:
+                return filename.decode('utf-8')
+        raise KeyError(docid)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __iter__(self):
+        # los docid de ficheros reindexados se guardan vacios
+        return (docid for docid in range(len(self.table)) if docid in self)
+
+
+class LazyFields(Mapping):
+    """
+    Diccionario campo --> indice de un fichero de indice cargado que abre cada campo la primera
+    vez que se consulta, llamando a "opener" con su nombre. Una query solo abre los campos que usa.
+
+    """
+
+    def __init__(self, fields, opener):
+        self.fields = list(fields)
+        self.opener = opener
+        self.opened = {}
+
+    def __getitem__(self, field):
+        value = self.opened.get(field)
+        if value is None:
+            if field not in self.fields:
+                raise KeyError(field)
+            value = self.opened[field] = self.opener(field)
+        return value
+
+    def __contains__(self, field):
+        return field in self.fields
+
+    def __len__(self):
+        return len(self.fields)
+
+    def __iter__(self):
+        return iter(self.fields)
+
+
+def read_sections(filename):
+    """
+    Lee la tabla de secciones de un fichero de indice sin proyectarlo en memoria.
+
+    """
+    with open(filename, 'rb') as fh:
+        _, _, table = INDEX_HEADER.unpack(fh.read(INDEX_HEADER.size))
+        fh.seek(table)
+        return pickle.loads(fh.read())
+
+
+def read_table(filename, section):
+    """
+    Lee secuencialmente, sin proyectar el fichero en memoria, los registros de una
+    tabla escrita con IndexWriter.add_table.
+
+    param:  "filename": fichero de indice
+            "section": nombre de la seccion
+
+    return: generador de registros (bytes)
+
+    """
+    with open(filename, 'rb') as fh:
+        _, _, table = INDEX_HEADER.unpack(fh.read(INDEX_HEADER.size))
+        fh.seek(table)
+        start, length = pickle.loads(fh.read())[section]
+        fh.seek(start + length - 8)
+        count = struct.unpack('<Q', fh.read(8))[0]
+        fh.seek(start + length - 8 - 8 * (count + 1))
+        ptrs = array('Q')
+        ptrs.frombytes(fh.read(8 * (count + 1)))
+        if sys.byteorder == 'big':
+            ptrs.byteswap()
+        fh.seek(start)
+        for i in range(count):
+            yield fh.read(ptrs[i + 1] - ptrs[i])
+
+
+def query_node(op, children):
+    """
+    Construye un nodo 'and' u 'or' del arbol sintactico de una query, uniendo los hijos
+    que ya son del mismo operador. Con un solo hijo devuelve el hijo.
+
+    """
+    flat = []
+    for child in children:
+        flat.extend(child[1] if child[0] == op else [child])
+    return flat[0] if len(flat) == 1 else (op, tuple(flat))
+
+
+def phrase_starts(starts, positions, offset, last=False):
+    """
+    Devuelve las posiciones de inicio de "starts" (ordenadas) en las que el termino aparece
+    "offset" posiciones despues, recorriendo a la vez "starts" y el iterador ordenado "positions".
+    Con "last" se para en la primera coincidencia.
+
+    """
+    res = []
+    position = next(positions, None)
+    for start in starts:
+        wanted = start + offset
+        while position is not None and position < wanted:
+            position = next(positions, None)
+        if position is None:
+            break
+        if position == wanted:
+            res.append(start)
+            if last:
+                break
+    return res
+
+
+def canonical_query(node):
+    """
+    Forma normalizada de un nodo del arbol sintactico para usarla como clave de la cache:
+    los operandos de AND y OR se ordenan, ya que el resultado no depende de su orden.
+
+    """
+    if node[0] in ('and', 'or'):
+        return (node[0], tuple(sorted((canonical_query(child) for child in node[1]), key=repr)))
+    if node[0] == 'not':
+        return ('not', canonical_query(node[1]))
+    return node
+
+
+def read_terms(filename, field):
+    """
+    Lee secuencialmente los terminos (bytes) del campo "field" de un fichero de indice: de su
+    seccion 'terms:<field>' en los runs de SPIMI, o del lexicon compartido en un indice guardado
+    (el indice del que se parte en modo append). Los campos 'stem:<campo>' usan el lexicon de stems.
+
+    """
+    sections = read_sections(filename)
+    if 'terms:' + field in sections:
+        yield from read_table(filename, 'terms:' + field)
+        return
+    with open(filename, 'rb') as fh:
+        fh.seek(sections['tids:' + field][0])
+        tids = array('I', fh.read(sections['tids:' + field][1]))
+    if sys.byteorder == 'big':
+        tids.byteswap()
+    mm, sections = map_index_file(filename)
+    try:
+        lexicon = map_lexicon(mm, sections, 'lexicon:stem' if field.startswith('stem:') else 'lexicon')
+        # los identificadores estan ordenados, cada bloque del lexicon se decodifica una vez
+        for tid in tids:
+            yield lexicon.term_bytes(tid)
+    finally:
+        mm.close()
+
+
+def run_stream(run, filename, field):
+    """
+    Recorre un run de SPIMI como tuplas (termino, numero de run, posting serializada) para heapq.merge.
+
+    """
+    terms = read_terms(filename, field)
+    postings = read_table(filename, 'postings:' + field)
+    for term, data in zip(terms, postings):
+        yield term, run, data
+
+
+def news_files(root):
+    """
+    Recorre recursivamente el directorio "root" en el orden de os.walk.
+
+    return: generador de las rutas de los ficheros de noticias (.json)
+
+    """
+    for dir, subdirs, files in os.walk(root):
+        for filename in files:
+            if filename.endswith('.json'):
+                yield os.path.join(dir, filename)
+
+
+# espacios en blanco entre los elementos de un array JSON
+JSON_SPACES = re.compile(r'[ \t\n\r]*')
+json_decoder = json.JSONDecoder()
+
+
+def iter_json_array(text):
+    """
+    Parsea un array JSON de forma incremental con JSONDecoder.raw_decode: cada elemento se
+    decodifica cuando se pide, sin construir antes la lista completa.
+
+    return: generador de los elementos del array
+
+    """
+    pos = JSON_SPACES.match(text).end()
+    if text[pos:pos + 1] != '[':
+        raise ValueError('expected a JSON array')
+    pos = JSON_SPACES.match(text, pos + 1).end()
+    if text[pos:pos + 1] == ']':
+        return
+    while True:
+        item, pos = json_decoder.raw_decode(text, pos)
+        yield item
+        pos = JSON_SPACES.match(text, pos).end()
+        if text[pos:pos + 1] == ']':
+            return
+        if text[pos:pos + 1] != ',':
+            raise ValueError("expected ',' or ']' at position %d" % pos)
+        pos = JSON_SPACES.match(text, pos + 1).end()
+
+
+def iter_news(data):
+    """
+    Genera las noticias del contenido "data" (bytes) de un fichero de noticias, de una en una
+    (ver iter_json_array): nunca se construye la lista con todas las noticias del fichero.
+
+    """
+    return iter_json_array(data.decode('utf-8'))
+
+
+def read_ahead(filenames, depth):
+    """
+    Lee el contenido de los ficheros "filenames" en un hilo, hasta "depth" ficheros por delante
+    del que se esta procesando, para que la lectura de disco se solape con la indexacion
+    (la lectura libera el GIL). Con "depth" 0 se leen en el propio hilo al pedirlos.
+
+    return: generador de pares (fichero, contenido en bytes)
+
+    """
+    if depth <= 0:
+        for filename in filenames:
+            with open(filename, 'rb') as fh:
+                yield filename, fh.read()
+        return
+
+    files = queue.Queue(depth)
+    stop = threading.Event()
+
+    def reader():
+        try:
+            for filename in filenames:
+                if stop.is_set():
+                    return
+                with open(filename, 'rb') as fh:
+                    files.put((filename, fh.read()))
+        except OSError as e:
+            files.put(e)
+        files.put(None)
+
+    thread = threading.Thread(target=reader, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = files.get()
+            if item is None:
+                return
+            if isinstance(item, OSError):
+                raise item
+            yield item
+    finally:
+        # si se deja de leer antes del final, se vacia la cola para que el hilo pueda terminar
+        stop.set()
+        while thread.is_alive():
+            try:
+                files.get(timeout=0.01)
+            except queue.Empty:
+                pass
+
+
+def index_batch(task):
+    """
+    Indexa un lote de ficheros en un proceso de self.index_files_parallel.
+
+    param:  "task": tupla (opciones de indexacion, lista de ficheros)
+
+    return: SAR_Project parcial con docids y newids locales al lote
+
+    """
+    options, filenames = task
+    partial = SAR_Project()
+    partial.set_index_options(options)
+    partial.set_profile(options['profile'])
+    for filename in filenames:
+        partial.index_file(filename)
+    if partial.profile is not None:
+        # los metodos instrumentados no se pueden enviar, solo los tiempos
+        profile = partial.profile
+        partial.set_profile(False)
+        partial.profile = profile
+    # el stemmer se vuelve a crear cuando hace falta, no hay que enviarlo al proceso principal
+    partial.stemmer = None
+    return partial
+
+
+def subexpressions(node):
+    """
+    Devuelve el conjunto de formas normalizadas (canonical_query) de los nodos de un arbol
+    que se guardan en la cache de subexpresiones: todos salvo los terminos simples.
+
+    """
+    found = set()
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if node[0] == 'term':
+            continue
+        found.add(canonical_query(node))
+        if node[0] == 'not':
+            stack.append(node[1])
+        elif node[0] in ('and', 'or'):
+            stack.extend(node[1])
+    return found
+
+
+# indice de cada proceso de SAR_Project.solve_batch, se carga una vez en batch_init
+batch_searcher = None
+
+
+def batch_init(filename, options):
+    """
+    Carga el indice en un proceso de SAR_Project.solve_batch. El fichero se proyecta con mmap,
+    por lo que todos los procesos comparten sus paginas.
+
+    param:  "filename": fichero de indice
+            "options": opciones de busqueda, ver SAR_Project.search_options
+
+    """
+    global batch_searcher
+    batch_searcher = SAR_Project.load(filename)
+    batch_searcher.set_search_options(options)
+
+
+def batch_solve(task):
+    """
+    Resuelve un grupo de queries en un proceso de SAR_Project.solve_batch.
+
+    param:  "task": tupla (lista de queries, True si solo se cuentan los resultados)
+
+    """
+    chunk, count_only = task
+    return batch_searcher.solve_chunk(chunk, count_only)
+
+
+# shards abiertos en cada proceso de ShardedProject.fan_out --> clave: fichero, valor: SAR_Project
+shard_searchers = {}
+
+
+def shard_call(task):
+    """
+    Llama a un metodo del indice de un shard en un proceso de ShardedProject.fan_out. El shard se
+    abre (con mmap) la primera vez que el proceso lo necesita y se queda abierto, con su cache de
+    subexpresiones, para las queries siguientes.
+
+    param:  "task": tupla (fichero del shard, opciones de busqueda, nombre del metodo, argumentos)
+
+    """
+    filename, options, method, args = task
+    project = shard_searchers.get(filename)
+    if project is None:
+        project = shard_searchers[filename] = SAR_Project.load(filename)
+    if project.search_options() != options:
+        project.set_search_options(options)
+    return getattr(project, method)(*args)
+
+
+def shard_cache_counts():
+    """
+    return: diccionario fichero --> (aciertos, fallos, entradas) de la cache de subexpresiones de
+            cada shard abierto en un proceso de ShardedProject.fan_out
+
+    """
+    return {filename: (project.cache_hits, project.cache_misses, len(project.cache))
+            for filename, project in shard_searchers.items()}
+
+
+def query_label(node):
+    """
+    Texto de un nodo del arbol sintactico en la traza de una query: el operador o la hoja
+    tal y como se escribiria en la query.
+
+    """
+    if node[0] in ('and', 'or', 'not'):
+        return node[0].upper()
+    prefix = '' if node[1] == 'article' else node[1] + ':'
+    if node[0] == 'phrase':
+        return '%s"%s"' % (prefix, ' '.join(node[2]))
+    if node[0] == 'range':
+        return prefix + '..'.join(node[2])
+    return prefix + node[2]
+
+
+class Profile:
+    """
+    Instrumentacion de un SAR_Project activada con set_profile (opcion --profile):
+
+        - tiempo acumulado y numero de llamadas de cada etapa de la indexacion y de la busqueda
+          (ver SAR_Project.PROFILE_STAGES); el tiempo de una etapa incluye el de las etapas que
+          se llaman desde ella
+        - traza de cada query: un registro por nodo evaluado con su profundidad en el arbol,
+          el numero de noticias del resultado, el tiempo y si se ha sacado de la cache
+
+    Los metodos medidos se sustituyen en la instancia por versiones con temporizador, por lo que
+    sin --profile no se ejecuta nada de esta clase.
+
+    """
+
+    def __init__(self, out=None):
+        self.timers = {}  # etapa --> segundos
+        self.calls = {}  # etapa --> numero de llamadas
+        self.trace = []  # [profundidad, nodo, noticias, segundos, nota] de la query en curso
+        self.inner = []  # tiempo de los nodos evaluados dentro de cada nodo de la traza sin terminar
+        self.estimating = 0
+        self.pending = {}  # hoja evaluada al estimar --> (noticias, segundos)
+        self.out = out  # fichero donde se escribe la traza de cada query, None para no escribirla
+
+    def add(self, stage, seconds, calls=1):
+        self.timers[stage] = self.timers.get(stage, 0.0) + seconds
+        self.calls[stage] = self.calls.get(stage, 0) + calls
+
+    def merge(self, other):
+        """
+        Suma los tiempos de otro Profile (el de un proceso de indexacion en paralelo).
+
+        """
+        for stage, seconds in other.timers.items():
+            self.add(stage, seconds, other.calls[stage])
+
+    def timed(self, stage, fnc):
+        """
+        Devuelve "fnc" acumulando su tiempo en la etapa "stage".
+
+        """
+        def timed_call(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                result = fnc(*args, **kwargs)
+            finally:
+                self.add(stage, time.perf_counter() - t0)
+            if isinstance(result, GeneratorType):
+                # el trabajo de un generador se hace al pedir cada elemento
+                return self.timed_iter(stage, result)
+            return result
+        return timed_call
+
+    def timed_iter(self, stage, iterator):
+        while True:
+            t0 = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add(stage, time.perf_counter() - t0, 0)
+                return
+            self.add(stage, time.perf_counter() - t0, 0)
+            yield item
+
+    def traced_solve(self, fnc):
+        """
+        Devuelve SAR_Project.solve_query empezando una traza nueva en cada query.
+
+        """
+        def traced_solve(query, prev={}):
+            self.trace = []
+            self.pending = {}
+            t0 = time.perf_counter()
+            answer = fnc(query, prev)
+            elapsed = time.perf_counter() - t0
+            self.add('query', elapsed)
+            # hojas estimadas que ningun operador ha llegado a usar (un AND vacio para antes)
+            for node, (news, seconds) in self.pending.items():
+                self.trace.append([1, node, news, seconds, 'not used'])
+            if self.out is not None:
+                self.show_trace(query, len(answer), elapsed, self.out)
+            return answer
+        return traced_solve
+
+    def traced_estimate(self, fnc):
+        """
+        Devuelve SAR_Project.estimate_query marcando que las hojas que se evaluan son para
+        estimar el orden de evaluacion (ver traced_eval).
+
+        """
+        def traced_estimate(node, leaves):
+            self.estimating += 1
+            try:
+                return fnc(node, leaves)
+            finally:
+                self.estimating -= 1
+        return traced_estimate
+
+    def traced_eval(self, project, fnc):
+        """
+        Devuelve SAR_Project.eval_query añadiendo a la traza cada nodo evaluado.
+
+        Las hojas se evaluan al estimar el tamaño de los operandos de su padre; su tiempo se
+        guarda aparte y se apunta en la traza cuando el operador las usa, debajo de el. El tiempo
+        propio de cada operador se acumula al terminar el nodo (ver timed_node).
+
+        """
+        def traced_eval(node, leaves):
+            if self.estimating or node in leaves:
+                fresh = node not in leaves
+                t0 = time.perf_counter()
+                answer = fnc(node, leaves)
+                if fresh:
+                    self.pending[node] = (len(answer), self.timed_node(node, time.perf_counter() - t0))
+                elif not self.estimating and node in self.pending:
+                    news, seconds = self.pending.pop(node)
+                    self.trace.append([len(self.inner), node, news, seconds, ''])
+                return answer
+            cached = node[0] != 'term' and project.cache_size and project.cache_key(node) in project.cache
+            if cached:
+                # una hoja estimada con la cache no pasa a "leaves": se apunta solo aqui, no como no usada
+                self.pending.pop(node, None)
+            entry = [len(self.inner), node, 0, 0.0, 'cache' if cached else '']
+            self.trace.append(entry)
+            self.inner.append(0.0)
+            t0 = time.perf_counter()
+            try:
+                answer = fnc(node, leaves)
+            finally:
+                inner = self.inner.pop()
+            entry[2] = len(answer)
+            entry[3] = self.timed_node(node, time.perf_counter() - t0, inner)
+            return answer
+        return traced_eval
+
+    def timed_node(self, node, seconds, inner=0.0):
+        """
+        Acumula el tiempo propio de un nodo (sin el de los nodos evaluados dentro de el, "inner")
+        en la etapa de su operador y lo suma al nodo que lo contiene.
+
+        """
+        self.add('operator: ' + node[0], seconds - inner)
+        if self.inner:
+            self.inner[-1] += seconds
+        return seconds
+
+    def show_trace(self, query, count, elapsed, file):
+        print("query '%s': %d news in %.3f ms" % (query, count, elapsed * 1000), file=file)
+        for depth, node, news, seconds, note in self.trace:
+            print("\t%10.3f ms %9d  %s%s%s" % (seconds * 1000, news, '  ' * depth, query_label(node),
+                                               ' (%s)' % note if note else ''), file=file)
+
+    def show(self, file=None):
+        for stage, seconds in self.timers.items():
+            print("\t%s: %.3f ms (%d calls)" % (stage, seconds * 1000, self.calls[stage]), file=file)
+
+
+class SAR_Project:
+    """
+    Prototipo de la clase para realizar la indexacion y la recuperacion de noticias
+
+        Preparada para todas las ampliaciones:
+          parentesis + multiples indices + posicionales + stemming + permuterm + ranking de resultado
+
+    Se deben completar los metodos que se indica.
+    Se pueden añadir nuevas variables y nuevos metodos
+    Los metodos que se añadan se deberan documentar en el codigo y explicar en la memoria
+    """
+
+    # lista de campos, el booleano indica si se debe tokenizar el campo
+    # NECESARIO PARA LA AMPLIACION MULTIFIELD
+    fields = [("title", True), ("date", False),
+              ("keywords", True), ("article", True),
+              ("summary", True)]
+    field_names = [field for field, _ in fields]
+
+    # numero maximo de documento a mostrar cuando self.show_all es False
+    SHOW_MAX = 10
+
+    def __init__(self):
+        """
+        Constructor de la classe SAR_Indexer.
+        NECESARIO PARA LA VERSION MINIMA
+
+        Incluye todas las variables necesaria para todas las ampliaciones.
+        Puedes añadir más variables si las necesitas
+
+        """
+        self.index = {}  # hash para el indice invertido de terminos --> clave: termino, valor: posting list.
+        # Si se hace la implementacion multifield, se pude hacer un segundo nivel de hashing de tal forma que:
+        # self.index['title'] seria el indice invertido del campo 'title'.
+        self.sindex = {}  # hash para el indice invertido de stems --> clave: campo, valor: diccionario stem --> Posting
+        # lexicon compartido por todos los campos: secuencia ordenada de terminos (identificador --> termino)
+        # y de stems; el fichero de indice guarda un solo diccionario y cada campo los identificadores
+        # de sus terminos (ver IndexWriter.add_lexicon y MappedIndex)
+        self.lexicon = None
+        self.stem_lexicon = None
+        self.ptindex = None  # indice permuterm (Permuterm) sobre el lexicon compartido.
+        self.dindex = None  # indice de fechas (DateIndex) del campo 'date', ver self.get_dates()
+        # diccionario de documentos --> clave: entero(docid),  valor: ruta del fichero.
+        self.docs = {}
+        # hash de terminos para el pesado, ranking de resultados --> clave: campo ('stem:<campo>' para
+        # los stems), valor: diccionario termino --> impactos BM25 (ver bm25_record)
+        self.weight = {}
+        # numero de tokens de cada noticia --> clave: campo, valor: array('I') indexado por newid
+        self.lengths = {}
+        # hash de noticias --> clave entero (newid), valor: la info necesaria para diferenciar la noticia dentro de su fichero (doc_id y posición dentro del documento)
+        self.news = {}
+        # expresion regular para hacer la tokenizacion: los tokens son las secuencias de caracteres
+        # alfanumericos, lo mismo que separar por "\W+"
+        self.tokenizer = re.compile(r"\w+")
+        # la misma expresion con grupo para re.split: separadores y tokens alternados, ver self.tokenize_bounds
+        self.token_splitter = re.compile(r"(\w+)")
+        self.tokens_indexed = 0
+        # almacen de documentos: registros comprimidos de cada noticia indexados por newid, ver store_record
+        self.store = []
+        # expresion regular para separar una query en parentesis, terminos y secuencias entre comillas
+        self.query_tokenizer = re.compile(r'\(|\)|[^\s()"]*"[^"]*"|[^\s()]+')
+        self.stemmer = None  # stemmer en castellano, se crea la primera vez que se usa (ver self.stem())
+        self.stem_memo = {}  # termino --> stem, compartido por todos los campos, ver self.stem()
+        self.stemming_time = 0.0
+        self.show_all = False  # valor por defecto, se cambia con self.set_showall()
+        self.show_snippet = False  # valor por defecto, se cambia con self.set_snippet()
+        self.use_stemming = False  # valor por defecto, se cambia con self.set_stemming()
+        self.use_ranking = False  # valor por defecto, se cambia con self.set_ranking()
+        self.engine = 'python'  # valor por defecto, se cambia con self.set_engine()
+
+        self.docid = 0
+        self.news_counter = 0
+
+        # opciones de indexacion, se fijan en self.index_dir()
+        self.multifield = False
+        self.positional = False
+        self.stemming = False
+        self.permuterm = False
+        self.indexed_fields = []
+        self.memory_budget = None
+        self.prefetch = READ_AHEAD
+
+        # SPIMI: runs volcados a disco y memoria estimada del indice en memoria
+        self.runs = []
+        self.run_dir = None
+        self.index_bytes = 0
+
+        # ficheros indexados --> clave: ruta absoluta, valor: (tamaño, mtime, docid)
+        self.files = {}
+        # newids de las noticias de ficheros que han cambiado, se eliminan al guardar el indice
+        self.deleted = set()
+        self.appending = False
+        # mapa de bits con todas las noticias, ver self.all_news()
+        self.universe = None
+        # cache LRU de subexpresiones --> clave: (stemming, motor, nodo normalizado), valor: posting list
+        self.cache = OrderedDict()
+        self.cache_size = 256  # valor por defecto, se cambia con self.set_cache()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # instrumentacion (Profile), None si no esta activada, se cambia con self.set_profile()
+        self.profile = None
+        # (mmap, tabla de secciones) del fichero de un indice cargado, ver self.map_sections()
+        self.mapped = None
+        # lo que se abre bajo demanda --> clave: stemmer, campo o permuterm, valor: segundos, ver self.timed_load()
+        self.load_times = OrderedDict()
+        # ranking como shard de un ShardedProject --> clave: campo o (campo, estadisticas de la coleccion),
+        # valor: estadisticas del campo en este indice o parametros de bm25_record, ver self.rank_shard()
+        self.bm25_cache = {}
+    ###############################
+    ###                         ###
+    ###      CONFIGURACION      ###
+    ###                         ###
+    ###############################
+
+    def set_showall(self, v):
+        """
+
+        Cambia el modo de mostrar los resultados.
+
+        input: "v" booleano.
+
+        UTIL PARA TODAS LAS VERSIONES
+
+        si self.show_all es True se mostraran todos los resultados el lugar de un maximo de self.SHOW_MAX, no aplicable a la opcion -C
+
+        """
+        self.show_all = v
+
+    def set_snippet(self, v):
+        """
+
+        Cambia el modo de mostrar snippet.
+
+        input: "v" booleano.
+
+        UTIL PARA TODAS LAS VERSIONES
+
+        si self.show_snippet es True se mostrara un snippet de cada noticia, no aplicable a la opcion -C
+
+        """
+        self.show_snippet = v
+
+    def set_stemming(self, v):
+        """
+
+        Cambia el modo de stemming por defecto.
+
+        input: "v" booleano.
+
+        UTIL PARA LA VERSION CON STEMMING
+
+        si self.use_stemming es True las consultas se resolveran aplicando stemming por defecto.
+
+        """
+        self.use_stemming = v
+
+    def set_ranking(self, v):
+        """
+
+        Cambia el modo de ranking por defecto.
+
+        input: "v" booleano.
+
+        UTIL PARA LA VERSION CON RANKING DE NOTICIAS
+
+        si self.use_ranking es True las consultas se mostraran ordenadas, no aplicable a la opcion -C
+
+        """
+        self.use_ranking = v
+
+    def set_engine(self, v):
+        """
+
+        Cambia el motor con el que se combinan las posting lists.
+
+        input: "v" cadena, 'python' o 'numpy'.
+
+        con 'numpy' and_posting, or_posting y minus_posting usan operaciones vectorizadas de numpy
+        y los AND de varios operandos se resuelven con una unica interseccion n-aria.
+        Los resultados son los mismos que con 'python'.
+
+        """
+        if v == 'numpy' and not import_numpy():
+            raise ValueError("the numpy engine needs numpy installed")
+        self.engine = v
+
+    def set_cache(self, v):
+        """
+
+        Cambia el tamaño de la cache de subexpresiones.
+
+        input: "v" entero, numero maximo de subexpresiones guardadas; 0 desactiva la cache.
+
+        cada subexpresion de una query que no sea un termino simple (AND, OR, NOT, frases y comodines)
+        se guarda ya resuelta; cuando esta llena se descarta la usada hace mas tiempo.
+
+        """
+        self.cache_size = v
+        while len(self.cache) > v:
+            self.cache.popitem(last=False)
+
+    # metodos que se miden con self.set_profile --> etapa en la que se acumula su tiempo
+    PROFILE_STAGES = {'read_files': 'wait for files', 'read_news': 'read json', 'tokenize': 'tokenize', 'tokenize_bounds': 'tokenize',
+                      'index_content': 'postings', 'stem_postings': 'stemming', 'make_weights': 'weights',
+                      'make_permuterm': 'permuterm', 'flush_run': 'SPIMI runs', 'merge_partial': 'merge partial',
+                      'save': 'save', 'rank_result': 'ranking', 'fetch_news': 'document store',
+                      'make_snippet': 'snippets'}
+    # metodos que se sustituyen para la traza de cada query
+    PROFILE_HOOKS = ('solve_query', 'estimate_query', 'eval_query')
+
+    def set_profile(self, v, out=None):
+        """
+
+        Activa o desactiva la instrumentacion (opcion --profile).
+
+        input: "v" booleano.
+               "out": fichero donde se escribe la traza de cada query, None para no escribirla.
+
+        los metodos de self.PROFILE_STAGES y self.PROFILE_HOOKS se sustituyen en la instancia
+        por versiones que miden su tiempo (ver Profile); al desactivarla se vuelven a usar los de
+        la clase, por lo que sin instrumentacion no hay ningun coste.
+
+        """
+        for name in list(self.PROFILE_STAGES) + list(self.PROFILE_HOOKS):
+            self.__dict__.pop(name, None)
+        self.profile = None
+        if not v:
+            return
+        profile = self.profile = Profile(out)
+        for name, stage in self.PROFILE_STAGES.items():
+            setattr(self, name, profile.timed(stage, getattr(self, name)))
+        self.solve_query = profile.traced_solve(self.solve_query)
+        self.estimate_query = profile.traced_estimate(self.estimate_query)
+        self.eval_query = profile.traced_eval(self, self.eval_query)
+
+    def show_profile(self, file=None):
+        """
+        Muestra los tiempos de cada etapa medidos con self.set_profile.
+
+        """
+        print("PROFILE (the time of a stage includes the stages called from it):", file=file)
+        self.profile.show(file)
+
+    def clear_cache(self):
+        """
+        Vacia la cache de subexpresiones, se llama cada vez que cambia el indice.
+
+        """
+        self.cache.clear()
+
+    def search_options(self):
+        """
+        Devuelve las opciones de busqueda fijadas con los metodos set_*, para copiarlas a otro
+        SAR_Project con self.set_search_options.
+
+        """
+        return {'showall': self.show_all, 'snippet': self.show_snippet, 'stemming': self.use_stemming,
+                'ranking': self.use_ranking, 'engine': self.engine, 'cache': self.cache_size}
+
+    def set_search_options(self, options):
+        for name, value in options.items():
+            getattr(self, 'set_' + name)(value)
+
+    ###############################
+    ###                         ###
+    ###   PARTE 1: INDEXACION   ###
+    ###                         ###
+    ###############################
+
+    def index_dir(self, root, **args):
+        """
+        NECESARIO PARA TODAS LAS VERSIONES
+
+        Recorre recursivamente el directorio "root" e indexa su contenido
+        los argumentos adicionales "**args" solo son necesarios para las funcionalidades ampliadas
+
+        """
+
+        self.set_index_options(args)
+        # en modo append solo se indexan los ficheros nuevos o modificados
+        filenames = [fullname for fullname in news_files(root) if self.check_file(fullname)]
+        self.index_files(filenames, args.get('jobs') or 1)
+
+        ##########################################
+        ## COMPLETAR PARA FUNCIONALIDADES EXTRA ##
+        ##########################################
+
+    def index_files(self, filenames, jobs=1):
+        """
+        Indexa la lista de ficheros "filenames" con las opciones ya fijadas (self.set_index_options)
+        y calcula los stems, pesos y permuterms del indice en memoria.
+
+        param:  "filenames": ficheros de noticias en el orden en que se indexan
+                "jobs": numero de procesos
+
+        """
+        if jobs > 1:
+            self.index_files_parallel(filenames, jobs)
+        else:
+            for fullname, data in self.read_files(filenames):
+                self.index_file(fullname, data)
+                self.check_memory()
+
+        # con SPIMI el diccionario de terminos no esta completo hasta mezclar los runs al guardar
+        if self.stemming and not self.runs:
+            self.make_stemming()
+        if not self.runs:
+            self.make_weights()
+            self.make_dates()
+        if self.permuterm and not self.runs:
+            self.make_permuterm()
+
+    def set_index_options(self, args):
+        """
+        Fija las opciones de indexacion a partir de los argumentos de self.index_dir
+        y crea el indice vacio de cada campo que se va a indexar.
+        Al añadir a un indice existente (self.start_append) se mantienen sus opciones.
+
+        param:  "args": diccionario con los argumentos 'multifield', 'positional', 'stem' y 'permuterm'
+
+        """
+        # presupuesto de memoria (en MB) del indice en memoria, SPIMI si se indica
+        memory = args.get('memory')
+        self.memory_budget = memory * 2**20 if memory else None
+        # ficheros que se leen por delante en un hilo mientras se indexa (ver read_ahead)
+        prefetch = args.get('prefetch')
+        self.prefetch = READ_AHEAD if prefetch is None else prefetch
+        if self.appending:
+            return
+
+        self.multifield = args['multifield']
+        self.positional = args['positional']
+        self.stemming = args['stem']
+        self.permuterm = args['permuterm']
+
+        # campos que se indexan: todos con multifield, solo 'article' en otro caso
+        self.indexed_fields = [(field, tokenize) for field, tokenize in self.fields
+                               if self.multifield or field == 'article']
+        for field, _ in self.indexed_fields:
+            self.index.setdefault(field, {})
+            self.lengths.setdefault(field, array('I'))
+
+    def start_append(self, filename):
+        """
+        Prepara un indice cargado con SAR_Project.load para añadirle ficheros nuevos.
+
+        El indice existente se trata como el primer run de SPIMI: los ficheros nuevos se indexan
+        en memoria y al guardar se mezclan con el, sin reconstruir lo ya indexado.
+        Los docid y newid siguen a partir de los ultimos asignados.
+
+        param:  "filename": fichero del indice cargado
+
+        """
+        self.appending = True
+        self.clear_cache()
+        if self.stemming and self.mapped is not None and 'stemids' in self.mapped[1]:
+            # los terminos ya indexados no se vuelven a pasar por el stemmer
+            self.stem_memo = map_stem_memo(*self.mapped)
+        self.runs = [filename]
+        self.index = {field: {} for field, _ in self.indexed_fields}
+        self.sindex = {}
+        self.lexicon = None
+        self.stem_lexicon = None
+        self.ptindex = None
+        self.dindex = None
+        self.mapped = None
+        self.weight = {}
+        # los documentos del indice cargado se copian de su almacen al guardar; si no tiene
+        # almacen (indice antiguo) se dejan registros vacios y se leen de los ficheros JSON
+        self.store = [] if self.store is not None else [b''] * self.news_counter
+        self.docs = dict(self.docs.items())
+        self.news = dict(self.news.items())
+
+    def check_file(self, filename):
+        """
+        Decide si hay que indexar un fichero comparando su tamaño y fecha de modificacion
+        con los de la ultima vez que se indexo. Si el fichero ha cambiado, sus noticias
+        anteriores se marcan como borradas y se volvera a indexar con un docid nuevo.
+
+        param:  "filename": ruta del fichero
+
+        return: True si el fichero es nuevo o ha cambiado
+
+        """
+        stat = os.stat(filename)
+        known = self.files.get(os.path.abspath(filename))
+        if known is not None:
+            size, mtime, docid = known
+            if (size, mtime) == (stat.st_size, stat.st_mtime_ns):
+                return False
+            self.delete_doc(docid)
+        return True
+
+    def delete_doc(self, docid):
+        """
+        Marca como borradas las noticias del fichero "docid".
+
+        """
+        for newid in [newid for newid, (doc, _) in self.news.items() if doc == docid]:
+            del self.news[newid]
+            self.deleted.add(newid)
+        del self.docs[docid]
+
+    def index_files_parallel(self, filenames, jobs):
+        """
+        Indexa "filenames" repartiendo lotes consecutivos de ficheros entre "jobs" procesos.
+
+        Cada proceso construye un indice parcial con docids y newids locales (ver index_batch).
+        Los indices parciales se reciben en el orden de los lotes y se añaden al indice desplazando
+        sus identificadores, por lo que los docid y newid son los mismos que en la indexacion secuencial.
+
+        param:  "filenames": lista de ficheros en el orden en que se indexarian secuencialmente
+                "jobs": numero de procesos
+
+        """
+        options = {'multifield': self.multifield, 'positional': self.positional,
+                   'stem': self.stemming, 'permuterm': self.permuterm, 'profile': self.profile is not None}
+        size = max(1, math.ceil(len(filenames) / jobs))
+        batches = [(options, filenames[i:i + size]) for i in range(0, len(filenames), size)]
+        # multiprocessing solo se importa con -j, el buscador no lo necesita
+        import multiprocessing
+        with multiprocessing.Pool(jobs) as pool:
+            for partial in pool.imap(index_batch, batches):
+                self.merge_partial(partial)
+                self.check_memory()
+
+    def merge_partial(self, partial):
+        """
+        Añade al final del indice un indice parcial construido por index_batch.
+
+        param:  "partial": SAR_Project con docids y newids empezando en 0
+
+        """
+        for docid in range(partial.docid):
+            self.docs[self.docid + docid] = partial.docs[docid]
+            self.register_file(partial.docs[docid], self.docid + docid)
+        for newid in range(partial.news_counter):
+            docid, pos = partial.news[newid]
+            self.news[self.news_counter + newid] = [self.docid + docid, pos]
+        self.store.extend(partial.store)
+        for field, _ in self.indexed_fields:
+            self.lengths[field].extend(partial.lengths[field])
+            index = self.index[field]
+            for term, other in partial.index[field].items():
+                posting = index.get(term)
+                if posting is None:
+                    # se reutiliza la posting parcial, solo hay que desplazar sus newid
+                    other.shift(self.news_counter)
+                    index[term] = other
+                else:
+                    posting.extend(other, self.news_counter)
+        self.docid += partial.docid
+        self.news_counter += partial.news_counter
+        self.index_bytes += partial.index_bytes
+        self.tokens_indexed += partial.tokens_indexed
+        if self.profile is not None and partial.profile is not None:
+            # tiempo de CPU sumado de todos los procesos
+            self.profile.merge(partial.profile)
+        self.clear_cache()
+
+    def check_memory(self):
+        """
+        SPIMI: si el indice en memoria supera el presupuesto de memoria, lo vuelca a disco como un run.
+
+        """
+        if self.memory_budget and self.index_bytes > self.memory_budget:
+            self.flush_run()
+
+    def flush_run(self):
+        """
+        SPIMI: escribe el indice en memoria en un fichero temporal (run) ordenado por termino,
+        con el mismo formato que el indice final, y vacia el indice en memoria.
+        Como las noticias se indexan por orden de newid, cada run contiene newids mayores
+        que los del run anterior.
+
+        """
+        if self.run_dir is None:
+            self.run_dir = tempfile.mkdtemp(prefix='sar_runs_')
+        filename = os.path.join(self.run_dir, 'run%05d.bin' % len(self.runs))
+        writer = IndexWriter(filename)
+        for field, _ in self.indexed_fields:
+            writer.add_postings(field, self.sorted_postings(field))
+            if self.stemming:
+                # los stems de cada run se mezclan al guardar como los terminos, ver self.save
+                sindex = self.stem_postings(self.index[field].items())
+                writer.add_postings('stem:' + field, ((stem.encode('utf-8'), sindex[stem].to_bytes())
+                                                      for stem in sorted(sindex)))
+            self.index[field] = {}
+        # las noticias de un run son los newid consecutivos indexados desde el run anterior
+        writer.add_table('store', self.store)
+        self.store = []
+        writer.close()
+        self.runs.append(filename)
+        self.index_bytes = 0
+
+    def merge_runs(self, field):
+        """
+        SPIMI: mezcla k-way de los runs del campo "field". Cada run se lee secuencialmente
+        del fichero, por lo que solo se tiene en memoria una posting list por run.
+        Las posting lists de un mismo termino se concatenan en el orden de los runs y se eliminan
+        las noticias borradas (self.deleted); los terminos que se quedan sin noticias desaparecen.
+
+        return: generador de pares (termino en utf-8, posting serializada) ordenado por termino
+
+        """
+        streams = [run_stream(run, filename, field) for run, filename in enumerate(self.runs)]
+
+        current, posting = None, None
+        for term, _, data in heapq.merge(*streams):
+            if term != current:
+                if current is not None and len(posting):
+                    yield current, posting.to_bytes()
+                current, posting = term, Posting()
+            other = Posting.from_bytes(data, 0, len(data))
+            if self.deleted:
+                other = other.without(self.deleted)
+            posting.extend(other, 0)
+        if current is not None and len(posting):
+            yield current, posting.to_bytes()
+
+    def index_file(self, filename, data=None):
+        """
+        NECESARIO PARA TODAS LAS VERSIONES
+
+        Indexa el contenido de un fichero.
+
+        Para tokenizar la noticia se debe llamar a "self.tokenize"
+
+        Dependiendo del valor de "self.multifield" y "self.positional" se debe ampliar el indexado.
+        En estos casos, se recomienda crear nuevos metodos para hacer mas sencilla la implementacion
+
+        input: "filename" es el nombre de un fichero en formato JSON Arrays (https://www.w3schools.com/js/js_json_arrays.asp).
+                Una vez parseado con json.load tendremos una lista de diccionarios, cada diccionario se corresponde a una noticia
+               "data": contenido del fichero si ya se ha leido (ver self.read_files)
+
+        Las noticias se parsean de una en una a medida que se indexan (ver self.read_news).
+
+        """
+
+        jlist = self.read_news(filename, data)
+        self.docs[self.docid] = filename
+        self.register_file(filename, self.docid)
+
+        # "jlist" es una lista con tantos elementos como noticias hay en el fichero,
+        # cada noticia es un diccionario con los campos:
+        #      "title", "date", "keywords", "article", "summary"
+        #
+        # En la version basica solo se debe indexar el contenido "article"
+        # COMPLETAR: asignar identificador al fichero 'filename'
+        myCounter = 0
+        for new in jlist:
+            self.news[self.news_counter] = [self.docid, myCounter]
+            for field, tokenize in self.indexed_fields:
+                if not tokenize:
+                    content = [new[field]]
+                elif field == 'article':
+                    # los limites de los tokens para el almacen de documentos salen de la misma pasada
+                    content, bounds = self.tokenize_bounds(new[field])
+                else:
+                    content = self.tokenize(new[field])
+                self.index_content(self.index[field], content, self.news_counter)
+                self.lengths[field].append(len(content))
+                self.tokens_indexed += len(content)
+
+            record = store_record(new, bounds)
+            self.store.append(record)
+            self.index_bytes += len(record)
+
+            self.news_counter += 1
+            myCounter += 1
+        self.clear_cache()
+
+        self.docid += 1
+
+    def read_files(self, filenames):
+        """
+        Recorre el contenido de "filenames" leyendo self.prefetch ficheros por delante en un hilo.
+
+        return: generador de pares (fichero, contenido en bytes)
+
+        """
+        return read_ahead(filenames, self.prefetch)
+
+    def read_news(self, filename, data=None):
+        """
+        Parsea las noticias de un fichero JSON de una en una (ver iter_news).
+
+        param:  "filename": fichero de noticias
+                "data": su contenido en bytes, si es None se lee el fichero
+
+        return: generador de noticias (diccionarios)
+
+        """
+        if data is None:
+            with open(filename, 'rb') as fh:
+                data = fh.read()
+        yield from iter_news(data)
+
+    def register_file(self, filename, docid):
+        """
+        Guarda el tamaño y la fecha de modificacion del fichero "filename" indexado con "docid",
+        para no volver a indexarlo al añadir ficheros nuevos si no ha cambiado.
+
+        """
+        stat = os.stat(filename)
+        self.files[os.path.abspath(filename)] = (stat.st_size, stat.st_mtime_ns, docid)
+
+    def index_content(self, index, content, newid):
+        """
+        Añade a la posting list de cada termino de "content" la noticia "newid".
+
+        Primero se agrupan las posiciones de cada termino dentro de la noticia y despues se
+        añade una sola entrada por termino a su Posting. Las posiciones solo se guardan si
+        el indice es posicional; si no lo es basta con contar los tokens (Counter, en C).
+
+        param:  "index": diccionario termino --> Posting del campo que se indexa
+                "content": lista de tokens del campo
+                "newid": identificador de la noticia
+
+        """
+        if not self.positional:
+            counts = Counter(content)
+            for term, tf in counts.items():
+                posting = index.get(term)
+                if posting is None:
+                    # la misma cadena la comparten los diccionarios de todos los campos y los stems
+                    posting = index[sys.intern(term)] = Posting()
+                    self.index_bytes += POSTING_BYTES + len(term)
+                posting.add(newid, tf)
+            self.index_bytes += 9 * len(counts)
+            return
+
+        terms = {}
+        for position, token in enumerate(content, 1):
+            # Grouping the positions of every token in the news
+            positions = terms.get(token)
+            if positions is None:
+                terms[token] = [position]
+            else:
+                positions.append(position)
+
+        for term, positions in terms.items():
+            posting = index.get(term)
+            # Checking if token does not exist in any news
+            if posting is None:
+                posting = index[sys.intern(term)] = Posting()
+                self.index_bytes += POSTING_BYTES + len(term)
+            posting.add(newid, len(positions), positions)
+            self.index_bytes += 9 + len(positions)
+
+    def tokenize(self, text):
+        """
+        NECESARIO PARA TODAS LAS VERSIONES
+
+        Tokeniza la cadena "texto" eliminando simbolos no alfanumericos y dividientola por espacios.
+        Puedes utilizar la expresion regular 'self.tokenizer'.
+
+        params: 'text': texto a tokenizar
+
+        return: lista de tokens
+
+        """
+        return self.tokenizer.findall(text.lower())
+
+    def tokenize_bounds(self, text):
+        """
+        Tokeniza "text" como self.tokenize y, en la misma pasada, calcula el inicio y el fin de
+        cada token en "text" para el almacen de documentos.
+
+        re.split con un grupo devuelve los separadores y los tokens alternados (el primer y el
+        ultimo separador pueden ser vacios), por lo que las sumas acumuladas de sus longitudes
+        son los limites de los tokens. Si text.lower() cambia la longitud del texto (algunos
+        caracteres fuera del ASCII) los limites se calculan sobre el texto original.
+
+        return: tupla (lista de tokens, lista (inicio0, fin0, inicio1, fin1, ...))
+
+        """
+        lowered = text.lower()
+        parts = self.token_splitter.split(lowered)
+        if len(lowered) == len(text):
+            bounds = list(accumulate(map(len, parts[:-1])))
+        else:
+            bounds = [bound for m in self.tokenizer.finditer(text) for bound in m.span()]
+        return parts[1::2], bounds
+
+    def make_stemming(self):
+        """
+        NECESARIO PARA LA AMPLIACION DE STEMMING.
+
+        Crea el indice de stemming (self.sindex) para los terminos de todos los indices.
+
+        self.stemmer.stem(token) devuelve el stem del token
+
+        Cada termino se pasa por el stemmer una sola vez (ver self.stem) y cada stem guarda la
+        union de las posting lists de sus terminos (ver Posting.merge_tf), de forma que una
+        consulta con stemming solo necesita una posting list por termino.
+
+        """
+        for field, _ in self.indexed_fields:
+            self.sindex[field] = self.stem_postings(self.index[field].items())
+
+    def stem(self, term):
+        """
+        Devuelve el stem de "term" recordando los ya calculados, el stemmer de nltk es lento.
+
+        """
+        stem = self.stem_memo.get(term)
+        if stem is None:
+            if self.stemmer is None:
+                self.stemmer = self.timed_load('stemmer', spanish_stemmer)
+            stem = self.stem_memo[term] = sys.intern(self.stemmer.stem(term))
+        return stem
+
+    def stem_postings(self, items):
+        """
+        Construye las posting lists de los stems a partir de los pares (termino, Posting) "items":
+        los terminos se agrupan por stem y las posting lists de cada grupo se unen una sola vez.
+        El tiempo empleado se acumula en self.stemming_time.
+
+        return: diccionario stem --> Posting
+
+        """
+        t0 = time.perf_counter()
+        groups = {}
+        for term, posting in items:
+            stem = self.stem(term)
+            group = groups.get(stem)
+            if group is None:
+                groups[stem] = [posting]
+            else:
+                group.append(posting)
+        sindex = {stem: Posting.merge_tf(postings) for stem, postings in groups.items()}
+        self.stemming_time += time.perf_counter() - t0
+        return sindex
+
+    def merged_items(self, items, name, field):
+        """
+        Recorre los pares (termino o stem en utf-8, posting serializada) de los runs mezclados que
+        se guardan en self.save, calculando a la vez sus pesos BM25 (self.weight[name]) con las
+        longitudes del campo "field".
+
+        """
+        params = self.bm25_params(field)
+        weights = self.weight[name] = {}
+        for term, data in items:
+            weights[term.decode('utf-8')] = bm25_record(Posting.from_bytes(data, 0, len(data)), *params)
+            yield term, data
+
+    def make_weights(self):
+        """
+        Calcula los pesos BM25 (self.weight) de los terminos, y de los stems si hay stemming,
+        de todos los indices: un impacto por noticia de cada posting list y el orden de las
+        noticias de mayor a menor impacto, para resolver el ranking sin recorrer todo el resultado.
+
+        """
+        for field, _ in self.indexed_fields:
+            params = self.bm25_params(field)
+            self.weight[field] = {term: bm25_record(posting, *params)
+                                  for term, posting in self.index[field].items()}
+            if self.stemming:
+                self.weight['stem:' + field] = {stem: bm25_record(posting, *params)
+                                                for stem, posting in self.sindex[field].items()}
+
+    def bm25_params(self, field, stats=None):
+        """
+        Devuelve los parametros comunes de bm25_record para el campo "field":
+        (normalizacion por longitud de cada noticia, numero de noticias, factor de cuantizacion).
+
+        param:  "stats": (suma de longitudes, numero de noticias) de la coleccion, por defecto
+                         las de este indice (ver self.length_stats)
+
+        """
+        lengths = self.lengths[field]
+        total, n = self.length_stats(field) if stats is None else stats
+        avgdl = max(total / max(n, 1), 1)
+        norms = [BM25_K1 * (1 - BM25_B + BM25_B * length / avgdl) for length in lengths]
+        return norms, n, bm25_scale(n)
+
+    def length_stats(self, field):
+        """
+        return: tupla (suma de las longitudes del campo "field" de las noticias, numero de noticias)
+
+        """
+        lengths = self.lengths[field]
+        return sum(lengths[newid] for newid in self.news), len(self.news)
+
+    def make_permuterm(self):
+        """
+        NECESARIO PARA LA AMPLIACION DE PERMUTERM
+
+        Crea el indice permuterm (self.ptindex) para los terminos de todos los indices.
+
+        Se construye una sola vez sobre el lexicon compartido por los campos; las rotaciones
+        apuntan a la posicion del termino en el lexicon, que es la misma que tendra en el fichero
+        de indice (ver Permuterm y self.save). Cada campo filtra sus terminos (self.permuterm_terms).
+
+        """
+        lexicon = self.get_lexicon()
+        self.ptindex = Permuterm.build(lexicon, self.permuterm_tids(lexicon, self.index))
+
+    def append_permuterm(self, lexicon, field_terms):
+        """
+        Modo append: construye el indice permuterm del lexicon "lexicon" a partir del guardado en
+        el indice del que se parte (self.runs[0]). Solo se ordenan las rotaciones de los terminos
+        nuevos; las de los terminos que desaparecen o dejan de rotarse se descartan (ver Permuterm.merge).
+
+        param:  "lexicon": lexicon compartido que se guarda
+                "field_terms": diccionario campo --> terminos del campo
+
+        """
+        rotated = self.permuterm_tids(lexicon, field_terms)
+        mm, sections = map_index_file(self.runs[0])
+        try:
+            if 'permuterm' not in sections:
+                return Permuterm.build(lexicon, rotated)
+            old_lexicon = map_lexicon(mm, sections, 'lexicon')
+            old = map_permuterm(mm, sections, old_lexicon)
+            tid = {term: i for i, term in enumerate(lexicon)}
+            rotated, old_rotated = set(rotated), set(old.tids)
+            tid_map = array('i', [-1]) * len(old_lexicon)
+            for old_tid, term in enumerate(old_lexicon):
+                new_tid = tid.get(term)
+                if new_tid in rotated and old_tid in old_rotated:
+                    tid_map[old_tid] = new_tid
+            ptindex = Permuterm.merge(old, lexicon, tid_map, sorted(rotated.difference(tid_map)))
+            # las rotaciones de "old" son vistas del mmap, se liberan antes de cerrarlo
+            del old
+            return ptindex
+        finally:
+            mm.close()
+
+    def permuterm_tids(self, lexicon, field_terms):
+        """
+        Devuelve los identificadores del lexicon que se rotan en el indice permuterm: las fechas
+        que solo son terminos del campo 'date' se buscan en el indice de fechas (self.dindex).
+
+        param:  "lexicon": lexicon compartido
+                "field_terms": diccionario campo --> terminos del campo
+
+        """
+        if 'date' not in field_terms:
+            return range(len(lexicon))
+        dates = set(field_terms['date']).difference(*(terms for field, terms in field_terms.items()
+                                                      if field != 'date'))
+        return [tid for tid, term in enumerate(lexicon) if term not in dates]
+
+    def make_dates(self):
+        """
+        Crea el indice de fechas (self.dindex) a partir del indice del campo 'date', si se indexa.
+
+        """
+        if 'date' in self.index:
+            index = self.index['date']
+            self.dindex = DateIndex.build((date, index[date].newids) for date in sorted(index))
+
+    def get_lexicon(self):
+        """
+        Devuelve el lexicon compartido: la union ordenada de los terminos de todos los campos.
+        En un indice en memoria se calcula la primera vez que se necesita.
+
+        """
+        if self.lexicon is None:
+            self.lexicon = sorted(set().union(*(self.index[field] for field, _ in self.indexed_fields)))
+        return self.lexicon
+
+    def get_stem_lexicon(self):
+        """
+        Devuelve el lexicon compartido de stems: la union ordenada de los stems de todos los campos.
+
+        """
+        if self.stem_lexicon is None:
+            self.stem_lexicon = sorted(set().union(*(self.sindex[field] for field, _ in self.indexed_fields)))
+        return self.stem_lexicon
+
+    def show_stats(self):
+        """
+        NECESARIO PARA TODAS LAS VERSIONES
+
+        Muestra estadisticas de los indices
+
+        """
+        print("========================================")
+        print("Number of indexed days: %d" % len(self.docs))
+        print("----------------------------------------")
+        print("Number of indexed news: %d" % len(self.news))
+        print("----------------------------------------")
+        print("TOKENS:")
+        for field, _ in self.indexed_fields:
+            print("\t# of tokens in '%s': %d" % (field, len(self.index[field])))
+        print("----------------------------------------")
+        if self.permuterm:
+            print("PERMUTERMS:")
+            for field, _ in self.indexed_fields:
+                print("\t# of permuterms in '%s': %d" % (field, self.permuterm_count(field)))
+            print("----------------------------------------")
+        if self.stemming:
+            print("STEMS:")
+            for field, _ in self.indexed_fields:
+                print("\t# of stems in '%s': %d" % (field, len(self.sindex[field])))
+            print("----------------------------------------")
+        print("MEMORY (compact postings vs. dict of lists):")
+        for field, _ in self.indexed_fields:
+            compact = legacy = 0
+            for posting in self.index[field].values():
+                compact += posting.nbytes()
+                legacy += posting.legacy_nbytes(self.positional)
+            print("\t'%s': %.2f MB vs. %.2f MB (x%.1f smaller)" %
+                  (field, compact / 2**20, legacy / 2**20, legacy / max(compact, 1)))
+        if self.stemming:
+            for field, _ in self.indexed_fields:
+                print("\t'%s' stems: %.2f MB" %
+                      (field, sum(posting.nbytes() for posting in self.sindex[field].values()) / 2**20))
+        for field, _ in self.indexed_fields:
+            print("\t'%s' BM25 impacts: %.2f MB" %
+                  (field, sum(len(record) for record in self.weight[field].values()) / 2**20))
+        if self.permuterm:
+            ptindex = self.get_ptindex()
+            print("\tpermuterm: %.2f MB (%d bytes per rotation)" %
+                  (ptindex.nbytes() / 2**20, ptindex.nbytes() // max(len(ptindex), 1)))
+        if self.dindex is not None:
+            rotations = sum(len(date) + 1 for date in self.dindex.dates)
+            print("\tdate index: %.2f KB (%d dates, %d runs) vs. %.2f KB for %d date permuterms" %
+                  (self.dindex.nbytes() / 2**10, len(self.dindex), len(self.dindex.runs) // 2,
+                   rotations * 6 / 2**10, rotations))
+        if self.store is not None:
+            print("\tdocument store: %.2f MB" % (sum(len(record) for record in self.store) / 2**20))
+        print("----------------------------------------")
+        self.show_lexicon_lookup()
+        if self.multifield:
+            self.show_lexicon_stats()
+        if self.positional:
+            print("Positional queries are allowed.")
+        else:
+            print("Positional queries are NOT allowed.")
+        if self.profile is not None:
+            print("----------------------------------------")
+            self.show_profile()
+        print("========================================")
+
+        ########################################
+        ## COMPLETAR PARA TODAS LAS VERSIONES ##
+        ########################################
+
+    def show_lexicon_lookup(self, samples=2000):
+        """
+        Compara el lexicon en bloques con codificacion frontal (BlockLexicon) con un diccionario
+        termino --> identificador: memoria de la seccion y del indice de bloques frente a la del
+        dict y sus cadenas, y tiempo medio de busqueda de "samples" terminos repartidos por el
+        lexicon y otros tantos que no estan. En un indice en memoria se codifica el lexicon.
+
+        """
+        lexicons = [('terms', self.get_lexicon())]
+        if self.stemming:
+            lexicons.append(('stems', self.get_stem_lexicon()))
+        print("LEXICON (front-coded blocks of %d vs. dict):" % LEXICON_BLOCK)
+        for name, lexicon in lexicons:
+            if not isinstance(lexicon, BlockLexicon):
+                data = BlockLexicon.to_bytes(lexicon)
+                lexicon = BlockLexicon(data, 0, len(data))
+            terms = list(lexicon)
+            table = {term: tid for tid, term in enumerate(terms)}
+            memory = sys.getsizeof(table) + sum(sys.getsizeof(term) for term in terms)
+            step = max(len(terms) // samples, 1)
+            keys = terms[::step]
+            keys += [term + '~' for term in keys]
+            t0 = time.perf_counter()
+            for key in keys:
+                lexicon.find(key)
+            t1 = time.perf_counter()
+            for key in keys:
+                table.get(key, -1)
+            t2 = time.perf_counter()
+            print("\t%s: %d in %d blocks, %.2f MB + %.2f MB block index vs. %.2f MB dict" %
+                  (name, len(lexicon), len(lexicon.block_index()), lexicon.nbytes() / 2**20,
+                   lexicon.index_nbytes() / 2**20, memory / 2**20))
+            print("\t%s lookup: %.2f us vs. %.2f us per term" %
+                  (name, (t1 - t0) / max(len(keys), 1) * 1e6, (t2 - t1) / max(len(keys), 1) * 1e6))
+        print("----------------------------------------")
+
+    def permuterm_count(self, field):
+        """
+        Numero de rotaciones de los terminos del campo "field", las que tendria un indice permuterm
+        del campo. Con indice de fechas las fechas no estan en el permuterm compartido (ver
+        self.permuterm_tids): sus comodines se resuelven con self.dindex.
+
+        """
+        return sum(len(term) + 1 for term in self.index[field])
+
+    def show_lexicon_stats(self):
+        """
+        Muestra la memoria de los diccionarios con el lexicon compartido por los campos frente a
+        un diccionario por campo:
+            - en el fichero cada termino se guarda una vez (en bloques con codificacion frontal, ver
+              BlockLexicon) y cada campo solo un identificador de 4 bytes por termino
+            - en memoria los terminos son cadenas internadas, un solo objeto str por termino
+        Lo mismo para los stems; el indice permuterm se construye una sola vez y no uno por campo.
+
+        """
+        def dictionary_bytes(terms):
+            return len(BlockLexicon.to_bytes(sorted(terms)))
+
+        def string_bytes(terms):
+            return sum(sys.getsizeof(term) for term in terms)
+
+        lexicons = [('terms', self.index, self.get_lexicon())]
+        if self.stemming:
+            lexicons.append(('stems', self.sindex, self.get_stem_lexicon()))
+        print("LEXICON (shared by all fields vs. one dictionary per field):")
+        saved = 0
+        for name, indexes, lexicon in lexicons:
+            counts = sum(len(indexes[field]) for field, _ in self.indexed_fields)
+            separate = sum(dictionary_bytes(indexes[field]) for field, _ in self.indexed_fields)
+            shared = dictionary_bytes(lexicon) + 4 * counts
+            strings = sum(string_bytes(indexes[field]) for field, _ in self.indexed_fields)
+            interned = string_bytes(lexicon)
+            saved += separate - shared + strings - interned
+            print("\t%s: %d shared vs. %d per field" % (name, len(lexicon), counts))
+            print("\t%s dictionary: %.2f MB vs. %.2f MB, strings in memory: %.2f MB vs. %.2f MB" %
+                  (name, shared / 2**20, separate / 2**20, interned / 2**20, strings / 2**20))
+        if self.permuterm:
+            ptindex = self.get_ptindex()
+            rotation = ptindex.tids.itemsize + ptindex.offsets.itemsize
+            separate = rotation * sum(self.permuterm_count(field) for field, _ in self.indexed_fields)
+            saved += separate - ptindex.nbytes()
+            print("\tpermuterm: %.2f MB vs. %.2f MB" % (ptindex.nbytes() / 2**20, separate / 2**20))
+        print("\tsaved: %.2f MB" % (saved / 2**20))
+        print("----------------------------------------")
+
+    ###################################
+    ###                             ###
+    ###   PERSISTENCIA DEL INDICE   ###
+    ###                             ###
+    ###################################
+
+    # atributos que se guardan en secciones propias del fichero de indice y no en 'meta'
+    MAPPED_ATTRS = ('index', 'docs', 'news', 'sindex', 'lexicon', 'stem_lexicon', 'ptindex', 'dindex', 'weight',
+                    'store', 'stemmer')
+    # atributos que solo tienen sentido mientras se indexa
+    TRANSIENT_ATTRS = ('runs', 'run_dir', 'index_bytes', 'appending', 'universe',
+                       'cache', 'cache_hits', 'cache_misses', 'stem_memo', 'stemming_time', 'tokens_indexed',
+                       'profile', 'mapped', 'load_times', 'bm25_cache')
+
+    def save(self, filename):
+        """
+        Guarda el indice en "filename" con el formato binario versionado (ver IndexWriter).
+
+        Secciones:
+            - 'meta': pickle con el resto de atributos del objeto (opciones de indexacion, contadores...)
+            - 'docs': tabla con la ruta de cada docid (vacia si se ha borrado)
+            - 'news': numero de noticias y array de pares (docid, posicion) indexado por newid
+            - 'lexicon' y 'lexicon:stem': terminos y stems ordenados de todos los campos (ver IndexWriter.add_lexicon)
+            - 'stemids': identificador en 'lexicon:stem' del stem de cada termino del lexicon
+            - 'tids:<campo>' y 'postings:<campo>': identificadores en el lexicon de los terminos del campo
+              y sus posting lists
+            - 'tids:stem:<campo>' y 'postings:stem:<campo>': lo mismo para los stems
+            - 'weights:<campo>' y 'weights:stem:<campo>': impactos BM25 alineados con los terminos y stems
+            - 'permuterm': rotaciones del indice permuterm del lexicon (ver Permuterm.to_bytes)
+            - 'dates': indice de fechas del campo 'date' (ver DateIndex.to_bytes)
+            - 'store': tabla con el registro comprimido de cada newid (ver store_record)
+
+        param:  "filename": fichero de salida
+
+        """
+        if self.runs:
+            # SPIMI: el indice final se obtiene mezclando los runs, incluido lo que queda en memoria
+            self.flush_run()
+
+        # se escribe en un fichero temporal porque "filename" puede ser uno de los runs (modo append)
+        tmpname = filename + '.tmp'
+        writer = IndexWriter(tmpname)
+        meta = {k: v for k, v in vars(self).items()
+                if k not in self.MAPPED_ATTRS and k not in self.TRANSIENT_ATTRS
+                and k not in self.PROFILE_STAGES and k not in self.PROFILE_HOOKS}
+        writer.add('meta', pickle.dumps(meta))
+        writer.add_table('docs', (self.docs.get(docid, '').encode('utf-8') for docid in range(self.docid)))
+        news = array('I')
+        for newid in range(self.news_counter):
+            news.extend(self.news.get(newid, (DELETED, 0)))
+        if sys.byteorder == 'big':
+            news.byteswap()
+        writer.add('news', struct.pack('<Q', len(self.news)) + news.tobytes())
+        field_terms, field_stems = {}, {}
+        for field, _ in self.indexed_fields:
+            if self.runs:
+                # los pesos se calculan mientras se escriben las posting lists mezcladas
+                items = self.merged_items(self.merge_runs(field), field, field)
+            else:
+                items = self.sorted_postings(field)
+            if field == 'date':
+                items = self.date_items(items)
+            terms = writer.add_postings(field, items, terms=False)
+            field_terms[field] = terms
+            writer.add_table('weights:' + field, (self.weight[field][term] for term in terms))
+            if self.stemming:
+                if self.runs:
+                    # los stems de los runs (y del indice guardado en modo append) se mezclan igual
+                    # que los terminos: solo se pasan por el stemmer los terminos de los runs nuevos
+                    items = self.merged_items(self.merge_runs('stem:' + field), 'stem:' + field, field)
+                else:
+                    sindex = self.sindex[field]
+                    items = ((stem.encode('utf-8'), sindex[stem].to_bytes()) for stem in sorted(sindex))
+                stems = field_stems['stem:' + field] = writer.add_postings('stem:' + field, items, terms=False)
+                writer.add_table('weights:stem:' + field, (self.weight['stem:' + field][stem] for stem in stems))
+        lexicon = writer.add_lexicon('lexicon', field_terms)
+        if self.stemming:
+            stem_lexicon = writer.add_lexicon('lexicon:stem', field_stems)
+            # stem de cada termino del lexicon, para no volver a pasarlos por el stemmer en modo append
+            stem_tid = {stem: i for i, stem in enumerate(stem_lexicon)}
+            stemids = array('I', [stem_tid[self.stem(term)] for term in lexicon])
+            if sys.byteorder == 'big':
+                stemids.byteswap()
+            writer.add('stemids', stemids.tobytes())
+        if self.permuterm:
+            # el permuterm construido en memoria ya apunta al mismo lexicon
+            if self.ptindex is not None and not self.runs:
+                ptindex = self.ptindex
+            elif self.appending:
+                ptindex = self.append_permuterm(lexicon, field_terms)
+            else:
+                ptindex = Permuterm.build(lexicon, self.permuterm_tids(lexicon, field_terms))
+            writer.add('permuterm', ptindex.to_bytes())
+        if 'date' in field_terms:
+            writer.add('dates', self.dindex.to_bytes())
+        writer.add_table('store', self.stored_records())
+        writer.close()
+        os.replace(tmpname, filename)
+
+        if self.runs:
+            # el indice ya solo esta en el fichero guardado
+            mm, sections = map_index_file(filename)
+            self.map_sections(mm, sections)
+            if self.run_dir is not None:
+                shutil.rmtree(self.run_dir)
+            self.runs = []
+            self.run_dir = None
+            self.deleted = set()
+            self.clear_cache()
+
+    def date_items(self, items):
+        """
+        Recorre los pares (fecha en utf-8, posting serializada) del campo 'date' que se guardan en
+        self.save, construyendo a la vez el indice de fechas (self.dindex).
+
+        """
+        dindex = self.dindex = DateIndex()
+        for term, data in items:
+            dindex.add(term.decode('utf-8'), Posting.from_bytes(data, 0, len(data)).newids)
+            yield term, data
+
+    def stored_records(self):
+        """
+        Recorre por orden de newid los registros del almacen de documentos de los runs y de
+        los indexados en memoria. Las noticias borradas se guardan con un registro vacio.
+
+        """
+        def records():
+            for run in self.runs:
+                if 'store' in read_sections(run):
+                    yield from read_table(run, 'store')
+            yield from self.store
+
+        for newid, record in enumerate(records()):
+            yield b'' if newid in self.deleted else record
+
+    def sorted_postings(self, field):
+        """
+        Recorre el indice en memoria del campo "field" en orden de termino.
+
+        return: generador de pares (termino en utf-8, posting serializada)
+
+        """
+        index = self.index[field]
+        for term in sorted(index):
+            yield term.encode('utf-8'), index[term].to_bytes()
+
+    @staticmethod
+    def load(filename):
+        """
+        Abre un indice guardado con self.save. El fichero se proyecta en memoria con mmap y
+        las posting lists se decodifican bajo demanda, de forma que el tiempo de carga no
+        depende del tamaño del indice.
+        Los indices antiguos guardados con pickle se siguen pudiendo cargar.
+
+        param:  "filename": fichero de indice
+
+        return: objeto SAR_Project
+
+        """
+        mapped = map_index_file(filename)
+        if mapped is None:
+            with open(filename, 'rb') as fh:
+                return pickle.load(fh)
+
+        mm, sections = mapped
+        if 'shards' in sections:
+            return ShardedProject.open(filename, mm, sections)
+        project = SAR_Project()
+        project.__dict__.update(pickle.loads(mm[slice(*section_range(sections['meta']))]))
+        project.docs = MappedDocs(MappedTable(mm, *sections['docs']))
+        project.news = MappedNews(mm, *sections['news'])
+        project.map_sections(mm, sections)
+        return project
+
+    def map_sections(self, mm, sections):
+        """
+        Abre sobre el mmap de un fichero de indice el lexicon compartido, el indice de fechas y
+        el almacen de documentos. Los indices de terminos y stems de cada campo y sus pesos se
+        abren la primera vez que una query usa el campo (LazyFields) y el indice permuterm la
+        primera vez que hay un comodin (self.get_ptindex).
+
+        """
+        self.mapped = (mm, sections)
+        fields = [field for field, _ in self.indexed_fields]
+        self.lexicon = map_lexicon(mm, sections, 'lexicon')
+        self.index = LazyFields(fields, self.map_field)
+        weights = fields
+        if self.stemming:
+            self.stem_lexicon = map_lexicon(mm, sections, 'lexicon:stem')
+            self.sindex = LazyFields(fields, lambda field: self.map_field('stem:' + field))
+            weights = fields + ['stem:' + field for field in fields]
+        # los indices guardados sin pesos no tienen ranking
+        self.weight = LazyFields([name for name in weights if 'weights:' + name in sections], self.map_weight)
+        self.store = MappedTable(mm, *sections['store']) if 'store' in sections else None
+        self.ptindex = None
+        # los indices guardados sin seccion 'dates' resuelven las fechas con el permuterm
+        self.dindex = DateIndex.from_buffer(mm, *section_range(sections['dates'])) if 'dates' in sections else None
+
+    def map_field(self, name):
+        """
+        Abre el indice del campo "name" ('stem:<campo>' para los stems) del fichero de indice cargado.
+
+        """
+        mm, sections = self.mapped
+        lexicon = self.stem_lexicon if name.startswith('stem:') else self.lexicon
+        return self.timed_load("index '%s'" % name, lambda: map_field_index(mm, sections, name, lexicon))
+
+    def map_weight(self, name):
+        """
+        Abre los impactos BM25 del campo "name" ('stem:<campo>' para los stems) del fichero de
+        indice cargado, con las mismas claves que self.weight.
+
+        """
+        mm, sections = self.mapped
+        index = self.sindex[name[len('stem:'):]] if name.startswith('stem:') else self.index[name]
+        return self.timed_load("weights '%s'" % name,
+                               lambda: MappedImpacts(index, MappedTable(mm, *sections['weights:' + name])))
+
+    def get_ptindex(self):
+        """
+        Devuelve el indice permuterm. En un indice cargado se abre la primera vez que se necesita.
+
+        """
+        if self.ptindex is None and self.permuterm and self.mapped is not None:
+            mm, sections = self.mapped
+            self.ptindex = self.timed_load('permuterm', lambda: map_permuterm(mm, sections, self.lexicon))
+        return self.ptindex
+
+    def timed_load(self, name, fnc):
+        """
+        Carga algo que se abre bajo demanda llamando a "fnc" y anota lo que ha tardado en
+        self.load_times (ver la opcion --timing de SAR_Searcher.py).
+
+        return: lo que devuelve "fnc"
+
+        """
+        t0 = time.perf_counter()
+        value = fnc()
+        self.load_times[name] = self.load_times.get(name, 0.0) + time.perf_counter() - t0
+        return value
+
+    ###################################
+    ###                             ###
+    ###   PARTE 2.1: RECUPERACION   ###
+    ###                             ###
+    ###################################
+
+    def solve_query(self, query, prev={}):
+        """
+        NECESARIO PARA TODAS LAS VERSIONES
+
+        Resuelve una query.
+        Debe realizar el parsing de consulta que sera mas o menos complicado en funcion de la ampliacion que se implementen
+
+
+        param:  "query": cadena con la query
+                "prev": incluido por si se quiere hacer una version recursiva. No es necesario utilizarlo.
+
+
+        return: posting list con el resultado de la query
+
+        """
+
+        if query is None or len(query) == 0:
+            return []
+
+        tree = self.optimize_query(self.parse_query(query))
+        if tree is None:
+            return []
+        return self.solve_tree(tree)
+
+    def solve_tree(self, tree):
+        """
+        Resuelve el arbol sintactico optimizado de una query (ver self.optimize_query).
+
+        return: posting list con el resultado
 
-        self.docid += 1
+        """
+        return as_array(self.eval_query(tree, {}))
 
-    def tokenize(self, text):
+    def parse_query(self, query):
         """
-        NECESARIO PARA TODAS LAS VERSIONES
+        Construye el arbol sintactico de una query. Los nodos son tuplas:
 
-        Tokeniza la cadena "texto" eliminando simbolos no alfanumericos y dividientola por espacios.
-        Puedes utilizar la expresion regular 'self.tokenizer'.
+            ('term', campo, termino)           termino normalizado
+            ('phrase', campo, (t1, t2, ...))   secuencia de terminos entre comillas
+            ('wildcard', campo, patron)        termino con '*' o '?'
+            ('range', 'date', (desde, hasta))  intervalo de fechas 'date:desde..hasta'
+            ('not', nodo)
+            ('and', (nodo, nodo, ...))
+            ('or', (nodo, nodo, ...))
 
-        params: 'text': texto a tokenizar
+        Las conectivas se asocian de izquierda a derecha sin prioridad entre ellas,
+        'a AND b OR c' es (a AND b) OR c; NOT solo afecta al operando que le sigue.
 
-        return: lista de tokens
+        param:  "query": cadena con la query
+
+        return: nodo raiz, None si la query no tiene terminos
 
         """
-        return self.tokenizer.sub(' ', text.lower()).split()
+        tree, _ = self.parse_tokens(self.query_tokenizer.findall(query), 0)
+        return tree
 
-    def make_stemming(self):
+    def parse_tokens(self, q, i):
         """
-        NECESARIO PARA LA AMPLIACION DE STEMMING.
+        Analiza la lista de tokens "q" a partir de la posicion "i" hasta el final o hasta
+        el parentesis que cierra el nivel actual. Los parentesis se analizan con una llamada recursiva.
 
-        Crea el indice de stemming (self.sindex) para los terminos de todos los indices.
+        param:  "q": lista de tokens de la query (terminos, conectivas y parentesis)
+                "i": posicion del primer token a analizar
 
-        self.stemmer.stem(token) devuelve el stem del token
+        return: tupla (nodo, posicion siguiente al ultimo token consumido)
 
         """
+        tree = None
+        connective = 'and'
+        negate = False
+        while i < len(q):
+            token = q[i]
+            i += 1
+            if token == ')':
+                break
+            elif token in ('AND', 'OR'):
+                connective = token.lower()
+                continue
+            elif token == 'NOT':
+                negate = not negate
+                continue
+            elif token == '(':
+                node, i = self.parse_tokens(q, i)
+                if node is None:
+                    continue
+            else:
+                node = self.parse_term(token)
 
-        pass
-        ####################################################
-        ## COMPLETAR PARA FUNCIONALIDAD EXTRA DE STEMMING ##
-        ####################################################
-
-    def make_permuterm(self):
-        """
-        NECESARIO PARA LA AMPLIACION DE PERMUTERM
+            if negate:
+                node = ('not', node)
+                negate = False
+            tree = node if tree is None else (connective, (tree, node))
 
-        Crea el indice permuterm (self.ptindex) para los terminos de todos los indices.
+        return tree, i
 
+    def parse_term(self, token):
         """
-        pass
-        ####################################################
-        ## COMPLETAR PARA FUNCIONALIDAD EXTRA DE STEMMING ##
-        ####################################################
+        Construye la hoja del arbol sintactico de un termino de la query.
+        El termino puede llevar un prefijo de campo ('title:'), ser una secuencia
+        de terminos entre comillas dobles o contener comodines.
 
-    def show_stats(self):
-        """
-        NECESARIO PARA TODAS LAS VERSIONES
+        param:  "token": termino de la query tal y como aparece en la consulta
 
-        Muestra estadisticas de los indices
+        return: nodo hoja
 
         """
-        pass
-        ########################################
-        ## COMPLETAR PARA TODAS LAS VERSIONES ##
-        ########################################
+        field = 'article'
+        prefix, sep, rest = token.partition(':')
+        if sep and prefix in self.field_names:
+            field, token = prefix, rest
+        if token.startswith('"'):
+            # entre comillas no se aplica stemming, aunque sea un unico termino
+            terms = tuple(self.tokenize(token))
+            if terms:
+                return ('phrase', field, terms)
+            token = ''
+        token = token.lower()
+        if field == 'date' and '..' in token:
+            first, _, last = token.partition('..')
+            return ('range', field, (first, last))
+        if '*' in token or '?' in token:
+            return ('wildcard', field, token)
+        return ('term', field, token)
+
+    def optimize_query(self, node):
+        """
+        Reescribe el arbol sintactico para evaluarlo con menos operaciones:
 
-    ###################################
-    ###                             ###
-    ###   PARTE 2.1: RECUPERACION   ###
-    ###                             ###
-    ###################################
+            - une los AND (OR) anidados en un unico AND (OR) con todos los operandos
+            - NOT NOT a --> a
+            - De Morgan: NOT a AND NOT b --> NOT (a OR b)
+                         NOT a OR NOT b --> NOT (a AND b)
+            - a OR NOT b --> NOT (b AND NOT a), para calcular un solo complemento y de la parte pequeña
 
-    def solve_query(self, query, prev={}):
-        """
-        NECESARIO PARA TODAS LAS VERSIONES
+        Tras la reescritura cada AND tiene como mucho un operando negado, que se resuelve
+        con minus_posting, y solo queda un NOT en la raiz de cada subexpresion puramente negativa.
 
-        Resuelve una query.
-        Debe realizar el parsing de consulta que sera mas o menos complicado en funcion de la ampliacion que se implementen
+        param:  "node": nodo del arbol sintactico
 
+        return: nodo equivalente optimizado
 
-        param:  "query": cadena con la query
-                "prev": incluido por si se quiere hacer una version recursiva. No es necesario utilizarlo.
+        """
+        if node is None or node[0] in ('term', 'phrase', 'wildcard', 'range'):
+            return node
+        if node[0] == 'not':
+            child = self.optimize_query(node[1])
+            return child[1] if child[0] == 'not' else ('not', child)
+
+        op = node[0]
+        # (a AND b) AND c --> AND(a, b, c)
+        children = query_node(op, [self.optimize_query(child) for child in node[1]])
+        children = children[1] if children[0] == op else [children]
+        positive = [child for child in children if child[0] != 'not']
+        negative = [child[1] for child in children if child[0] == 'not']
+
+        if op == 'and':
+            if not positive:
+                return ('not', query_node('or', negative))
+            if negative:
+                positive.append(('not', query_node('or', negative)))
+            return query_node('and', positive)
+
+        if not negative:
+            return query_node('or', positive)
+        # NOT a OR NOT b OR c --> NOT ((a AND b) AND NOT c)
+        negative = query_node('and', negative)
+        if positive:
+            negative = query_node('and', [negative, ('not', query_node('or', positive))])
+        return ('not', negative)
+
+    def estimate_query(self, node, leaves):
+        """
+        Estima el numero de noticias del resultado de un nodo para decidir el orden de evaluacion.
+        Las hojas se evaluan (y se guardan en "leaves") porque obtener su posting list es barato.
 
+        param:  "node": nodo del arbol sintactico optimizado
+                "leaves": diccionario hoja --> posting list de la query que se esta resolviendo
 
-        return: posting list con el resultado de la query
+        return: numero estimado de noticias
 
         """
+        if node[0] in ('and', 'or', 'not') and self.cache_size:
+            cached = self.cache.get(self.cache_key(node))
+            if cached is not None:
+                return len(cached)
+        if node[0] == 'not':
+            return len(self.news) - self.estimate_query(node[1], leaves)
+        if node[0] == 'and':
+            return min(self.estimate_query(child, leaves) for child in node[1])
+        if node[0] == 'or':
+            return min(len(self.news), sum(self.estimate_query(child, leaves) for child in node[1]))
+        return len(self.eval_query(node, leaves))
+
+    def eval_query(self, node, leaves):
+        """
+        Evalua un nodo del arbol sintactico optimizado. Salvo los terminos simples, los nodos
+        se buscan primero en la cache de subexpresiones.
 
-        if query is None or len(query) == 0:
-            return []
+            - AND: intersecta los operandos de menor a mayor tamaño estimado, parando si el
+              resultado se queda vacio, y resta el operando negado con minus_posting.
+            - OR: une los operandos empezando por los mas pequeños.
+            - NOT: complemento con reverse_posting.
 
-        q = query.split()
-        answer = []
-        if len(q) == 2 and q[0] == 'NOT':
-            p1 = get_posting(q[1])
-            return reverse_posting(p1)
-            
-        elif len(q) == 3 and q[1] in ['AND', 'OR']:
-            p1 = get_posting(q[0])
-            p2 = get_posting(q[2])
-            if q[1] == 'AND':
-                return and_posting(p1, p2)
-            elif q[1] == 'OR':
-                return or_posting(p1, p2)
-            else:
-                return []
-        else:
-            p1 = get_posting(q[0])
-            if q[1] == 'AND':
-                answer = answer.append(and_posting(p1,solve_query(self, q[2:],{}))) 
-            elif q[1] == 'OR':
-                answer = answer.append(or_posting(p1,solve_query(self, q[2:],{}))) 
-            
-
-
-
-        # NOT B OR ( wewe AND wewe AND ( valencia AND NOT wewe ) OR (wewe AND qwqw) )
-        # dqwe OR (A AND B, ( D AND E AND ( F AND NOT G ) ) )
-        # qwqw OR qweqw AND sljf
-        # NOT qweqwe
-        # qweqwe AND  NOT qweqweqw
-        # qweqweqwe AND NOT qweqweq
-        # valencia
-        # AND (( D AND E, ( F AND NOT G ) )
-
-        query = query.replace('(', ' ( ')
-        query = query.replace(')', ' ) ')
-        q = query.split()
-        i = 0
-        q_length = len(q)
+        param:  "node": nodo del arbol sintactico optimizado
+                "leaves": diccionario hoja --> posting list de la query que se esta resolviendo
+
+        return: posting list
 
+        """
+        kind = node[0]
+        if kind == 'term' or not self.cache_size:
+            return self.compute_query(node, leaves)
+        # las subexpresiones resueltas se guardan en la cache LRU, ver self.set_cache()
+        key = self.cache_key(node)
+        answer = self.cache.get(key)
+        if answer is not None:
+            self.cache.move_to_end(key)
+            self.cache_hits += 1
+            return answer
+        self.cache_misses += 1
+        answer = self.compute_query(node, leaves)
+        self.cache[key] = answer
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return answer
+
+    def cache_stats(self):
+        """
+        Resumen de aciertos y fallos de la cache de subexpresiones.
 
-        opened = 0
-        first = True
-        i0 = 0
+        """
+        lookups = self.cache_hits + self.cache_misses
+        return "Query cache: %d hits, %d misses (%.1f%% hit rate), %d/%d entries" % (
+            self.cache_hits, self.cache_misses, 100 * self.cache_hits / lookups if lookups else 0,
+            len(self.cache), self.cache_size)
 
-        #nota: en el caso de arriba cortaría parte de la consulta
-        if ("(" in q and ")" in q):
-           while i < q_length:
-                if q[i] == ("("):
-                 opened += 1            
-                 if first: i0 = i, first = False
-                if q[i] == (")"):
-                    opened -= 1
-                    if opened == 0:
-                        solve_query(self, q[i0+1:i], q[0:i0]))
+    def cache_key(self, node):
+        """
+        Clave de un nodo en la cache de subexpresiones: el resultado depende del arbol normalizado
+        (que ya incluye el campo de cada hoja), de si se aplica stemming y del motor, que
+        determina el tipo de las posting lists guardadas.
 
+        """
+        return (self.use_stemming, self.engine, canonical_query(node))
 
+    def compute_query(self, node, leaves):
+        """
+        Resuelve un nodo del arbol sintactico sin consultar la cache (ver self.eval_query).
 
-        #         j = q_length - 1
-        #         while j > 0:
-        #             if q[j] == (")"):
-        #                 resultado = hazoperacion(q[0:i], solve_query(self, q[i+1:j], q[0:i]))
+        param:  "node": nodo del arbol sintactico optimizado
+                "leaves": diccionario hoja --> posting list de la query que se esta resolviendo
 
-        #             j -= 1
-        #     i += 1
+        return: posting list
 
-            ########################################
-            ## COMPLETAR PARA TODAS LAS VERSIONES ##
-            ########################################
+        """
+        kind = node[0]
+        if kind == 'and':
+            positive = [child for child in node[1] if child[0] != 'not']
+            negative = [child[1] for child in node[1] if child[0] == 'not']
+            positive.sort(key=lambda child: self.estimate_query(child, leaves))
+            if self.engine == 'numpy':
+                answer = self.and_many([self.eval_query(child, leaves) for child in positive])
+            else:
+                answer = self.eval_query(positive[0], leaves)
+                for child in positive[1:]:
+                    if len(answer) == 0:
+                        break
+                    answer = self.and_posting(answer, self.eval_query(child, leaves))
+            for child in negative:
+                if len(answer) == 0:
+                    break
+                answer = self.minus_posting(answer, self.eval_query(child, leaves))
+            return answer
+        if kind == 'or':
+            children = sorted(node[1], key=lambda child: self.estimate_query(child, leaves))
+            answer = self.eval_query(children[0], leaves)
+            for child in children[1:]:
+                answer = self.or_posting(answer, self.eval_query(child, leaves))
+            return answer
+        if kind == 'not':
+            return self.reverse_posting(self.eval_query(node[1], leaves))
+
+        posting = leaves.get(node)
+        if posting is None:
+            if node[1] not in self.index:
+                # campo que no se ha indexado (indice creado sin multifield): ninguna noticia
+                posting = array('I')
+            elif kind == 'phrase':
+                posting = self.get_positionals(list(node[2]), node[1])
+            elif kind == 'range':
+                posting = self.get_date_range(*node[2])
+            else:
+                posting = self.get_posting(node[2], node[1])
+            leaves[node] = posting
+        return posting
 
     def get_posting(self, term, field='article'):
         """
@@ -364,7 +3780,25 @@ class SAR_Project:
 
         return: posting list
         """
-        return list(self.index[term])
+        if field == 'date' and self.dindex is not None:
+            return self.get_dates(term)
+        if '*' in term or '?' in term:
+            return self.get_permuterm(term, field)
+        if self.use_stemming:
+            return self.get_stemming(term, field)
+        return self.posting_list(self.index[field].get(term))
+
+    def posting_list(self, posting):
+        """
+        Devuelve la posting list de newids de un Posting (None si el termino no esta en el indice).
+        Los terminos muy frecuentes se manejan como mapa de bits.
+
+        """
+        if posting is None:
+            return array('I')
+        if len(posting) * DENSE_RATIO > self.news_counter:
+            return posting.as_bitmap()
+        return posting.newids
 
         ########################################
         ## COMPLETAR PARA TODAS LAS VERSIONES ##
@@ -381,11 +3815,53 @@ class SAR_Project:
 
         return: posting list
 
+        Los terminos se recorren de menos a mas frecuente: las noticias candidatas son las del
+        termino mas raro, y en cada una se buscan los demas con busqueda binaria a partir de la
+        ultima posicion encontrada. En cada noticia candidata se mantienen las posiciones de
+        inicio de la frase que siguen siendo posibles y se cruzan con las posiciones de cada
+        termino desplazadas por su lugar en la frase; las posiciones se decodifican solo hasta
+        pasar la ultima posicion de inicio posible y con el ultimo termino basta la primera
+        coincidencia. No se aplica stemming.
+
         """
-        pass
-        ########################################################
-        ## COMPLETAR PARA FUNCIONALIDAD EXTRA DE POSICIONALES ##
-        ########################################################
+        index = self.index[field]
+        postings = [index.get(term) for term in terms]
+        if any(posting is None for posting in postings):
+            return array('I')
+        if len(terms) == 1:
+            return self.posting_list(postings[0])
+        if not self.positional:
+            # indice sin posiciones: se aproxima la frase con el AND de sus terminos
+            postings.sort(key=len)
+            answer = postings[0].newids
+            for posting in postings[1:]:
+                answer = self.and_posting(answer, posting.newids)
+            return answer
+
+        # (posting, desplazamiento del termino en la frase) de menos a mas frecuente
+        order = sorted(zip(postings, range(len(terms))), key=lambda entry: len(entry[0]))
+        (rarest, first), others = order[0], order[1:]
+        lows = [0] * len(others)
+        res = array('I')
+        for i, newid in enumerate(rarest.newids):
+            # posicion de la noticia en la posting list de cada uno de los demas terminos
+            found = []
+            for j, (posting, _) in enumerate(others):
+                k = bisect.bisect_left(posting.newids, newid, lows[j])
+                lows[j] = k
+                if k == len(posting.newids) or posting.newids[k] != newid:
+                    break
+                found.append(k)
+            else:
+                starts = [position - first for position in rarest.iter_positions(i)]
+                for j, ((posting, offset), k) in enumerate(zip(others, found)):
+                    starts = phrase_starts(starts, posting.iter_positions(k), offset,
+                                           last=j == len(others) - 1)
+                    if not starts:
+                        break
+                else:
+                    res.append(newid)
+        return res
 
     def get_stemming(self, term, field='article'):
         """
@@ -400,11 +3876,15 @@ class SAR_Project:
 
         """
 
-        stem = self.stemmer.stem(term)
-
-        ####################################################
-        ## COMPLETAR PARA FUNCIONALIDAD EXTRA DE STEMMING ##
-        ####################################################
+        sindex = self.sindex.get(field)
+        if sindex is None and isinstance(self.index[field], MappedIndex):
+            # indice guardado sin stemming: se buscan en el lexicon los terminos con el mismo stem
+            index = self.index[field]
+            return self.union_postings(index.posting(i) for i in self.stem_positions(term, field))
+        if sindex is None:
+            # indice creado sin stemming: se calculan los stems de este campo la primera vez
+            sindex = self.sindex[field] = self.stem_postings(self.index[field].items())
+        return self.posting_list(sindex.get(self.stem(term)))
 
     def get_permuterm(self, term, field='article'):
         """
@@ -418,10 +3898,128 @@ class SAR_Project:
         return: posting list
 
         """
+        index = self.index[field]
+        if isinstance(index, MappedIndex) and (term.endswith('*') and term.count('*') == 1 and '?' not in term
+                                               or self.get_ptindex() is None):
+            # los terminos con la parte del patron anterior al primer comodin son un intervalo del lexicon
+            return self.union_postings(index.posting(i) for i in self.prefix_positions(term, field))
+        if self.get_ptindex() is not None:
+            terms = self.permuterm_terms(term, field)
+        else:
+            # indice sin permuterm: se recorre todo el diccionario de terminos
+            regex = re.compile(re.escape(term).replace(r'\*', '.*').replace(r'\?', '.'))
+            terms = [t for t in self.index[field] if regex.fullmatch(t)]
+        return self.union_terms(terms, field)
+
+    def prefix_positions(self, pattern, field='article'):
+        """
+        Devuelve las posiciones en el diccionario (MappedIndex) del campo "field" de los terminos
+        que encajan con el comodin "pattern". Los que empiezan por la parte del patron anterior al
+        primer comodin son un intervalo del lexicon; solo se decodifican y se comprueban con el
+        patron si no acaba en un unico '*'.
+
+        """
+        index = self.index[field]
+        first = min(pattern.find(c) for c in '*?' if c in pattern)
+        a, b = index.prefix_positions(pattern[:first])
+        if pattern == pattern[:first] + '*':
+            return range(a, b)
+        regex = wildcard_regex(pattern)
+        terms = index.lexicon.terms_of(index.tids[a:b])
+        return [i for i, t in zip(range(a, b), terms) if regex.fullmatch(t)]
+
+    def stem_positions(self, term, field='article'):
+        """
+        Devuelve las posiciones en el diccionario (MappedIndex) del campo "field" de los terminos
+        con el mismo stem que "term", sin indice de stems.
+
+        El stemmer de Snowball solo cambia la palabra a partir de su region R1 (tras la primera
+        consonante que sigue a una vocal) y quita las tildes: los terminos del stem empiezan por
+        el principio del stem hasta R1, con o sin tilde en cada vocal. Solo se pasan por el stemmer
+        los terminos del campo con alguno de esos prefijos.
+
+        """
+        index = self.index[field]
+        stem = self.stem(term)
+        match = STEM_R1.search(stem)
+        prefix = stem[:match.end()] if match else stem
+        positions = []
+        for variant in product(*(ACCENTS.get(c, c) for c in prefix)):
+            a, b = index.prefix_positions(''.join(variant))
+            terms = index.lexicon.terms_of(index.tids[a:b])
+            positions.extend(i for i, t in zip(range(a, b), terms) if self.stem(t) == stem)
+        return positions
+
+    def union_terms(self, terms, field='article'):
+        """
+        Devuelve la union de las posting lists de los terminos "terms" del campo "field".
+
+        """
+        return self.union_postings(self.index[field][t] for t in terms)
+
+    def union_postings(self, postings):
+        """
+        Devuelve la union de las posting lists de los Posting "postings".
+
+        """
+        postings = list(postings)
+        if len(postings) == 1:
+            return self.posting_list(postings[0])
+        newids = set()
+        for posting in postings:
+            newids.update(posting.newids)
+        return array('I', sorted(newids))
+
+    def get_dates(self, pattern):
+        """
+        Devuelve la posting list de una fecha o de un comodin sobre las fechas ('date:201*10')
+        con el indice de fechas (self.dindex), sin pasar por el permuterm ni por el stemming
+        ('date' no se tokeniza).
+
+        """
+        return self.date_posting(self.dindex.runs_of(self.dindex.lookup(pattern)))
+
+    def get_date_range(self, first, last):
+        """
+        Devuelve la posting list de las noticias con fecha en el intervalo "first".."last"
+        (ver DateIndex.between). Los indices sin indice de fechas recorren las fechas del campo.
+
+        """
+        if self.dindex is None:
+            return self.union_terms([date for date in self.index['date'] if in_date_range(date, first, last)],
+                                    'date')
+        return self.date_posting(self.dindex.runs_of(self.dindex.between(first, last)))
+
+    def date_posting(self, runs):
+        """
+        Convierte las secuencias (inicio, fin) de newids del indice de fechas en una posting list;
+        si son muchas noticias, en un mapa de bits con un desplazamiento por secuencia.
+
+        """
+        if sum(end - start for start, end in runs) * DENSE_RATIO > self.news_counter:
+            bits = 0
+            for start, end in runs:
+                bits |= ((1 << (end - start)) - 1) << start
+            return Bitmap(bits)
+        answer = array('I')
+        for start, end in runs:
+            answer.extend(range(start, end))
+        return answer
+
+    def permuterm_terms(self, pattern, field='article'):
+        """
+        Devuelve los terminos del campo "field" que encajan con el comodin "pattern": el indice
+        permuterm es unico para todos los campos y sus terminos se filtran por el campo.
 
-        ##################################################
-        ## COMPLETAR PARA FUNCIONALIDAD EXTRA PERMUTERM ##
-        ##################################################
+        """
+        index = self.index[field]
+        ptindex = self.get_ptindex()
+        terms = ptindex.terms
+        tids = ptindex.lookup_ids(pattern)
+        if isinstance(index, MappedIndex):
+            # se comparan identificadores, sin buscar cada termino en el lexicon
+            return [terms[tid] for tid in index.select(tids)]
+        return [terms[tid] for tid in tids if terms[tid] in index]
 
     def reverse_posting(self, p):
         """
@@ -438,20 +4036,48 @@ class SAR_Project:
 
         """
 
-        # Obtaining list of all news
-        answer = list(self.news.keys())
-
-        # Looping the posting list
-        for post in p:
-            # Deleting the news from the news list
-            answer.remove(post)
-
-        return answer
+        # el complemento se calcula con bitmaps: O(|p| + N/64) en lugar de borrar de una lista
+        return Bitmap(self.all_news().bits & ~as_bits(p))
 
         ########################################
         ## COMPLETAR PARA TODAS LAS VERSIONES ##
         ########################################
 
+    def all_news(self):
+        """
+        Devuelve el mapa de bits con todas las noticias indexadas (sin las borradas).
+        Se guarda mientras no cambie el numero de noticias.
+
+        """
+        key = (self.news_counter, len(self.news))
+        if self.universe is None or self.universe[0] != key:
+            if len(self.news) == self.news_counter:
+                bits = (1 << self.news_counter) - 1
+            else:
+                bits = Bitmap.from_newids(sorted(self.news)).bits
+            self.universe = (key, Bitmap(bits))
+        return self.universe[1]
+
+    def and_many(self, postings):
+        """
+        Calcula el AND de varias posting lists a la vez con el motor numpy: los mapas de bits se
+        intersectan entre si, los arrays con np_and_many y por ultimo se combinan ambos resultados.
+
+        param:  "postings": lista de posting lists
+
+        return: posting list con los newid incluidos en todas
+
+        """
+        bitmaps = [p for p in postings if isinstance(p, Bitmap)]
+        arrays = [np_view(p) for p in postings if not isinstance(p, Bitmap)]
+        bits = None
+        for bitmap in bitmaps:
+            bits = bitmap.bits if bits is None else bits & bitmap.bits
+        if not arrays:
+            return Bitmap(bits)
+        answer = np_and_many(arrays)
+        return answer if bits is None else np_filter(Bitmap(bits), answer)
+
     def and_posting(self, p1, p2):
         """
         NECESARIO PARA TODAS LAS VERSIONES
@@ -463,7 +4089,15 @@ class SAR_Project:
         return: posting list con los newid incluidos en p1 y p2
 
         """
-        res = []
+        # la interseccion con un bitmap solo tiene que comprobar los newid de la otra lista
+        if isinstance(p1, Bitmap):
+            return Bitmap(p1.bits & p2.bits) if isinstance(p2, Bitmap) else p1.filter(p2)
+        if isinstance(p2, Bitmap):
+            return p2.filter(p1)
+        if self.engine == 'numpy':
+            return np_and(np_view(p1), np_view(p2))
+
+        res = array('I')
         i = 0
         j = 0
         long_p1 = len(p1)
@@ -504,7 +4138,12 @@ class SAR_Project:
         return: posting list con los newid incluidos de p1 o p2
 
         """
-        answer = []
+        if isinstance(p1, Bitmap) or isinstance(p2, Bitmap):
+            return Bitmap(as_bits(p1) | as_bits(p2))
+        if self.engine == 'numpy':
+            return np_or(np_view(p1), np_view(p2))
+
+        answer = array('I')
         i = 0
         j = 0
 
@@ -546,7 +4185,16 @@ class SAR_Project:
         return: posting list con los newid incluidos de p1 y no en p2
 
         """
-        answer = []
+        if isinstance(p2, Bitmap):
+            if isinstance(p1, Bitmap):
+                return Bitmap(p1.bits & ~p2.bits)
+            return p2.filter(p1, keep=False)
+        if isinstance(p1, Bitmap):
+            return Bitmap(p1.bits & ~as_bits(p2))
+        if self.engine == 'numpy':
+            return np.setdiff1d(np_view(p1), np_view(p2), assume_unique=True)
+
+        answer = array('I')
         i = 0
         j = 0
 
@@ -605,31 +4253,690 @@ class SAR_Project:
 
         return: el numero de noticias recuperadas, para la opcion -T
 
+        """
+        count, lines = self.show_lines(query)
+        print('\n'.join(lines))
+        return count
+
+    def show_lines(self, query):
+        """
+        Resuelve una consulta y devuelve las lineas que muestra self.solve_and_show, sin
+        escribirlas; el servidor de consultas (SAR_Server.py) las envia al cliente.
+
+        param:  "query": query que se debe resolver.
+
+        return: tupla (numero de noticias recuperadas, lista de lineas)
+
         """
         result = self.solve_query(query)
+        k = len(result) if self.show_all else self.SHOW_MAX
         if self.use_ranking:
-            result = self.rank_result(result, query)
+            shown = self.rank_result(result, query, k)
+        else:
+            shown = [(newid, 0) for newid in result[:k]]
+
+        lines = ["========================================",
+                 "Query: '%s'" % query,
+                 "Number of results: %d" % len(result)]
+        terms = self.get_query_terms(query) if self.show_snippet else None
+        for rank, (newid, score) in enumerate(shown, 1):
+            new = self.fetch_news(newid, self.show_snippet)
+            if self.use_ranking:
+                score = '%.4f' % score
+            if self.show_snippet:
+                lines.append("#%d" % rank)
+                lines.append("Score: %s" % score)
+                lines.append(str(newid))
+                lines.append("Date: %s" % new['date'])
+                lines.append("Title: %s" % new['title'])
+                lines.append("Keywords: %s" % new['keywords'])
+                lines.append(self.make_snippet(new, newid, terms))
+                if rank < len(shown):
+                    lines.append("--------------------")
+            else:
+                lines.append("#%d (%s) (%d) (%s) %s (%s)" % (rank, score, newid, new['date'],
+                                                             new['title'], new['keywords']))
+        lines.append("========================================")
+        return len(result), lines
 
         ########################################
         ## COMPLETAR PARA TODAS LAS VERSIONES ##
         ########################################
 
-    def rank_result(self, result, query):
+    def plan_batch(self, queries, jobs):
+        """
+        Reparte las queries distintas de "queries" en como mucho "jobs" grupos para self.solve_batch.
+
+        Las queries que comparten alguna subexpresion (ver subexpressions) se unen en una misma
+        componente y cada componente va entera a un grupo, de forma que la subexpresion se
+        resuelve una sola vez y el resto de queries la encuentran en la cache de su proceso.
+        Las componentes se asignan de mayor a menor al grupo con menos queries.
+
+        return: tupla (lista de grupos de queries, numero de subexpresiones compartidas,
+                maximo de subexpresiones distintas de un grupo)
+
+        """
+        unique = list(dict.fromkeys(query for query in queries if query))
+        keys = []
+        owner = {}
+        uses = Counter()
+        parent = list(range(len(unique)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for i, query in enumerate(unique):
+            tree = self.optimize_query(self.parse_query(query))
+            keys.append(subexpressions(tree) if tree is not None else set())
+            uses.update(keys[i])
+            for key in keys[i]:
+                parent[find(i)] = find(owner.setdefault(key, i))
+
+        components = {}
+        for i in range(len(unique)):
+            components.setdefault(find(i), []).append(i)
+        chunks = [[] for _ in range(max(1, min(jobs, len(components))))]
+        for component in sorted(components.values(), key=len, reverse=True):
+            min(chunks, key=len).extend(component)
+        chunks = [sorted(chunk) for chunk in chunks if chunk]
+        needed = max((len(set().union(*(keys[i] for i in chunk))) for chunk in chunks), default=0)
+        shared = sum(1 for n in uses.values() if n > 1)
+        return [[unique[i] for i in chunk] for chunk in chunks], shared, needed
+
+    def solve_chunk(self, queries, count_only):
+        """
+        Resuelve en orden un grupo de queries de self.solve_batch.
+
+        return: lista de tuplas (query, numero de resultados, lineas de self.show_lines o None, segundos)
+
+        """
+        answers = []
+        for query in queries:
+            t0 = time.perf_counter()
+            if count_only:
+                count, lines = len(self.solve_query(query)), None
+            else:
+                count, lines = self.show_lines(query)
+            answers.append((query, count, lines, time.perf_counter() - t0))
+        return answers
+
+    def solve_batch(self, filename, queries, jobs=1, count_only=True):
+        """
+        Resuelve una lista de queries (opciones -L y -T) de una vez: las queries repetidas se
+        resuelven una sola vez, las que comparten subexpresiones se agrupan (ver self.plan_batch)
+        y cada grupo se resuelve en un proceso de un pool que abre el mismo fichero de indice
+        con mmap. Con un solo proceso se resuelven en este objeto.
+
+        param:  "filename": fichero del indice cargado, para abrirlo en los procesos
+                "queries": lista de queries
+                "jobs": numero de procesos
+                "count_only": True si solo se necesita el numero de resultados
+
+        return: diccionario query --> (numero de resultados, lineas o None, segundos)
+
+        """
+        chunks, _, needed = self.plan_batch(queries, jobs)
+        options = self.search_options()
+        if options['cache']:
+            # que ninguna subexpresion compartida salga de la cache antes de reutilizarla
+            options['cache'] = max(options['cache'], needed)
+        if len(chunks) <= 1:
+            cache_size = self.cache_size
+            self.set_cache(options['cache'])
+            results = [self.solve_chunk(chunk, count_only) for chunk in chunks]
+            self.set_cache(cache_size)
+        else:
+            import multiprocessing
+            with multiprocessing.Pool(len(chunks), initializer=batch_init, initargs=(filename, options)) as pool:
+                results = pool.map(batch_solve, [(chunk, count_only) for chunk in chunks])
+        return {query: (count, lines, seconds) for chunk in results for query, count, lines, seconds in chunk}
+
+    def get_query_terms(self, query):
+        """
+        Devuelve los terminos (normalizados) de una query que se buscan en el cuerpo de la noticia,
+        sin conectivas, parentesis ni terminos de otros campos. Se usa para construir los snippets.
+
+        param:  "query": query tal y como la escribe el usuario
+
+        return: lista de terminos
+
+        """
+        terms = []
+        for token in self.query_tokenizer.findall(query):
+            if token in ('AND', 'OR', 'NOT', '(', ')'):
+                continue
+            prefix, sep, rest = token.partition(':')
+            if sep and prefix in self.field_names:
+                if prefix != 'article':
+                    continue
+                token = rest
+            terms.extend(self.tokenize(token))
+        return terms
+
+    def fetch_news(self, newid, bounds=True):
+        """
+        Devuelve los campos guardados de una noticia (ver read_store_record) leyendo solo su
+        registro del almacen de documentos. Los indices sin almacen leen el fichero JSON.
+
+        param:  "newid": identificador de la noticia
+                "bounds": si es False no se obtienen las posiciones de los tokens del cuerpo
+
+        return: diccionario con los campos STORED_FIELDS y 'bounds'
+
+        """
+        record = self.store[newid] if self.store is not None else b''
+        if record:
+            return read_store_record(record, bounds)
+        docid, pos = self.news[newid]
+        with open(self.docs[docid]) as fh:
+            new = json.load(fh)[pos]
+        if bounds:
+            new['bounds'] = array('I', self.tokenize_bounds(new['article'])[1])
+        return new
+
+    def make_snippet(self, new, newid, terms, context=5):
+        """
+        Construye el snippet de una noticia: un fragmento alrededor de la primera aparicion
+        de cada termino de la query, uniendo los fragmentos que se solapan.
+
+        Las apariciones se toman de las posiciones del indice posicional (o comparando los tokens
+        guardados si no es posicional) y los fragmentos se recortan del texto original con las
+        posiciones de los tokens del almacen de documentos, sin volver a tokenizar la noticia.
+
+        param:  "new": noticia devuelta por self.fetch_news
+                "newid": identificador de la noticia
+                "terms": terminos de la query
+                "context": numero de tokens que se muestran a cada lado del termino
+
+        return: cadena con el snippet
+
+        """
+        article, bounds = new['article'], new['bounds']
+        first = []
+        if self.positional and 'article' in self.index:
+            index = self.index['article']
+            for term in terms:
+                posting = index.get(term)
+                if posting is not None:
+                    i = bisect.bisect_left(posting.newids, newid)
+                    if i < len(posting.newids) and posting.newids[i] == newid:
+                        first.append(next(posting.iter_positions(i)) - 1)
+        else:
+            wanted = set(terms)
+            for position in range(len(bounds) // 2):
+                token = article[bounds[2 * position]:bounds[2 * position + 1]].lower()
+                if token in wanted:
+                    first.append(position)
+                    wanted.discard(token)
+                    if not wanted:
+                        break
+        windows = []
+        for position in sorted(set(first)):
+            start, end = max(position - context, 0), min(position + context + 1, len(bounds) // 2)
+            if windows and start <= windows[-1][1]:
+                windows[-1][1] = max(windows[-1][1], end)
+            else:
+                windows.append([start, end])
+        if not windows:
+            windows = [[0, min(2 * context + 1, len(bounds) // 2)]]
+        return ' ... '.join(' '.join(article[bounds[2 * start]:bounds[2 * end - 1]].split())
+                            for start, end in windows if start < end) + ' ...'
+
+    def rank_result(self, result, query, k=None):
         """
         NECESARIO PARA LA AMPLIACION DE RANKING
 
         Ordena los resultados de una query.
 
+        La puntuacion de una noticia es BM25: la suma de los impactos precalculados (self.weight)
+        de los terminos de la query que no estan negados, en el campo de cada termino, usando los
+        stems si hay stemming y los terminos de las frases sin stemming. Los comodines no puntuan.
+        Solo se calculan las "k" mejores noticias (ver top_k).
+
         param:  "result": lista de resultados sin ordenar
                 "query": query, puede ser la query original, la query procesada o una lista de terminos
+                "k": numero de noticias a devolver, self.SHOW_MAX por defecto
+
+
+        return: la lista de resultados ordenada, pares (newid, puntuacion) de las "k" mejores noticias
+
+        """
+        if k is None:
+            k = self.SHOW_MAX
+        lists = [(posting.newids,) + decode_impacts(self.weight[name][key])
+                 for name, key, posting in self.scoring_postings(self.optimize_query(self.parse_query(query)))]
+        scale = bm25_scale(len(self.news))
+        return [(newid, score / scale) for newid, score in top_k(as_array(result), lists, k)]
+
+    def scoring_stats(self, tree):
+        """
+        Estadisticas de este indice como shard de un ShardedProject para el ranking de una query
+        (ver ShardedProject.rank_result): numero de noticias con cada termino que puntua en el
+        arbol sintactico "tree" y (suma de longitudes, numero de noticias) de cada campo. Las de
+        los campos se dan aunque el shard no tenga los terminos, cuentan igual en la coleccion.
+
+        return: tupla (diccionario (clave en self.weight, termino o stem) --> df,
+                       diccionario campo --> (suma de longitudes, numero de noticias))
+
+        """
+        df = {(name, key): len(posting) for name, key, posting in self.scoring_postings(tree)}
+        for field, _ in self.indexed_fields:
+            if field not in self.bm25_cache:
+                self.bm25_cache[field] = self.length_stats(field)
+        return df, {field: self.bm25_cache[field] for field, _ in self.indexed_fields}
+
+    def rank_shard(self, result, tree, k, df, stats):
+        """
+        Ranking de este indice como shard de un ShardedProject: los impactos BM25 no son los
+        guardados sino que se calculan con las estadisticas de la coleccion completa, para que las
+        puntuaciones de todos los shards se puedan comparar.
+
+        param:  "result": array('I') ordenado con los newid (del shard) que cumplen la query
+                "tree": arbol sintactico optimizado de la query
+                "k": numero de noticias a devolver
+                "df": (clave en self.weight, termino o stem) --> df en toda la coleccion
+                "stats": campo --> (suma de longitudes, numero de noticias) de toda la coleccion
+
+        return: lista de pares (newid, puntuacion cuantizada con bm25_scale de toda la coleccion)
+
+        """
+        lists = []
+        for name, key, posting in self.scoring_postings(tree):
+            field = name[len('stem:'):] if name.startswith('stem:') else name
+            params = self.bm25_cache.get((field, stats[field]))
+            if params is None:
+                params = self.bm25_cache[field, stats[field]] = self.bm25_params(field, stats[field])
+            lists.append((posting.newids,) + decode_impacts(bm25_record(posting, *params, df=df[name, key])))
+        return top_k(result, lists, k)
+
+    def scoring_postings(self, tree):
+        """
+        Posting lists de los terminos que puntuan en el arbol sintactico "tree" (ver
+        self.scoring_terms), sin repetir y solo los que tienen impactos BM25 en el indice.
+
+        return: lista de tuplas (clave en self.weight, termino o stem, Posting)
+
+        """
+        postings = []
+        seen = set()
+        for name, key, index in self.scoring_terms(tree):
+            weights = self.weight.get(name)
+            posting = index.get(key)
+            if weights is None or posting is None or (name, key) in seen:
+                continue
+            seen.add((name, key))
+            postings.append((name, key, posting))
+        return postings
+
+    def scoring_terms(self, node, negated=False):
+        """
+        Recorre las hojas no negadas del arbol sintactico de una query.
+
+        return: generador de tuplas (clave en self.weight, termino o stem, indice donde buscarlo)
+
+        """
+        if node is None:
+            return
+        kind = node[0]
+        if kind == 'not':
+            yield from self.scoring_terms(node[1], not negated)
+        elif kind in ('and', 'or'):
+            for child in node[1]:
+                yield from self.scoring_terms(child, negated)
+        elif negated or kind in ('wildcard', 'range') or node[1] not in self.index:
+            return
+        elif kind == 'phrase':
+            for term in node[2]:
+                yield node[1], term, self.index[node[1]]
+        elif self.use_stemming:
+            stem, field = self.stem(node[2]), node[1]
+            sindex = self.sindex.get(field)
+            if sindex is None and isinstance(self.index[field], MappedIndex):
+                # indice guardado sin stemming: la posting list del stem se construye con los
+                # terminos del lexicon que tienen ese stem, como en get_stemming
+                index = self.index[field]
+                postings = [index.posting(i) for i in self.stem_positions(node[2], field)]
+                sindex = {stem: Posting.merge_tf(postings)} if postings else {}
+            elif sindex is None:
+                # indice creado sin stemming: get_stemming calcula los stems del campo
+                self.get_stemming(node[2], field)
+                sindex = self.sindex[field]
+            yield 'stem:' + field, stem, sindex
+        else:
+            yield node[1], node[2], self.index[node[1]]
+
 
+class ShardedProject(SAR_Project):
+    """
+    Indice dividido en shards por fecha (año, mes o dia del nombre de cada fichero de noticias).
+    Cada shard es un indice SAR_Project independiente con sus newid 0..n-1, que en el indice
+    completo empiezan en el "base" del shard; las bases siguen el orden de indexacion, por lo que
+    los newid son los mismos que en un indice sin shards.
+
+    El fichero de indice solo guarda la lista de shards (seccion 'shards', ver self.build) y
+    cada shard se abre la primera vez que una query lo necesita. Cada query se envia a la vez a
+    todos los shards que pueden tener resultados, saltando los que no por una restriccion 'date:'
+    (ver self.may_match), y los resultados se concatenan en el orden de los shards. Una noticia
+    esta en un solo shard, por lo que el resultado es el mismo que en el indice completo.
+
+    La evaluacion usa la CPU, por lo que los shards se resuelven en un pool de procesos (ver
+    self.fan_out) que abren los ficheros de los shards con mmap, como SAR_Project.solve_batch.
+
+    """
+
+    # componentes de la fecha YYYY-MM-DD del fichero que forman la clave de su shard
+    SHARD_KEYS = {'year': 1, 'month': 2, 'day': 3}
+
+    def __init__(self, filename=None, shards=(), options=None, workers=None):
+        super().__init__()
+        self.filename = filename
+        # shards --> diccionarios con 'key', 'file', 'base', 'news', 'docs' y 'dates'
+        # (fechas de sus noticias, None si no se ha indexado el campo 'date')
+        self.shards = [dict(shard, dates=None if shard['dates'] is None else set(shard['dates']))
+                       for shard in shards]
+        self.bases = [shard['base'] for shard in self.shards]
+        self.projects = [None] * len(self.shards)
+        # procesos de self.fan_out, se crean la primera vez que se usan
+        self.workers = workers or min(len(self.shards), os.cpu_count() or 1) or 1
+        self.pools = None
+        self.news_counter = sum(shard['news'] for shard in self.shards)
+        self.docid = sum(shard['docs'] for shard in self.shards)
+        if options is not None:
+            self.multifield = options['multifield']
+            self.positional = options['positional']
+            self.stemming = options['stem']
+            self.permuterm = options['permuterm']
+
+    @staticmethod
+    def shard_key(filename, shard):
+        """
+        Clave del shard de un fichero de noticias: el año, mes o dia de la fecha YYYY-MM-DD de su
+        nombre. Si el nombre no tiene fecha, el directorio que lo contiene.
+
+        """
+        match = re.search(r'(\d{4})-(\d{2})-(\d{2})', os.path.basename(filename))
+        if match is None:
+            return os.path.basename(os.path.dirname(filename))
+        return '-'.join(match.groups()[:ShardedProject.SHARD_KEYS[shard]])
+
+    @staticmethod
+    def build(root, filename, shard='month', **args):
+        """
+        Indexa el directorio "root" con un indice por shard, de uno en uno, y guarda cada shard en
+        "<filename>.<clave>" y la lista de shards en "filename".
+
+        param:  "root": directorio de noticias
+                "filename": fichero de indice
+                "shard": 'year', 'month' o 'day'
+                "args": opciones de indexacion, como en SAR_Project.index_dir
+
+        return: ShardedProject con los totales de la indexacion
+
+        """
+        groups = OrderedDict()
+        for fullname in news_files(root):
+            groups.setdefault(ShardedProject.shard_key(fullname, shard), []).append(fullname)
+
+        shards = []
+        base = tokens = 0
+        stemming_time = 0.0
+        stem_memo = {}
+        profile = Profile() if args.get('profile') else None
+        for key, filenames in groups.items():
+            project = SAR_Project()
+            project.set_profile(profile is not None)
+            project.set_index_options(args)
+            # los terminos que se repiten entre shards solo se pasan una vez por el stemmer
+            project.stem_memo = stem_memo
+            project.index_files(filenames, args.get('jobs') or 1)
+            project.save('%s.%s' % (filename, key))
+            dates = sorted(project.index['date']) if 'date' in project.index else None
+            shards.append({'key': key, 'file': '%s.%s' % (os.path.basename(filename), key), 'base': base,
+                           'news': project.news_counter, 'docs': project.docid, 'dates': dates})
+            base += project.news_counter
+            tokens += project.tokens_indexed
+            stemming_time += project.stemming_time
+            if profile is not None:
+                profile.merge(project.profile)
+
+        options = {name: bool(args.get(name)) for name in ('multifield', 'positional', 'stem', 'permuterm')}
+        writer = IndexWriter(filename)
+        writer.add('shards', json.dumps({'shard': shard, 'options': options, 'shards': shards}).encode('utf-8'))
+        writer.close()
+        sharded = ShardedProject(filename, shards, options)
+        sharded.tokens_indexed = tokens
+        sharded.stemming_time = stemming_time
+        # tiempos sumados de todos los shards, se muestran con show_stats
+        sharded.profile = profile
+        return sharded
+
+    @staticmethod
+    def open(filename, mm, sections):
+        """
+        Abre la lista de shards de un indice guardado con self.build, sin abrir los shards.
+
+        """
+        manifest = json.loads(mm[slice(*section_range(sections['shards']))])
+        return ShardedProject(filename, manifest['shards'], manifest['options'])
+
+    def project(self, i):
+        """
+        Devuelve el indice del shard "i", abriendolo la primera vez, con las opciones de busqueda
+        de este objeto.
+
+        """
+        project = self.projects[i]
+        if project is None:
+            project = self.projects[i] = self.timed_load("shard '%s'" % self.shards[i]['key'],
+                                                         lambda: SAR_Project.load(self.shard_file(i)))
+        options = self.search_options()
+        if project.search_options() != options:
+            project.set_search_options(options)
+        return project
+
+    def set_workers(self, v):
+        """
+        Cambia el numero de procesos con los que se resuelven los shards, 1 para resolverlos en
+        este proceso. Se cierran los procesos que hubiera.
+
+        """
+        self.shutdown()
+        self.workers = max(v, 1)
+
+    def shutdown(self):
+        """
+        Termina los procesos de self.fan_out.
+
+        """
+        if self.pools is not None:
+            for pool in self.pools:
+                pool.close()
+                pool.join()
+            self.pools = None
+
+    def fan_out(self, method, tasks):
+        """
+        Llama al metodo "method" del indice de cada shard con los argumentos de su tarea, a la vez
+        en todos los shards. El shard "i" se resuelve siempre en el proceso i % self.workers, de
+        forma que cada shard se abre en un solo proceso y su cache de subexpresiones se reutiliza
+        (ver shard_call). Los procesos de un pool (SAR_Server, SAR_Project.solve_batch) ya se
+        reparten las queries entre si, por lo que en ellos los shards se resuelven en el propio
+        proceso, como con un solo shard o un solo proceso.
+
+        param:  "method": nombre del metodo de SAR_Project
+                "tasks": lista de tuplas (shard, tupla de argumentos)
 
-        return: la lista de resultados ordenada
+        return: lista de resultados en el orden de "tasks"
 
         """
+        import multiprocessing
+        if len(tasks) <= 1 or self.workers <= 1 or multiprocessing.parent_process() is not None:
+            return [getattr(self.project(i), method)(*args) for i, args in tasks]
+        if self.pools is None:
+            self.pools = [multiprocessing.Pool(1) for _ in range(self.workers)]
+        options = self.search_options()
+        pending = [self.pools[i % self.workers].apply_async(shard_call, ((self.shard_file(i), options, method, args),))
+                   for i, args in tasks]
+        return [result.get() for result in pending]
+
+    def shard_file(self, i):
+        """
+        return: ruta del fichero del shard "i"
+
+        """
+        return os.path.join(os.path.dirname(self.filename), self.shards[i]['file'])
+
+    def shard_of(self, newid):
+        """
+        return: tupla (shard de la noticia "newid", newid dentro del shard)
+
+        """
+        i = bisect.bisect_right(self.bases, newid) - 1
+        return i, newid - self.bases[i]
+
+    def may_match(self, node, dates):
+        """
+        Decide si un nodo del arbol sintactico puede tener resultados en un shard con noticias de
+        las fechas "dates". Solo es False si una hoja 'date:' no coincide con ninguna fecha y el
+        operador que la contiene no puede tener resultados sin ella.
+
+        """
+        kind = node[0]
+        if kind == 'and':
+            return all(self.may_match(child, dates) for child in node[1])
+        if kind == 'or':
+            return any(self.may_match(child, dates) for child in node[1])
+        if kind == 'not' or kind == 'phrase' or node[1] != 'date' or dates is None:
+            return True
+        if kind == 'wildcard':
+            regex = wildcard_regex(node[2])
+            return any(regex.fullmatch(date) for date in dates)
+        if kind == 'range':
+            return any(in_date_range(date, *node[2]) for date in dates)
+        return node[2] in dates
+
+    def solve_query(self, query, prev={}):
+        """
+        Resuelve una query en los shards que pueden tener resultados y concatena sus resultados,
+        pasando los newid de cada shard al indice completo.
+
+        """
+        if query is None or len(query) == 0:
+            return []
+        tree = self.optimize_query(self.parse_query(query))
+        if tree is None:
+            return []
+        wanted = [i for i, shard in enumerate(self.shards)
+                  if shard['news'] and self.may_match(tree, shard['dates'])]
+        answer = array('I')
+        # el arbol no depende del indice, se analiza una sola vez para todos los shards
+        for i, result in zip(wanted, self.fan_out('solve_tree', [(i, (tree,)) for i in wanted])):
+            base = self.bases[i]
+            answer.extend(result if base == 0 else [newid + base for newid in result])
+        return answer
+
+    def rank_result(self, result, query, k=None):
+        """
+        Ordena los resultados de una query y se queda con las "k" mejores noticias de todos los
+        shards. Para que las puntuaciones se puedan comparar entre shards, los impactos BM25 no son
+        los guardados en cada shard sino que se calculan con las estadisticas de la coleccion
+        completa: numero de noticias, longitud media de cada campo y numero de noticias con cada
+        termino en todos los shards. Las puntuaciones son las del indice sin shards.
+
+        Se hace en dos pasos en todos los shards a la vez (ver self.fan_out): se recogen sus
+        estadisticas (SAR_Project.scoring_stats) y se ordenan sus resultados con las de la
+        coleccion (SAR_Project.rank_shard).
+
+        """
+        if k is None:
+            k = self.SHOW_MAX
+        result = as_array(result)
+        tree = self.optimize_query(self.parse_query(query))
+        # el df de cada termino se suma en todos los shards, tengan o no resultados
+        live = [i for i, shard in enumerate(self.shards) if shard['news']]
+        df, stats = {}, {}
+        for shard_df, shard_stats in self.fan_out('scoring_stats', [(i, (tree,)) for i in live]):
+            for key, count in shard_df.items():
+                df[key] = df.get(key, 0) + count
+            for field, (total, n) in shard_stats.items():
+                old_total, old_n = stats.get(field, (0, 0))
+                stats[field] = (old_total + total, old_n + n)
+        # todos los campos tienen el mismo numero de noticias, el de la coleccion
+        scale = bm25_scale(next(iter(stats.values()))[1]) if stats else 1.0
+
+        tasks = []
+        for i in live:
+            base = self.bases[i]
+            lo = bisect.bisect_left(result, base)
+            hi = bisect.bisect_left(result, base + self.shards[i]['news'])
+            if lo < hi:
+                local = array('I', [newid - base for newid in result[lo:hi]])
+                tasks.append((i, (local, tree, k, df, stats)))
+        ranked = []
+        for (i, _), items in zip(tasks, self.fan_out('rank_shard', tasks)):
+            base = self.bases[i]
+            ranked.extend((newid + base, score / scale) for newid, score in items)
+        ranked.sort(key=lambda item: (-item[1], item[0]))
+        return ranked[:k]
+
+    def fetch_news(self, newid, bounds=True):
+        i, local = self.shard_of(newid)
+        return self.project(i).fetch_news(local, bounds)
+
+    def make_snippet(self, new, newid, terms, context=5):
+        i, local = self.shard_of(newid)
+        return self.project(i).make_snippet(new, local, terms, context)
+
+    def cache_stats(self):
+        """
+        Resumen de aciertos y fallos de las caches de subexpresiones de los shards abiertos, en
+        este proceso o en los de self.fan_out.
+
+        """
+        # un shard puede estar abierto aqui (queries de un solo shard, noticias que se muestran)
+        # y en un proceso a la vez: se cuenta una vez con la suma de sus caches
+        counts = [{self.shard_file(i): (project.cache_hits, project.cache_misses, len(project.cache))
+                   for i, project in enumerate(self.projects) if project is not None}]
+        if self.pools is not None:
+            counts.extend(pool.apply(shard_cache_counts) for pool in self.pools)
+        opened = set().union(*counts)
+        hits, misses, entries = (sum(count[j] for shards in counts for count in shards.values()) for j in range(3))
+        lookups = hits + misses
+        return "Query cache: %d hits, %d misses (%.1f%% hit rate), %d entries in %d/%d open shards" % (
+            hits, misses, 100 * hits / lookups if lookups else 0, entries, len(opened), len(self.shards))
 
-        pass
+    def show_stats(self):
+        """
+        Muestra las estadisticas de cada shard y las del indice completo.
 
-        ###################################################
-        ## COMPLETAR PARA FUNCIONALIDAD EXTRA DE RANKING ##
-        ###################################################
+        """
+        fields = ['article'] if not self.multifield else self.field_names
+        terms = {field: set() for field in fields}
+        print("========================================")
+        print("Number of shards: %d" % len(self.shards))
+        for i, shard in enumerate(self.shards):
+            project = self.project(i)
+            for field in fields:
+                terms[field].update(project.index[field])
+            print("\t'%s': %d days, %d news, %d tokens in 'article'" % (
+                shard['key'], shard['docs'], shard['news'], len(project.index['article'])))
+        print("----------------------------------------")
+        print("Number of indexed days: %d" % self.docid)
+        print("----------------------------------------")
+        print("Number of indexed news: %d" % self.news_counter)
+        print("----------------------------------------")
+        print("TOKENS:")
+        for field in fields:
+            print("\t# of tokens in '%s': %d" % (field, len(terms[field])))
+        print("----------------------------------------")
+        if self.positional:
+            print("Positional queries are allowed.")
+        else:
+            print("Positional queries are NOT allowed.")
+        if self.profile is not None:
+            print("----------------------------------------")
+            self.show_profile()
+        print("========================================")